@@ -5,8 +5,8 @@ from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import RedirectResponse, JSONResponse
 from typing import Optional
 import logging
-from app.utils.api_recorder import verify_and_record_api_call
-from .core import get_bing_wallpaper_url, API_ID
+from app.utils.latency import run_upstream
+from .core import get_bing_wallpaper_url
 
 logger = logging.getLogger(__name__)
 
@@ -19,11 +19,7 @@ async def get_bing_wallpaper(
 ):
 
     try:
-        # 验证API密钥并记录调用 - 从请求中自动提取，验证失败直接抛出异常，不统计
-        subscription = verify_and_record_api_call(api_id=API_ID, request=request)
-        
-
-        img_url = get_bing_wallpaper_url()
+        img_url = await run_upstream(get_bing_wallpaper_url)
 
         if type == 'img':
             return RedirectResponse(url=img_url, status_code=302)
@@ -38,7 +34,7 @@ async def get_bing_wallpaper(
             )
             
     except HTTPException as e:
-        # API密钥验证失败不统计，直接抛出异常
+        # 已知错误直接抛出
         raise
     except Exception as e:
         logger.error(f"Bing API调用失败: {e}")
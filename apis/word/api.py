@@ -5,8 +5,8 @@ from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from typing import Optional
 import logging
-from app.utils.api_recorder import verify_and_record_api_call
-from .core import query_unipus_word, API_ID
+from app.utils.latency import run_upstream
+from .core import query_unipus_word
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +19,7 @@ async def search_word(
     word: Optional[str] = Query(None, description="要查询的单词")
 ):
     try:
-        # 验证API密钥并记录调用（若为免费API则只统计，不校验密钥）
-        verify_and_record_api_call(api_id=API_ID, request=request)
-
-        result = query_unipus_word(word or "")
+        result = await run_upstream(query_unipus_word, word or "")
         code = (result or {}).get("code", 500)
         status = 200 if code in (200, 201) else 500
         return JSONResponse(status_code=status, content=result or {"code":500, "list":None, "msg":"服务异常"})
@@ -1,7 +1,7 @@
 import requests
 from typing import Any, Dict, Optional
 
-API_ID = 7
+API_ALIAS = "word"
 
 
 def query_unipus_word(name: str, timeout: float = 10.0) -> Optional[Dict[str, Any]]:
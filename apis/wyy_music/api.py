@@ -5,8 +5,8 @@ from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from typing import Optional
 import logging
-from app.utils.api_recorder import verify_and_record_api_call
-from .core import resolve_music_direct_url, API_ID
+from app.utils.latency import run_upstream
+from .core import resolve_music_direct_url
 
 logger = logging.getLogger(__name__)
 
@@ -23,10 +23,7 @@ async def get_music_url(
     - 失败: { code:201/202/500, music_id, src:null, msg }
     """
     try:
-        # 支持免费API：内部函数会判断是否免费，免费则不需要apiKey
-        verify_and_record_api_call(api_id=API_ID, request=request)
-
-        result = resolve_music_direct_url(id)
+        result = await run_upstream(resolve_music_direct_url, id)
         return JSONResponse(status_code=200, content=result)
     except HTTPException:
         raise
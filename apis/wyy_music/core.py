@@ -4,7 +4,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-API_ID = 6
+API_ALIAS = "wyy_music"
 
 
 def resolve_music_direct_url(song_id: str) -> Dict[str, Optional[str]]:
@@ -5,8 +5,8 @@ from fastapi import APIRouter, HTTPException, Query, Request
 from fastapi.responses import PlainTextResponse, JSONResponse
 from typing import Optional
 import logging
-from app.utils.api_recorder import verify_and_record_api_call
-from .core import format_hitokoto_response, API_ID
+from app.utils.latency import run_upstream
+from .core import format_hitokoto_response
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +28,8 @@ async def get_hitokoto(
     """
     
     try:
-        # 验证API密钥并记录调用 - 从请求中自动提取，验证失败直接抛出异常，不统计
-        subscription = verify_and_record_api_call(api_id=API_ID, request=request)
-        
         # 获取一言数据
-        hitokoto_data = format_hitokoto_response(type or 'json')
+        hitokoto_data = await run_upstream(format_hitokoto_response, type or 'json')
         
         if not hitokoto_data or hitokoto_data.get('code') == 500:
             raise HTTPException(
@@ -60,7 +57,7 @@ async def get_hitokoto(
             )
             
     except HTTPException as e:
-        # API密钥验证失败不统计，直接抛出异常
+        # 已知错误直接抛出
         raise
     except Exception as e:
         logger.error(f"YiYan API调用失败: {e}")
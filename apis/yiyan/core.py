@@ -2,7 +2,7 @@ import random
 import os
 from typing import Optional, Dict, Any
 
-API_ID = 3
+API_ALIAS = "yiyan"
 
 
 def get_hitokoto_text() -> Optional[Dict[str, Any]]:
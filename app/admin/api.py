@@ -3,11 +3,14 @@ from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, text, cast
 from sqlalchemy.types import String
 from typing import List, Optional
-from datetime import datetime
-from app.database import get_db
+from datetime import datetime, timedelta, timezone
+from app.database import get_db, get_read_db
 from app.auth import get_current_admin_user, get_admin_only, get_admin_module_access
 from . import crud, schemas, models
 from app.cache import cache_manager
+from app.utils import call_counter, invalidation, key_principal, latency, usage_rollup
+from app.utils.concurrency import run_sync
+from app.utils.pagination import paginate
 import logging
 from app.utils.operation_logger import log_action
 from app.utils.webconfig_manager import get_config, ConfigKeys
@@ -109,6 +112,9 @@ async def get_users(
     keyword: Optional[str] = Query(None, description="搜索关键词"),
     is_active: Optional[bool] = Query(None, description="是否激活"),
     is_admin: Optional[bool] = Query(None, description="是否管理员"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 skip"),
+    with_total: bool = Query(True, description="是否统计总数，深分页时可关闭"),
+    estimate_total: bool = Query(False, description="无筛选条件时使用表统计信息估算总数"),
     current_admin: models.User = Depends(get_admin_module_access),
     db: Session = Depends(get_db)
 ):
@@ -126,11 +132,9 @@ async def get_users(
         if is_admin is not None:
             query = query.filter(models.User.is_admin == is_admin)
 
-        # 总数为满足条件的全部用户数
-        total = query.count()
-
-        # 分页取当前页数据
-        users = query.offset(skip).limit(limit).all()
+        # 分页取当前页数据（按注册时间倒序，总数为满足条件的全部用户数）
+        result = paginate(query, models.User, limit, skip, cursor, with_total, estimate_total)
+        users = result.items
 
         # 批量统计扩展字段（订单数、订阅数、最后登录时间）
         user_ids = [u.id for u in users]
@@ -170,10 +174,12 @@ async def get_users(
                 "created_at": user.created_at,
                 "updated_at": user.updated_at
             } for user in users],
-            total=total,
-            page=skip // limit + 1,
+            total=result.total,
+            page=None if cursor else skip // limit + 1,
             size=limit,
-            pages=(total + limit - 1) // limit
+            pages=None if result.total is None else (result.total + limit - 1) // limit,
+            next_cursor=result.next_cursor,
+            total_estimated=result.estimated
         )
     except HTTPException:
         # 重新抛出HTTP异常，保持原始状态码
@@ -231,6 +237,7 @@ async def update_user(
         
         # 清除相关缓存
         cache_manager.clear_pattern(f"user:*{user_id}*")
+        key_principal.invalidate_user(user_id)
         
         # 写管理日志
         try:
@@ -282,6 +289,7 @@ async def delete_user(
         if crud.UserCRUD.delete(db, user_id):
             # 清除相关缓存
             cache_manager.clear_pattern(f"user:*{user_id}*")
+            key_principal.invalidate_user(user_id)
             
             # 写管理日志
             try:
@@ -351,6 +359,7 @@ async def toggle_user_status(
         
         # 清除相关缓存
         cache_manager.clear_pattern(f"user:*{user_id}*")
+        key_principal.invalidate_user(user_id)
         
         return schemas.ResponseModel(
             success=True,
@@ -476,11 +485,13 @@ async def get_apis_admin(
             apis = apis.filter(models.API.is_public == is_public)
         
         total = apis.count()
-        apis = apis.options(joinedload(models.API.category)).offset(skip).limit(limit).all()
+        apis = apis.add_columns(call_counter.total_calls_expr()).options(
+            joinedload(models.API.category)
+        ).offset(skip).limit(limit).all()
         
         # 转换为响应格式
         items = []
-        for api in apis:
+        for api, calls in apis:
             api_dict = {
                 "id": api.id,
                 "title": api.title,
@@ -498,7 +509,7 @@ async def get_apis_admin(
                 "is_active": api.is_active,
                 "is_public": api.is_public,
                 "is_free": api.is_free,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "category_id": api.category_id,
                 "category": api.category.name if api.category else None,
                 "tags": api.tags or "[]",
@@ -506,6 +517,7 @@ async def get_apis_admin(
                 "price_type": api.price_type.value if api.price_type else "per_call",
                 "version": api.version or "1.0.0",
                 "deprecated": api.deprecated,
+                "rate_limit_per_minute": api.rate_limit_per_minute,
                 "created_at": api.created_at,
                 "updated_at": api.updated_at
             }
@@ -563,6 +575,7 @@ async def create_api_admin(
         
         # 清除相关缓存
         cache_manager.clear_pattern("api:*")
+        invalidation.publish("api", db_api.id)
         
         # 日志
         try:
@@ -649,6 +662,7 @@ async def update_api_admin(
         # 清除相关缓存
         cache_manager.clear_pattern(f"api:*{api_id}*")
         cache_manager.clear_pattern("api:*")
+        key_principal.invalidate_api(api_id)
         
         # 日志
         try:
@@ -694,6 +708,7 @@ async def delete_api_admin(
             # 清除相关缓存
             cache_manager.clear_pattern(f"api:*{api_id}*")
             cache_manager.clear_pattern("api:*")
+            key_principal.invalidate_api(api_id)
             
             try:
                 log_action(db,
@@ -748,6 +763,7 @@ async def toggle_api_status_admin(
         # 清除相关缓存
         cache_manager.clear_pattern(f"api:*{api_id}*")
         cache_manager.clear_pattern("api:*")
+        key_principal.invalidate_api(api_id)
         
         try:
             log_action(db,
@@ -785,7 +801,7 @@ async def toggle_api_status_admin(
 @router.get("/stats", response_model=schemas.APIStats)
 async def get_admin_stats(
     current_admin: models.User = Depends(get_admin_module_access),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """获取管理统计信息"""
     try:
@@ -796,10 +812,8 @@ async def get_admin_stats(
         total_apis = db.query(models.API).count()
         active_apis = db.query(models.API).filter(models.API.is_active == True).count()
         
-        # 获取总调用次数
-        total_calls = db.query(models.API).with_entities(
-            func.sum(models.API.call_count)
-        ).scalar() or 0
+        # 获取总调用次数（含尚未合并的分片计数）
+        total_calls = db.scalar(call_counter.total_calls_sum()) or 0
         
         # 获取订单总数
         total_orders = db.query(models.Order).count()
@@ -861,7 +875,7 @@ async def get_admin_stats(
 async def get_user_growth_stats(
     days: int = Query(7, ge=1, le=30, description="统计天数"),
     current_admin: models.User = Depends(get_admin_module_access),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """获取用户增长趋势数据"""
     try:
@@ -919,15 +933,16 @@ async def get_user_growth_stats(
 @router.get("/stats/api-usage")
 async def get_api_usage_stats(
     current_admin: models.User = Depends(get_admin_module_access),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """获取API使用情况统计（按API聚合）"""
     try:
-        # 按API聚合调用次数，取前10
+        # 按API聚合调用次数（含尚未合并的分片计数），取前10
+        total_calls = call_counter.total_calls_expr().label('total_calls')
         api_usage = db.query(
             models.API.title.label('api_title'),
-            models.API.call_count.label('total_calls')
-        ).order_by(models.API.call_count.desc())\
+            total_calls
+        ).order_by(total_calls.desc())\
          .limit(10).all()
 
         # 转换为图表数据格式
@@ -965,24 +980,59 @@ async def get_api_usage_stats(
 async def get_api_performance_stats(
     days: int = Query(7, ge=1, le=30, description="统计天数"),
     current_admin: models.User = Depends(get_admin_module_access),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """获取API调用汇总统计（精简版）
+    """获取API调用汇总统计
 
-    说明：不再依赖 APILog 明细表统计成功次数、成功率、平均响应时间、今日/本月调用。
-    仅返回所有 API 在 apis.call_count 字段上的总和。
+    基于时间分桶汇总表（api_usage_rollups）：统计周期、今日、本月的调用次数、成功率与平均响应时间，
+    以及最近24小时各API的调用量。今日/本月按UTC自然日、自然月计算。
     """
     try:
-        # 基于 API 表的调用累计计数汇总
-        total_calls = db.query(models.API).with_entities(
-            func.sum(models.API.call_count)
-        ).scalar() or 0
+        now = datetime.now(timezone.utc)
+        today = usage_rollup.bucket_start(now, usage_rollup.DAY)
+        month_start = today.replace(day=1)
+
+        period = usage_rollup.get_totals(db, today - timedelta(days=days - 1), usage_rollup.DAY)
+        today_calls = usage_rollup.get_totals(db, today, usage_rollup.DAY)["total_calls"]
+        month_calls = usage_rollup.get_totals(db, month_start, usage_rollup.DAY)["total_calls"]
+
+        last_24h = usage_rollup.get_by_api(
+            db, usage_rollup.bucket_start(now - timedelta(hours=24), usage_rollup.HOUR), usage_rollup.HOUR
+        )
+        apis = {}
+        if last_24h:
+            apis = {
+                row.id: row for row in db.query(models.API.id, models.API.title, models.API.alias).filter(
+                    models.API.id.in_(list(last_24h))
+                ).all()
+            }
+        last_24h_items = sorted(
+            (
+                {
+                    "api_id": api_id,
+                    "api_title": apis[api_id].title if api_id in apis else None,
+                    "api_alias": apis[api_id].alias if api_id in apis else None,
+                    **stats,
+                }
+                for api_id, stats in last_24h.items()
+            ),
+            key=lambda item: item["total_calls"],
+            reverse=True
+        )
+
+        # 汇总表上线前的历史调用只记录在 apis.call_count 中
+        cumulative_calls = db.scalar(call_counter.total_calls_sum()) or 0
 
         return schemas.ResponseModel(
             success=True,
             message="获取API调用汇总成功",
             data={
-                "total_calls": int(total_calls)
+                **period,
+                "period_days": days,
+                "today_calls": today_calls,
+                "month_calls": month_calls,
+                "cumulative_calls": int(cumulative_calls),
+                "last_24h": last_24h_items
             }
         )
 
@@ -993,6 +1043,31 @@ async def get_api_performance_stats(
             detail="获取API调用汇总失败"
         )
 
+@router.get("/stats/latency")
+async def get_latency_stats(
+    hours: int = Query(1, ge=1, le=latency.RETENTION_HOURS, description="统计最近几个小时（含当前小时）"),
+    alias: Optional[str] = Query(None, description="API别名，为空统计全部"),
+    current_admin: models.User = Depends(get_admin_module_access)
+):
+    """获取开放API分阶段延迟分位数（auth / upstream / serialization / total 的 p50/p95/p99）"""
+    try:
+        stats = await run_sync(latency.get_histograms, hours, alias)
+        return schemas.ResponseModel(
+            success=True,
+            message="获取延迟统计成功",
+            data={
+                "hours": hours,
+                "phases": list(latency.PHASES),
+                "apis": stats
+            }
+        )
+    except Exception as e:
+        logger.error(f"获取延迟统计失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="获取延迟统计失败"
+        )
+
 @router.get("/system/status")
 async def get_system_status(
     current_admin: models.User = Depends(get_admin_module_access),
@@ -1137,6 +1212,7 @@ async def create_category_admin(
         
         # 创建分类
         db_category = crud.CategoryCRUD.create(db, category.dict())
+        invalidation.publish("category", db_category.id)
         
         return schemas.ResponseModel(
             success=True,
@@ -1185,6 +1261,7 @@ async def update_category_admin(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="分类不存在"
             )
+        invalidation.publish("category", category_id)
         
         try:
             log_action(db,
@@ -1222,6 +1299,7 @@ async def delete_category_admin(
     """删除分类（管理员）"""
     try:
         if crud.CategoryCRUD.delete(db, category_id):
+            invalidation.publish("category", category_id)
             try:
                 log_action(db,
                     actor_id=current_admin.id,
@@ -1282,11 +1360,11 @@ async def get_category_apis_admin(
         )
         
         total = apis.count()
-        apis = apis.offset(skip).limit(limit).all()
+        apis = apis.add_columns(call_counter.total_calls_expr()).offset(skip).limit(limit).all()
         
         # 转换为响应格式
         items = []
-        for api in apis:
+        for api, calls in apis:
             api_dict = {
                 "id": api.id,
                 "title": api.title,
@@ -1304,7 +1382,7 @@ async def get_category_apis_admin(
                 "is_active": api.is_active,
                 "is_public": api.is_public,
                 "is_free": api.is_free,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "category_id": api.category_id,
                 "category": api.category.name if api.category else None,
                 "tags": api.tags or "[]",
@@ -1312,6 +1390,7 @@ async def get_category_apis_admin(
                 "price_type": api.price_type.value if api.price_type else "per_call",
                 "version": api.version or "1.0.0",
                 "deprecated": api.deprecated,
+                "rate_limit_per_minute": api.rate_limit_per_minute,
                 "created_at": api.created_at,
                 "updated_at": api.updated_at
             }
@@ -1344,6 +1423,9 @@ async def get_orders_admin(
     api_id: Optional[int] = Query(None, description="API ID筛选"),
     start_date: Optional[str] = Query(None, description="开始日期"),
     end_date: Optional[str] = Query(None, description="结束日期"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 skip"),
+    with_total: bool = Query(True, description="是否统计总数，深分页时可关闭"),
+    estimate_total: bool = Query(False, description="无筛选条件时使用表统计信息估算总数"),
     current_admin: models.User = Depends(get_admin_module_access),
     db: Session = Depends(get_db)
 ):
@@ -1364,8 +1446,8 @@ async def get_orders_admin(
         if end_date:
             orders = orders.filter(models.Order.created_at <= end_date)
         
-        total = orders.count()
-        orders = orders.order_by(models.Order.created_at.desc()).offset(skip).limit(limit).all()
+        result = paginate(orders, models.Order, limit, skip, cursor, with_total, estimate_total)
+        orders = result.items
         
         # 转换为响应格式
         items = []
@@ -1393,10 +1475,12 @@ async def get_orders_admin(
         
         return schemas.PaginatedResponse(
             items=items,
-            total=total,
-            page=skip // limit + 1,
+            total=result.total,
+            page=None if cursor else skip // limit + 1,
             size=limit,
-            pages=(total + limit - 1) // limit
+            pages=None if result.total is None else (result.total + limit - 1) // limit,
+            next_cursor=result.next_cursor,
+            total_estimated=result.estimated
         )
     except HTTPException:
         # 重新抛出HTTP异常，保持原始状态码
@@ -1584,27 +1668,8 @@ async def clear_all_cache(
 ):
     """清除系统缓存（保留用户登录状态）"""
     try:
-        # 明确指定要清除的缓存类型，避免使用通配符*
-        cache_patterns = [
-            "api:*",           # API相关缓存
-            "category:*",      # 分类缓存
-            "order:*",         # 订单缓存
-            "webconfig*",      # 网站配置缓存
-            "stats:*",         # 统计缓存
-        ]
-        
-        total_cleared = 0
-        for pattern in cache_patterns:
-            cleared = cache_manager.clear_pattern(pattern)
-            total_cleared += cleared
-            logger.info(f"清除缓存模式 {pattern}: {cleared} 个键")
-        
-        # 清除用户信息缓存，但保留token缓存
-        user_cache_keys = cache_manager.redis.keys("user:*")
-        for key in user_cache_keys:
-            if not key.decode('utf-8').startswith("token:"):
-                cache_manager.redis.delete(key)
-                total_cleared += 1
+        # 只清除缓存类型的键（见 app.cache.CACHE_PATTERNS），登录Token、调用计数缓冲、配额等不受影响
+        total_cleared = cache_manager.clear_all()
         
         try:
             log_action(db=None,
@@ -1742,6 +1807,7 @@ async def create_webconfig(
         
         # 清除相关缓存
         cache_manager.clear_pattern("webconfig*")
+        invalidation.publish("webconfig")
         
         return config
     except HTTPException:
@@ -1771,6 +1837,7 @@ async def update_webconfig(
         
         # 清除相关缓存
         cache_manager.clear_pattern("webconfig*")
+        invalidation.publish("webconfig")
         
         try:
             log_action(db,
@@ -1817,6 +1884,7 @@ async def update_webconfig_by_key(
         
         # 清除相关缓存
         cache_manager.clear_pattern("webconfig*")
+        invalidation.publish("webconfig")
         
         try:
             log_action(db,
@@ -1856,6 +1924,7 @@ async def delete_webconfig(
         
         # 清除相关缓存
         cache_manager.clear_pattern("webconfig*")
+        invalidation.publish("webconfig")
         
         try:
             log_action(db,
@@ -1899,6 +1968,7 @@ async def delete_webconfig_by_key(
         
         # 清除相关缓存
         cache_manager.clear_pattern("webconfig*")
+        invalidation.publish("webconfig")
         
         try:
             log_action(db,
@@ -1959,6 +2029,9 @@ async def get_system_logs(
     end_time: Optional[str] = Query(None, description="结束时间 YYYY-MM-DD 或 ISO8601"),
     metadata_keyword: Optional[str] = Query(None, description="元数据模糊查询"),
     keyword: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 skip"),
+    with_total: bool = Query(True, description="是否统计总数，深分页时可关闭"),
+    estimate_total: bool = Query(False, description="无筛选条件时使用表统计信息估算总数"),
     current_admin: models.User = Depends(get_admin_module_access),
     db: Session = Depends(get_db)
 ):
@@ -2020,8 +2093,8 @@ async def get_system_logs(
             like = f"%{metadata_keyword}%"
             q = q.filter(cast(models.SystemLog.meta, String).like(like))
 
-        total = q.count()
-        logs = q.order_by(models.SystemLog.created_at.desc()).offset(skip).limit(limit).all()
+        result = paginate(q, models.SystemLog, limit, skip, cursor, with_total, estimate_total)
+        logs = result.items
 
         items = []
         for log in logs:
@@ -2041,11 +2114,15 @@ async def get_system_logs(
 
         return schemas.PaginatedResponse(
             items=items,
-            total=total,
-            page=skip // limit + 1,
+            total=result.total,
+            page=None if cursor else skip // limit + 1,
             size=limit,
-            pages=(total + limit - 1) // limit
+            pages=None if result.total is None else (result.total + limit - 1) // limit,
+            next_cursor=result.next_cursor,
+            total_estimated=result.estimated
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取系统日志失败: {e}")
         raise HTTPException(
@@ -3,6 +3,7 @@ from sqlalchemy import func, desc
 from typing import List, Optional
 from datetime import datetime, timedelta
 from . import models
+from app.utils import call_counter
 
 class UserCRUD:
     """用户CRUD操作"""
@@ -222,7 +223,7 @@ class APICRUD:
         """获取API统计信息"""
         total_apis = db.query(models.API).count()
         active_apis = db.query(models.API).filter(models.API.is_active == True).count()
-        total_calls = db.query(func.sum(models.API.call_count)).scalar() or 0
+        total_calls = db.scalar(call_counter.total_calls_sum()) or 0
         
         return {
             "total_apis": total_apis,
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Float, JSON, Enum
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, Boolean, ForeignKey, Float, JSON, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -93,7 +93,10 @@ class API(Base):
     # 版本信息
     version = Column(String(20), default="1.0.0", comment="接口版本")
     deprecated = Column(Boolean, default=False, comment="是否已废弃")
-    
+
+    # 频率限制
+    rate_limit_per_minute = Column(Integer, nullable=True, comment="每个调用方每分钟调用上限（为空使用全局配置）")
+
     # 关联信息
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -101,6 +104,11 @@ class API(Base):
     orders = relationship("Order", back_populates="api")
     subscriptions = relationship("Subscription", back_populates="api")
 
+    __table_args__ = (
+        # 前台列表/热门排序：is_active + is_public 过滤后按 call_count 排序
+        Index("ix_apis_active_public_calls", "is_active", "is_public", "call_count"),
+    )
+
 # APIPricing 模型已删除，价格信息现在直接存储在 API 模型中
 
 class Subscription(Base):
@@ -137,6 +145,16 @@ class Subscription(Base):
     api = relationship("API", back_populates="subscriptions")
     # pricing = relationship("APIPricing")  # APIPricing模型已删除
 
+    __table_args__ = (
+        # 购买、更新密钥：按 用户 + API + 状态 查找订阅
+        Index("ix_subscriptions_user_api_status", "user_id", "api_id", "status"),
+        # 密钥验证：按 api_key 查找时只读索引即可得到鉴权所需的列
+        Index(
+            "ix_subscriptions_key_cover",
+            "api_key", "status", "end_date", "remaining_calls", "user_id", "api_id"
+        ),
+    )
+
 class SystemLog(Base):
     """系统操作日志"""
     __tablename__ = "system_logs"
@@ -165,6 +183,11 @@ class SystemLog(Base):
     # 关系
     actor = relationship("User")
 
+    __table_args__ = (
+        # 用户最后登录时间、按操作者和动作筛选日志
+        Index("ix_system_logs_actor_action_created", "actor_id", "action", "created_at"),
+    )
+
 class Order(Base):
     """订单模型"""
     __tablename__ = "orders"
@@ -197,6 +220,11 @@ class Order(Base):
     api = relationship("API", back_populates="orders")
     # pricing = relationship("APIPricing")  # APIPricing模型已删除
 
+    __table_args__ = (
+        # 用户订单列表：按用户过滤、按创建时间排序
+        Index("ix_orders_user_created", "user_id", "created_at"),
+    )
+
 
 class APICategory(Base):
     """API分类模型"""
@@ -223,3 +251,69 @@ class WebConfig(Base):
     v = Column(Text, nullable=False, comment="配置值")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), comment="创建时间")
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), comment="更新时间")
+
+
+class UsageFlushBatch(Base):
+    """调用计数刷写批次（用于保证Redis计数刷写到MySQL不重复）"""
+    __tablename__ = "usage_flush_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(String(64), unique=True, nullable=False, comment="刷写批次ID")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class APICallLog(Base):
+    """开放API调用明细日志（由后台批量写入）"""
+    __tablename__ = "api_call_logs"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    api_id = Column(Integer, nullable=False, comment="API ID")
+    subscription_id = Column(Integer, nullable=True, comment="订阅ID（免费API为空）")
+    user_id = Column(Integer, nullable=True, index=True, comment="用户ID（免费API为空）")
+
+    method = Column(String(10), comment="请求方式")
+    path = Column(String(500), comment="请求路径")
+    status_code = Column(Integer, comment="响应状态码")
+    latency_ms = Column(Float, comment="耗时（毫秒）")
+    response_bytes = Column(Integer, comment="响应字节数")
+    client_ip = Column(String(50), comment="客户端IP")
+
+    created_at = Column(DateTime(timezone=True), nullable=False, index=True, comment="调用时间（UTC）")
+
+    __table_args__ = (
+        Index("ix_api_call_logs_api_created", "api_id", "created_at"),
+    )
+
+
+class APIUsageRollup(Base):
+    """API调用量时间分桶汇总（分钟/小时/天），由使用事件增量维护"""
+    __tablename__ = "api_usage_rollups"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    granularity = Column(String(10), nullable=False, comment="粒度：minute/hour/day")
+    bucket_start = Column(DateTime(timezone=True), nullable=False, comment="分桶起始时间（UTC）")
+    api_id = Column(Integer, nullable=False, comment="API ID")
+    subscription_id = Column(Integer, nullable=False, default=0, comment="订阅ID（0 表示该API的整体汇总）")
+
+    calls = Column(Integer, nullable=False, default=0, comment="调用次数")
+    success_calls = Column(Integer, nullable=False, default=0, comment="成功次数（状态码 < 400）")
+    error_calls = Column(Integer, nullable=False, default=0, comment="失败次数")
+    latency_ms_sum = Column(Float, nullable=False, default=0.0, comment="耗时合计（毫秒）")
+    response_bytes_sum = Column(BigInteger, nullable=False, default=0, comment="响应字节数合计")
+
+    __table_args__ = (
+        Index(
+            "ux_api_usage_rollups_bucket",
+            "granularity", "subscription_id", "bucket_start", "api_id",
+            unique=True
+        ),
+    )
+
+
+class APICallCounter(Base):
+    """API调用次数分片计数（写入随机分片，避免所有调用争用 apis.call_count 同一行；定期合并回 apis.call_count）"""
+    __tablename__ = "api_call_counters"
+
+    api_id = Column(Integer, primary_key=True, autoincrement=False, comment="API ID")
+    shard = Column(Integer, primary_key=True, autoincrement=False, comment="分片序号")
+    count = Column(BigInteger, nullable=False, default=0, comment="尚未合并到 apis.call_count 的调用次数")
@@ -139,6 +139,9 @@ class APIBase(BaseModel):
     version: str = Field("1.0.0", description="接口版本")
     deprecated: bool = Field(False, description="是否已废弃")
 
+    # 频率限制
+    rate_limit_per_minute: Optional[int] = Field(None, ge=1, description="每个调用方每分钟调用上限（为空使用全局配置）")
+
 class APICreate(APIBase):
     pass
 
@@ -164,6 +167,7 @@ class APIUpdate(BaseModel):
     price_type: Optional[PriceType] = None
     version: Optional[str] = None
     deprecated: Optional[bool] = None
+    rate_limit_per_minute: Optional[int] = Field(None, ge=1)
 
 class API(APIBase):
     id: int
@@ -182,10 +186,12 @@ class ResponseModel(BaseModel):
 
 class PaginatedResponse(BaseModel):
     items: List[dict]
-    total: int
-    page: int
+    total: Optional[int] = None  # 未统计总数（with_total=false）时为空
+    page: Optional[int] = None  # 游标翻页时为空
     size: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None  # 下一页游标，没有下一页时为空
+    total_estimated: bool = False  # 总数是否为表统计信息的估算值
 
 # 统计信息模式
 class APIStats(BaseModel):
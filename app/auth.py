@@ -1,11 +1,12 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from fastapi import Depends, HTTPException, status, Query
+from fastapi import Depends, HTTPException, status, Query, Request
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import re
 import hashlib
+import ipaddress
 from sqlalchemy.orm import Session
 from .database import get_db
 from .config import config
@@ -20,6 +21,14 @@ pwd_context = CryptContext(schemes=["sha256_crypt", "bcrypt"], deprecated="auto"
 
 # OAuth2 密码承载者（与路由前缀一致）
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v/user/login")
+# /metrics 允许不带Token访问（白名单IP），Token仅在非白名单IP时校验
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/v/user/login", auto_error=False)
+
+# 允许免Token访问 /metrics 的地址（支持CIDR），按直连地址判断，不信任代理头
+METRICS_ALLOWED_NETWORKS = [
+    ipaddress.ip_network(item, strict=False)
+    for item in config.get('app.metrics.allowed_ips', ["127.0.0.1", "::1"])
+]
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码"""
@@ -267,6 +276,29 @@ def get_admin_module_access(current_user = Depends(get_current_user)):
         )
     return current_user
 
+def get_metrics_access(
+    request: Request,
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: Session = Depends(get_db)
+):
+    """监控指标访问权限（白名单IP或管理员Token）"""
+    client_host = request.client.host if request.client else None
+    if client_host:
+        try:
+            address = ipaddress.ip_address(client_host)
+            if any(address in network for network in METRICS_ALLOWED_NETWORKS):
+                return None
+        except ValueError:
+            pass
+    if token:
+        user = get_current_user(token, db)
+        if user.is_admin:
+            return user
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="无权访问监控指标"
+    )
+
 def get_admin_only(current_user = Depends(get_current_user)):
     """仅管理员可访问（用于admin模块的严格权限控制）"""
     if not current_user.is_admin:
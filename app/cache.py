@@ -1,50 +1,285 @@
+"""
+缓存管理器（两级缓存）
+- 一级：进程内 LRU + TTL（容量 app.cache.max_size），只缓存 app.cache.local_ttls 中配置了时间的命名空间
+- 二级：Redis
+一级缓存条目记录写入时所属命名空间的代数；清除命名空间（clear_pattern）只需把代数加一，旧条目随之失效。
+写入/删除一级缓存命名空间中的键时，通过失效总线（app.utils.invalidation，类型 cache）通知其它worker清除各自的一级缓存。
+
+批量失效（都不使用会阻塞Redis的 KEYS）：
+- clear_pattern：SCAN 增量遍历匹配的键，按批 UNLINK（后台释放内存）
+- 标签：set(..., tags=[...]) 把键登记到标签集合 tag:<标签>，invalidate_tag 只删除该标签下的键，O(成员数)
+- 命名空间代数：namespaced_key 生成带代数的键，bump_namespace 把代数加一即可让整个命名空间失效，O(1)，
+  旧键不再被读取，随TTL过期
+
+批量读写：get_many（MGET）、set_many / delete_many（管道），以及 pipeline() 上下文管理器，
+N 个键只需一次（或按 BULK_BATCH 分批的几次）往返，值的编码/解码与 get/set 一致。
+
+缓存值（get/set 系列与哈希字段）由 app.utils.codec 编码为带类型字节的二进制，经不解码响应的客户端（binary）读写；
+标签、代数、SCAN 等键操作仍使用文本客户端（redis）。
+"""
+import asyncio
+import hashlib
 import json
 import logging
-from typing import Any, Optional, Union
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 from functools import wraps
 from .database import redis_manager
 from .config import config
+from app.utils import codec, metrics
+from app.utils.concurrency import run_sync
 
 logger = logging.getLogger(__name__)
 
+metrics.counter("cache_requests_total", "缓存读取次数（按命名空间与命中结果）", ("namespace", "result"))
+metrics.counter("cache_evictions_total", "进程内缓存因容量淘汰的条目数", ("namespace",))
+metrics.gauge("cache_local_entries", "进程内一级缓存条目数")
+
+_MISSING = object()
+
+TAG_PREFIX = "tag:"
+GENERATION_PREFIX = "cache:gen:"
+SCAN_COUNT = 1000
+# MGET / UNLINK 每条命令的最大键数
+BULK_BATCH = 500
+# 标签集合的过期时间（每次登记时刷新），应不短于被标记键的TTL
+TAG_TTL = config.get('app.cache.tag_ttl', 86400)
+# clear_all 清除的缓存键；同一个Redis库中的登录Token（token:*）、调用计数缓冲（usage:*）、
+# 配额（quota:*）、频率限制（ratelimit:*）、命名空间代数与失效版本号（cache:*）等状态数据不在其中
+CACHE_PATTERNS = (
+    "api:*",
+    "api_state:*",
+    "principal:*",
+    "category:*",
+    "order:*",
+    "webconfig*",
+    "stats:*",
+    "user:*",
+    "count_*",
+    TAG_PREFIX + "*",
+)
+
+
+def cache_namespace(key: str) -> str:
+    """缓存键的命名空间（第一个冒号之前的部分）"""
+    return key.split(":", 1)[0]
+
+
+class LocalLRUCache:
+    """
+    进程内 LRU + TTL 缓存（线程安全），条目带命名空间代数
+    一级缓存、密钥主体、负缓存、频率上限等进程内缓存共用；容量满时淘汰最久未使用的条目，O(1)
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        # 键 -> (过期时刻, 命名空间, 代数, 值)
+        self._data: "OrderedDict[Any, Tuple[float, str, int, Any]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Any, default: Any = _MISSING) -> Any:
+        """返回缓存值，未命中/过期/代数已变化时返回 default（默认 _MISSING）"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expire_at, namespace, generation, value = item
+            if expire_at < time.monotonic() or generation != self._generations.get(namespace, 0):
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+
+    def set(self, key: Any, namespace: str, value: Any, ttl: float, generation: Optional[int] = None) -> None:
+        """
+        写入条目；generation 为读取数据源之前的代数，读取期间命名空间被清除时写入的条目直接失效，
+        不传时使用当前代数
+        """
+        evicted = None
+        with self._lock:
+            if generation is None:
+                generation = self._generations.get(namespace, 0)
+            self._data[key] = (time.monotonic() + ttl, namespace, generation, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_size:
+                _, (_, evicted, _, _) = self._data.popitem(last=False)
+        if evicted is not None:
+            metrics.inc("cache_evictions_total", (f"local_{evicted}",))
+
+    def pop(self, key: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop_where(self, predicate: Callable[[Any], bool]) -> int:
+        """删除值满足条件的条目（遍历全部条目，只用于失效处理），返回删除数量"""
+        with self._lock:
+            keys = [k for k, item in self._data.items() if predicate(item[3])]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def bump(self, namespace: str) -> None:
+        """命名空间代数加一，该命名空间下已缓存的条目全部失效（读取时淘汰）"""
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CachePipeline:
+    """
+    CacheManager.pipeline() 中使用的批量操作：命令先排队，退出 with 块时一次发送。
+    get/set/delete 返回该命令在 results 中的序号；执行后 results 依次为解码后的值 / 是否成功 / 删除数，
+    执行失败时全部为 None。读取不经过一级缓存。
+    """
+
+    def __init__(self, manager: "CacheManager"):
+        self._manager = manager
+        self._pipe = manager.binary.pipeline(transaction=False)
+        # 每条命令：(在Redis管道中的位置, 类型)
+        self._slots: List[Tuple[int, str]] = []
+        self._written: List[str] = []
+        self.results: List[Any] = []
+
+    def _slot(self, kind: str) -> int:
+        self._slots.append((len(self._pipe), kind))
+        return len(self._slots) - 1
+
+    def get(self, key: str) -> int:
+        index = self._slot("get")
+        self._pipe.get(key)
+        return index
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, tags: Iterable[str] = ()) -> int:
+        index = self._slot("set")
+        self._pipe.setex(key, ttl or self._manager.default_ttl, codec.encode(value))
+        self._manager.queue_tags(self._pipe, key, tags)
+        self._written.append(key)
+        return index
+
+    def delete(self, key: str) -> int:
+        index = self._slot("delete")
+        self._pipe.delete(key)
+        self._written.append(key)
+        return index
+
+    def execute(self) -> List[Any]:
+        if not self._slots:
+            return self.results
+        try:
+            raw = self._pipe.execute()
+            self.results = [
+                codec.decode(raw[pos]) if kind == "get"
+                else bool(raw[pos]) if kind == "set" else raw[pos]
+                for pos, kind in self._slots
+            ]
+        except Exception as e:
+            logger.error(f"缓存管道执行失败: {e}")
+            self.results = [None] * len(self._slots)
+        for key in self._written:
+            self._manager._forget(key)
+        return self.results
+
+
 class CacheManager:
-    """Redis缓存管理器 - 使用全局Redis连接"""
+    """Redis缓存管理器 - 使用全局Redis连接，热点命名空间前置进程内一级缓存"""
     
     def __init__(self):
         self.default_ttl = config.get('app.cache.default_ttl', 3600)
         self.max_size = config.get('app.cache.max_size', 1000)
+        # 各命名空间的一级缓存时间（秒），未配置的命名空间只走Redis
+        self.local_ttls: Dict[str, float] = config.get('app.cache.local_ttls', {}) or {}
+        self.local = LocalLRUCache(self.max_size)
+        # 命名空间代数的进程内副本（bump_namespace 通过失效总线通知其它worker丢弃）
+        self._ns_generations: Dict[str, int] = {}
     
     @property
     def redis(self):
         """获取Redis客户端 - 延迟加载"""
         return redis_manager.get_client()
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
-        """设置缓存"""
+    @property
+    def binary(self):
+        """读写缓存值的Redis客户端（不解码响应）"""
+        return redis_manager.get_binary_client()
+    
+    # ==================== 一级缓存 ====================
+    
+    def _local_ttl(self, namespace: str) -> float:
+        return self.local_ttls.get(namespace) or 0
+    
+    def _publish_local(self, value: Optional[str]) -> None:
+        """通知其它worker清除一级缓存（value：key:<键> / ns:<命名空间> / gen:<命名空间> / None 表示全部）"""
+        from app.utils import invalidation
+        invalidation.publish("cache", value)
+    
+    def invalidate_local(self, value: Optional[str]) -> None:
+        """清除本进程一级缓存（失效总线 cache 类型的处理函数）"""
+        if value is None:
+            self.local.clear()
+            self._ns_generations.clear()
+        elif value.startswith("gen:"):
+            self._ns_generations.pop(value[4:], None)
+            self.local.bump(value[4:])
+        elif value.startswith("ns:"):
+            self.local.bump(value[3:])
+        elif value.startswith("key:"):
+            self.local.pop(value[4:])
+    
+    def _forget(self, key: str) -> None:
+        """键被写入或删除：清除所有worker一级缓存中的旧值"""
+        if self._local_ttl(cache_namespace(key)):
+            self._publish_local(f"key:{key}")
+    
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, tags: Iterable[str] = ()) -> bool:
+        """设置缓存（tags：登记到这些标签，之后可用 invalidate_tag 批量删除）"""
         try:
-            if isinstance(value, (dict, list)):
-                value = json.dumps(value, ensure_ascii=False)
-            elif not isinstance(value, (str, int, float, bool)):
-                value = str(value)
-            
+            value = codec.encode(value)
             ttl = ttl or self.default_ttl
-            return self.redis.setex(key, ttl, value)
+            if tags:
+                pipe = self.binary.pipeline(transaction=False)
+                pipe.setex(key, ttl, value)
+                self.queue_tags(pipe, key, tags)
+                result = pipe.execute()[0]
+            else:
+                result = self.binary.setex(key, ttl, value)
+            self._forget(key)
+            return result
         except Exception as e:
             logger.error(f"设置缓存失败: {e}")
             return False
     
     def get(self, key: str, default: Any = None) -> Any:
-        """获取缓存"""
+        """获取缓存（一级缓存命中时不访问Redis）"""
+        namespace = cache_namespace(key)
+        local_ttl = self._local_ttl(namespace)
+        if local_ttl:
+            # 一级缓存保存Redis中的原始字节，每次命中时重新解码，调用方修改返回值不会影响缓存
+            raw = self.local.get(key)
+            metrics.inc("cache_requests_total", (f"local_{namespace}", "miss" if raw is _MISSING else "hit"))
+            if raw is not _MISSING:
+                return codec.decode(raw)
+            generation = self.local.generation(namespace)
         try:
-            value = self.redis.get(key)
+            value = self.binary.get(key)
+            metrics.inc("cache_requests_total", (namespace, "miss" if value is None else "hit"))
             if value is None:
                 return default
-            
-            # 尝试解析JSON
-            try:
-                return json.loads(value)
-            except (json.JSONDecodeError, TypeError):
-                return value.decode('utf-8') if isinstance(value, bytes) else value
+            if local_ttl:
+                self.local.set(key, namespace, value, local_ttl, generation)
+            return codec.decode(value)
         except Exception as e:
             logger.error(f"获取缓存失败: {e}")
             return default
@@ -52,11 +287,98 @@ class CacheManager:
     def delete(self, key: str) -> bool:
         """删除缓存"""
         try:
-            return bool(self.redis.delete(key))
+            result = bool(self.redis.delete(key))
+            self._forget(key)
+            return result
         except Exception as e:
             logger.error(f"删除缓存失败: {e}")
             return False
     
+    # ==================== 批量读写 ====================
+    
+    def get_many(self, keys: Iterable[str], default: Any = None) -> Dict[str, Any]:
+        """批量获取缓存（一级缓存未命中的键用 MGET 读取），返回 {键: 值}，不存在的键为 default"""
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, Any] = {}
+        remote: List[str] = []
+        generations: Dict[str, int] = {}
+        for key in keys:
+            namespace = cache_namespace(key)
+            if self._local_ttl(namespace):
+                raw = self.local.get(key)
+                metrics.inc("cache_requests_total", (f"local_{namespace}", "miss" if raw is _MISSING else "hit"))
+                if raw is not _MISSING:
+                    found[key] = codec.decode(raw)
+                    continue
+                generations[key] = self.local.generation(namespace)
+            remote.append(key)
+        
+        if remote:
+            try:
+                values = []
+                for i in range(0, len(remote), BULK_BATCH):
+                    values.extend(self.binary.mget(remote[i:i + BULK_BATCH]))
+            except Exception as e:
+                logger.error(f"批量获取缓存失败: {e}")
+                values = [None] * len(remote)
+            for key, value in zip(remote, values):
+                namespace = cache_namespace(key)
+                metrics.inc("cache_requests_total", (namespace, "miss" if value is None else "hit"))
+                if value is None:
+                    continue
+                if key in generations:
+                    self.local.set(key, namespace, value, self._local_ttl(namespace), generations[key])
+                try:
+                    found[key] = codec.decode(value)
+                except ValueError as e:
+                    logger.error(f"解码缓存失败 {key}: {e}")
+        return {key: found.get(key, default) for key in keys}
+    
+    def set_many(self, mapping: Mapping[str, Any], ttl: Optional[int] = None, tags: Iterable[str] = ()) -> bool:
+        """批量设置缓存（一次管道往返，所有键使用相同的TTL与标签）"""
+        if not mapping:
+            return True
+        tags = tuple(tags)
+        try:
+            ttl = ttl or self.default_ttl
+            pipe = self.binary.pipeline(transaction=False)
+            for key, value in mapping.items():
+                pipe.setex(key, ttl, codec.encode(value))
+                self.queue_tags(pipe, key, tags)
+            pipe.execute()
+            for key in mapping:
+                self._forget(key)
+            return True
+        except Exception as e:
+            logger.error(f"批量设置缓存失败: {e}")
+            return False
+    
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """批量删除缓存，返回删除的键数"""
+        keys = list(dict.fromkeys(keys))
+        try:
+            deleted = self._unlink_all(keys)
+        except Exception as e:
+            logger.error(f"批量删除缓存失败: {e}")
+            return 0
+        for key in keys:
+            self._forget(key)
+        return deleted
+    
+    @contextmanager
+    def pipeline(self):
+        """
+        批量操作上下文：
+            with cache_manager.pipeline() as pipe:
+                i = pipe.get("a")
+                pipe.set("b", {...}, 60)
+            value = pipe.results[i]
+        with 块正常结束时一次发送所有命令；块内抛出异常时不发送。
+        """
+        pipe = CachePipeline(self)
+        yield pipe
+        pipe.execute()
+    
     def exists(self, key: str) -> bool:
         """检查缓存是否存在"""
         try:
@@ -73,26 +395,98 @@ class CacheManager:
             logger.error(f"设置过期时间失败: {e}")
             return False
     
+    def _unlink_all(self, keys: Iterable[str]) -> int:
+        """按批 UNLINK（内存在Redis后台线程释放），返回删除的键数"""
+        total = 0
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= BULK_BATCH:
+                total += self.redis.unlink(*batch)
+                batch = []
+        if batch:
+            total += self.redis.unlink(*batch)
+        return total
+    
     def clear_pattern(self, pattern: str) -> int:
-        """清除匹配模式的缓存"""
+        """清除匹配模式的缓存（SCAN 增量遍历，不阻塞Redis）"""
         try:
-            keys = self.redis.keys(pattern)
-            if keys:
-                return self.redis.delete(*keys)
-            return 0
+            namespace = cache_namespace(pattern)
+            if any(c in namespace for c in "*?["):
+                # 模式未限定命名空间，清除全部一级缓存
+                if self.local_ttls:
+                    self._publish_local(None)
+            elif self._local_ttl(namespace):
+                self._publish_local(f"ns:{namespace}")
+            return self._unlink_all(self.redis.scan_iter(match=pattern, count=SCAN_COUNT))
         except Exception as e:
             logger.error(f"清除模式缓存失败: {e}")
             return 0
     
-    def clear_all(self) -> bool:
-        """清除所有缓存"""
+    # ==================== 标签 ====================
+    
+    @staticmethod
+    def queue_tags(pipe, key: str, tags: Iterable[str]) -> None:
+        """在管道中登记键的标签（同步/异步管道均可，由调用方执行）"""
+        for tag in tags:
+            pipe.sadd(TAG_PREFIX + tag, key)
+            pipe.expire(TAG_PREFIX + tag, TAG_TTL)
+    
+    def invalidate_tag(self, *tags: str) -> int:
+        """删除登记在这些标签下的所有键（及标签集合本身），返回删除的键数"""
+        total = 0
+        namespaces = set()
+        for tag in tags:
+            tag_key = TAG_PREFIX + tag
+            try:
+                members = []
+                for key in self.redis.sscan_iter(tag_key, count=SCAN_COUNT):
+                    members.append(key)
+                    namespaces.add(cache_namespace(key))
+                total += self._unlink_all(members)
+                self.redis.unlink(tag_key)
+            except Exception as e:
+                logger.error(f"按标签清除缓存失败 {tag}: {e}")
+        for namespace in namespaces:
+            if self._local_ttl(namespace):
+                self._publish_local(f"ns:{namespace}")
+        return total
+    
+    # ==================== 命名空间代数 ====================
+    
+    def namespace_generation(self, namespace: str) -> int:
+        """命名空间的当前代数（进程内缓存，首次使用时从Redis读取）"""
+        generation = self._ns_generations.get(namespace)
+        if generation is None:
+            generation = int(self.redis.get(GENERATION_PREFIX + namespace) or 0)
+            self._ns_generations[namespace] = generation
+        return generation
+    
+    def namespaced_key(self, namespace: str, key: str) -> str:
+        """带代数的缓存键：<命名空间>:g<代数>:<键>"""
+        return f"{namespace}:g{self.namespace_generation(namespace)}:{key}"
+    
+    def bump_namespace(self, namespace: str) -> Optional[int]:
+        """使整个命名空间失效（代数加一，不遍历键），返回新代数"""
         try:
-            self.redis.flushdb()
-            logger.info("所有缓存已清除")
-            return True
+            generation = int(self.redis.incr(GENERATION_PREFIX + namespace))
         except Exception as e:
-            logger.error(f"清除所有缓存失败: {e}")
-            return False
+            logger.error(f"更新缓存命名空间代数失败 {namespace}: {e}")
+            return None
+        self._publish_local(f"gen:{namespace}")
+        self._ns_generations[namespace] = generation
+        return generation
+    
+    def clear_all(self) -> int:
+        """清除所有缓存（只删除 CACHE_PATTERNS 匹配的键，不使用 FLUSHDB），返回删除的键数"""
+        total = 0
+        for pattern in CACHE_PATTERNS:
+            cleared = self.clear_pattern(pattern)
+            total += cleared
+            logger.info(f"清除缓存模式 {pattern}: {cleared} 个键")
+        self._publish_local(None)
+        logger.info(f"所有缓存已清除，共 {total} 个键")
+        return total
     
     def get_stats(self) -> dict:
         """获取缓存统计信息"""
@@ -102,7 +496,9 @@ class CacheManager:
                 "total_keys": info.get('db0', {}).get('keys', 0),
                 "memory_usage": info.get('used_memory_human', '0B'),
                 "connected_clients": info.get('connected_clients', 0),
-                "uptime": info.get('uptime_in_seconds', 0)
+                "uptime": info.get('uptime_in_seconds', 0),
+                "local_entries": len(self.local),
+                "local_max_size": self.max_size
             }
         except Exception as e:
             logger.error(f"获取缓存统计失败: {e}")
@@ -111,9 +507,7 @@ class CacheManager:
     def set_hash(self, key: str, field: str, value: Any) -> bool:
         """设置哈希字段"""
         try:
-            if isinstance(value, (dict, list)):
-                value = json.dumps(value, ensure_ascii=False)
-            return bool(self.redis.hset(key, field, value))
+            return bool(self.binary.hset(key, field, codec.encode(value)))
         except Exception as e:
             logger.error(f"设置哈希字段失败: {e}")
             return False
@@ -121,14 +515,10 @@ class CacheManager:
     def get_hash(self, key: str, field: str, default: Any = None) -> Any:
         """获取哈希字段"""
         try:
-            value = self.redis.hget(key, field)
+            value = self.binary.hget(key, field)
             if value is None:
                 return default
-            
-            try:
-                return json.loads(value)
-            except (json.JSONDecodeError, TypeError):
-                return value.decode('utf-8') if isinstance(value, bytes) else value
+            return codec.decode(value)
         except Exception as e:
             logger.error(f"获取哈希字段失败: {e}")
             return default
@@ -136,14 +526,8 @@ class CacheManager:
     def get_all_hash(self, key: str) -> dict:
         """获取所有哈希字段"""
         try:
-            data = self.redis.hgetall(key)
-            result = {}
-            for field, value in data.items():
-                try:
-                    result[field] = json.loads(value)
-                except (json.JSONDecodeError, TypeError):
-                    result[field] = value.decode('utf-8') if isinstance(value, bytes) else value
-            return result
+            data = self.binary.hgetall(key)
+            return {field.decode('utf-8'): codec.decode(value) for field, value in data.items()}
         except Exception as e:
             logger.error(f"获取所有哈希字段失败: {e}")
             return {}
@@ -161,28 +545,103 @@ def get_cache_manager() -> CacheManager:
 # 兼容性别名
 cache_manager = get_cache_manager()
 
-def cache_result(ttl: Optional[int] = None, key_prefix: str = ""):
-    """缓存装饰器"""
+
+@metrics.register_collector
+def _collect_local_entries():
+    return [("cache_local_entries", {}, len(cache_manager.local))]
+
+# ==================== 函数结果缓存 ====================
+
+# 缓存键 -> 正在计算的任务（单飞：同一进程内同一个键同时只计算一次）
+_inflight: Dict[str, "asyncio.Task"] = {}
+
+
+def _canonical_default(value: Any) -> Any:
+    """参数中非JSON类型的稳定表示"""
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if type(value).__repr__ is object.__repr__:
+        # 默认 repr 含内存地址（如数据库会话、请求、用户对象），无法区分不同的实例，
+        # 按类型归并会让不同用户/请求共用同一个缓存结果
+        raise TypeError(
+            f"缓存键参数 {type(value).__module__}.{type(value).__qualname__} 没有稳定的表示，"
+            f"请为 cache_result 指定 key_func"
+        )
+    return repr(value)
+
+
+def make_cache_key(key_prefix: str, func, args: tuple, kwargs: dict) -> str:
+    """
+    由函数与参数生成跨进程稳定的缓存键（规范化JSON的 blake2b 摘要，与关键字参数顺序无关）
+    参数中有使用默认 repr 的对象时抛出 TypeError
+    """
+    payload = json.dumps(
+        [args, kwargs], sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_canonical_default
+    )
+    digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{key_prefix}:{func.__module__}.{func.__qualname__}:{digest}"
+
+
+def _start_flight(cache_key: str, compute) -> "asyncio.Task":
+    """返回该键正在进行的计算，没有时启动一个"""
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(compute())
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    return task
+
+
+def _log_refresh_error(task: "asyncio.Task") -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"后台刷新缓存失败: {task.exception()}")
+
+
+def cache_result(
+    ttl: Optional[int] = None,
+    key_prefix: str = "",
+    stale_ttl: int = 0,
+    key_func: Optional[Callable[..., Any]] = None
+):
+    """
+    缓存装饰器（用于异步函数，结果需可JSON序列化）
+
+    - 缓存键由函数全名与参数的规范化摘要组成，各worker、重启前后一致
+    - 参数中有数据库会话、请求等没有稳定表示的对象时，需指定 key_func(*args, **kwargs)
+      返回决定结果的值（如用户ID），否则调用时抛出 TypeError
+    - Redis读写放到线程池执行，不阻塞事件循环
+    - 单飞：同一进程内同一个键未命中时只执行一次函数，并发的调用等待同一个结果
+    - stale_ttl：过期后的 stale_ttl 秒内先返回旧值，同时在后台刷新（stale-while-revalidate）
+    """
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # 生成缓存键
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(kwargs))}"
-            
-            # 尝试从缓存获取
-            cached_result = cache_manager.get(cache_key)
-            if cached_result is not None:
-                logger.debug(f"从缓存获取结果: {cache_key}")
-                return cached_result
-            
-            # 执行函数
-            result = await func(*args, **kwargs)
-            
-            # 缓存结果
-            cache_manager.set(cache_key, result, ttl)
-            logger.debug(f"结果已缓存: {cache_key}")
-            
-            return result
+            if key_func is not None:
+                cache_key = make_cache_key(key_prefix, func, (key_func(*args, **kwargs),), {})
+            else:
+                cache_key = make_cache_key(key_prefix, func, args, kwargs)
+            fresh_ttl = ttl or cache_manager.default_ttl
+
+            async def compute():
+                result = await func(*args, **kwargs)
+                entry = {"value": result, "fresh_until": time.time() + fresh_ttl}
+                await run_sync(cache_manager.set, cache_key, entry, fresh_ttl + stale_ttl)
+                logger.debug(f"结果已缓存: {cache_key}")
+                return result
+
+            cached = await run_sync(cache_manager.get, cache_key)
+            if isinstance(cached, dict) and "fresh_until" in cached:
+                if cached["fresh_until"] > time.time():
+                    logger.debug(f"从缓存获取结果: {cache_key}")
+                    return cached["value"]
+                if stale_ttl:
+                    if cache_key not in _inflight:
+                        _start_flight(cache_key, compute).add_done_callback(_log_refresh_error)
+                    logger.debug(f"返回过期结果并后台刷新: {cache_key}")
+                    return cached["value"]
+
+            # shield：某个等待方被取消时不影响其它等待方共用的计算
+            return await asyncio.shield(_start_flight(cache_key, compute))
         return wrapper
     return decorator
 
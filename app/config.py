@@ -3,7 +3,7 @@ import logging
 import yaml
 import os
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 class Config:
     """配置管理类"""
@@ -43,6 +43,33 @@ class Config:
         mysql = self.get('database.mysql')
         return f"mysql+pymysql://{mysql['username']}:{mysql['password']}@{mysql['host']}:{mysql['port']}/{mysql['database']}?charset={mysql['charset']}"
     
+    def get_async_database_url(self) -> Optional[str]:
+        """获取异步数据库连接URL（未启用异步模式时返回None）
+
+        database.mysql.async_url 优先（如本地测试用 sqlite+aiosqlite:///./dev.db），
+        否则按 database.mysql.async_driver（asyncmy / aiomysql）拼接MySQL连接URL
+        """
+        mysql = self.get('database.mysql', {})
+        if mysql.get('async_url'):
+            return mysql['async_url']
+        driver = mysql.get('async_driver')
+        if not driver:
+            return None
+        return f"mysql+{driver}://{mysql['username']}:{mysql['password']}@{mysql['host']}:{mysql['port']}/{mysql['database']}?charset={mysql['charset']}"
+    
+    def get_replica_database_urls(self, driver: str = "pymysql") -> List[str]:
+        """获取只读从库连接URL列表（database.mysql.replicas，未配置时为空）
+
+        每一项为覆盖主库配置的字典（通常只需 host/port，也可覆盖账号、库名），
+        同步引擎使用 pymysql，异步引擎传入 async_driver
+        """
+        mysql = self.get('database.mysql', {})
+        urls = []
+        for replica in mysql.get('replicas') or []:
+            merged = {**mysql, **replica}
+            urls.append(f"mysql+{driver}://{merged['username']}:{merged['password']}@{merged['host']}:{merged['port']}/{merged['database']}?charset={merged['charset']}")
+        return urls
+    
     def get_redis_url(self) -> str:
         """获取Redis连接URL"""
         redis = self.get('database.redis')
@@ -1,12 +1,22 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import Delete, Insert, Update, create_engine, event, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
 from redis import Redis
-from typing import Generator
+from redis.asyncio import Redis as AsyncRedis
+from typing import Any, AsyncGenerator, Generator, List, Optional, Sequence, Union
+from fastapi import Request
 import logging
 from .config import config
+import hashlib
+import random
 import threading
+import time
 from datetime import datetime
+from app.utils import metrics
+from app.utils.concurrency import run_sync
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -15,12 +25,77 @@ logger = logging.getLogger(__name__)
 # 全局变量
 _engine = None
 _session_factory = None
+_async_engine = None
+_async_session_factory = None
+_replica_engines: Optional[List[Any]] = None
+_async_replica_engines: Optional[List[Any]] = None
 _redis_client = None
 _lock = threading.Lock()
 
 # 创建基础模型类
 Base = declarative_base()
 
+metrics.counter("db_pool_checkouts_total", "从连接池取出连接的次数")
+metrics.counter("db_pool_connects_total", "连接池新建数据库连接的次数")
+metrics.gauge("db_pool_connections", "连接池连接数", ("state",))
+metrics.histogram(
+    "redis_command_duration_seconds", "Redis命令耗时（秒，不含pipeline）", ("command",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+
+class TimedRedis(Redis):
+    """记录命令耗时的Redis客户端"""
+
+    def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            metrics.observe(
+                "redis_command_duration_seconds", (str(args[0]).lower(),), time.perf_counter() - started
+            )
+
+
+class TimedAsyncRedis(AsyncRedis):
+    """记录命令耗时的异步Redis客户端"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            metrics.observe(
+                "redis_command_duration_seconds", (str(args[0]).lower(),), time.perf_counter() - started
+            )
+
+def _pool_options() -> dict:
+    mysql_config = config.get_mysql_config()
+    return {
+        "pool_size": mysql_config.get('pool_size', 10),
+        "max_overflow": mysql_config.get('max_overflow', 20),
+        "pool_timeout": mysql_config.get('pool_timeout', 30),
+        "pool_recycle": mysql_config.get('pool_recycle', 3600),
+        "echo": mysql_config.get('echo', False),
+        "pool_pre_ping": True,  # 连接前ping测试
+    }
+
+
+class RoutingSession(Session):
+    """
+    读写分离会话：标记为只读（info["read_only"]）且配置了从库时，查询随机发往从库；
+    写语句、刷写以及本会话发生过写入之后的所有语句都走主库（保证会话内读到自己的写入）
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replicas = self.info.get("replicas")
+        if replicas and self.info.get("read_only") and not self.info.get("wrote"):
+            if not self._flushing and not isinstance(clause, (Insert, Update, Delete)):
+                return random.choice(replicas)
+            self.info["wrote"] = True
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
 class DatabaseManager:
     """数据库连接管理器 - 单例模式"""
     
@@ -45,17 +120,9 @@ class DatabaseManager:
                 if _engine is None:
                     try:
                         database_url = config.get_database_url()
-                        mysql_config = config.get_mysql_config()
-                        
-                        _engine = create_engine(
-                            database_url,
-                            pool_size=mysql_config.get('pool_size', 10),
-                            max_overflow=mysql_config.get('max_overflow', 20),
-                            pool_timeout=mysql_config.get('pool_timeout', 30),
-                            pool_recycle=mysql_config.get('pool_recycle', 3600),
-                            echo=mysql_config.get('echo', False),
-                            pool_pre_ping=True  # 连接前ping测试
-                        )
+                        _engine = create_engine(database_url, **_pool_options())
+                        event.listen(_engine, "checkout", lambda *_: metrics.inc("db_pool_checkouts_total"))
+                        event.listen(_engine, "connect", lambda *_: metrics.inc("db_pool_connects_total"))
                         logger.info("MySQL数据库引擎创建成功")
                     except Exception as e:
                         logger.error(f"MySQL数据库引擎创建失败: {e}")
@@ -69,19 +136,124 @@ class DatabaseManager:
             with _lock:
                 if _session_factory is None:
                     engine = self.get_engine()
-                    _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                    _session_factory = sessionmaker(
+                        autocommit=False, autoflush=False, bind=engine,
+                        class_=RoutingSession, info={"replicas": self.get_replica_engines()}
+                    )
                     logger.info("数据库会话工厂创建成功")
         return _session_factory
     
+    def get_replica_engines(self) -> List[Any]:
+        """获取只读从库引擎列表（database.mysql.replicas，未配置时为空）"""
+        global _replica_engines
+        if _replica_engines is None:
+            engines = []
+            for url in config.get_replica_database_urls():
+                try:
+                    engines.append(create_engine(url, **_pool_options()))
+                except Exception as e:
+                    logger.error(f"从库引擎创建失败: {e}")
+            if engines:
+                logger.info(f"已配置 {len(engines)} 个只读从库")
+            _replica_engines = engines
+        return _replica_engines
+    
     def create_session(self) -> Session:
         """创建新的数据库会话"""
         factory = self.get_session_factory()
         return factory()
     
+    def create_read_session(self) -> Session:
+        """创建只读会话（查询走从库；会话内发生写入后切回主库）"""
+        session = self.create_session()
+        session.info["read_only"] = True
+        return session
+    
+    def async_enabled(self) -> bool:
+        """是否配置了异步引擎（database.mysql.async_driver / async_url）"""
+        return config.get_async_database_url() is not None
+    
+    def get_async_engine(self):
+        """获取异步数据库引擎 - 单例（需配置 async_driver 或 async_url）"""
+        global _async_engine
+        if _async_engine is None:
+            with _lock:
+                if _async_engine is None:
+                    database_url = config.get_async_database_url()
+                    if database_url is None:
+                        raise RuntimeError("未配置异步数据库驱动（database.mysql.async_driver）")
+                    options = _pool_options()
+                    # SQLite（aiosqlite）使用默认连接池，不支持连接池参数
+                    if not database_url.startswith("mysql"):
+                        options = {"echo": options["echo"], "pool_pre_ping": True}
+                    try:
+                        _async_engine = create_async_engine(database_url, **options)
+                        event.listen(
+                            _async_engine.sync_engine, "checkout",
+                            lambda *_: metrics.inc("db_pool_checkouts_total")
+                        )
+                        logger.info(f"异步数据库引擎创建成功: {database_url.split(':', 1)[0]}")
+                    except Exception as e:
+                        logger.error(f"异步数据库引擎创建失败: {e}")
+                        raise
+        return _async_engine
+    
+    def get_async_session_factory(self):
+        """获取异步会话工厂 - 单例"""
+        global _async_session_factory
+        if _async_session_factory is None:
+            with _lock:
+                if _async_session_factory is None:
+                    _async_session_factory = async_sessionmaker(
+                        bind=self.get_async_engine(), autoflush=False, expire_on_commit=False,
+                        sync_session_class=RoutingSession,
+                        info={"replicas": [engine.sync_engine for engine in self.get_async_replica_engines()]}
+                    )
+        return _async_session_factory
+    
+    def get_async_replica_engines(self) -> List[Any]:
+        """获取只读从库的异步引擎列表（使用与主库相同的异步驱动）"""
+        global _async_replica_engines
+        if _async_replica_engines is None:
+            driver = config.get_mysql_config().get('async_driver')
+            engines = []
+            for url in config.get_replica_database_urls(driver) if driver else []:
+                try:
+                    engines.append(create_async_engine(url, **_pool_options()))
+                except Exception as e:
+                    logger.error(f"从库异步引擎创建失败: {e}")
+            _async_replica_engines = engines
+        return _async_replica_engines
+    
+    def create_async_session(self) -> AsyncSession:
+        """创建新的异步数据库会话"""
+        return self.get_async_session_factory()()
+    
+    def create_async_read_session(self) -> AsyncSession:
+        """创建只读异步会话（查询走从库）"""
+        session = self.create_async_session()
+        session.info["read_only"] = True
+        return session
+    
+    async def dispose_async(self):
+        """释放异步引擎的连接（需在事件循环中调用）"""
+        global _async_engine, _async_session_factory, _async_replica_engines
+        engine, _async_engine, _async_session_factory = _async_engine, None, None
+        replicas, _async_replica_engines = _async_replica_engines or [], None
+        for item in [engine, *replicas]:
+            if item is not None:
+                await item.dispose()
+        if engine is not None:
+            logger.info("异步数据库连接已释放")
+    
     def dispose(self):
         """释放数据库连接"""
         global _engine, _session_factory
         with _lock:
+            global _replica_engines
+            for replica in _replica_engines or []:
+                replica.dispose()
+            _replica_engines = None
             if _engine:
                 _engine.dispose()
                 _engine = None
@@ -101,24 +273,32 @@ class RedisManager:
     def __init__(self):
         if not hasattr(self, '_initialized'):
             self._redis_client = None
+            self._async_client = None
+            # 不解码响应的客户端，用于读写缓存值（app.utils.codec 编码的二进制数据）
+            self._binary_client = None
+            self._async_binary_client = None
             self._initialized = True
     
+    @staticmethod
+    def _client_options(decode_responses: bool) -> dict:
+        redis_config = config.get_redis_config()
+        return {
+            "host": redis_config.get('host', 'localhost'),
+            "port": redis_config.get('port', 6379),
+            "db": redis_config.get('db', 0),
+            "password": redis_config.get('password'),
+            "decode_responses": decode_responses,
+            "socket_connect_timeout": 5,
+            "socket_timeout": 5,
+        }
+    
     def get_client(self) -> Redis:
         """获取Redis客户端 - 单例"""
         if self._redis_client is None:
             with _lock:
                 if self._redis_client is None:
                     try:
-                        redis_config = config.get_redis_config()
-                        self._redis_client = Redis(
-                            host=redis_config.get('host', 'localhost'),
-                            port=redis_config.get('port', 6379),
-                            db=redis_config.get('db', 0),
-                            password=redis_config.get('password'),
-                            decode_responses=True,  # 自动解码响应
-                            socket_connect_timeout=5,
-                            socket_timeout=5
-                        )
+                        self._redis_client = TimedRedis(**self._client_options(True))  # 自动解码响应
                         # 测试连接
                         self._redis_client.ping()
                         logger.info("Redis连接成功")
@@ -127,9 +307,47 @@ class RedisManager:
                         raise
         return self._redis_client
     
+    def get_binary_client(self) -> Redis:
+        """获取不解码响应的Redis客户端 - 单例（读写二进制缓存值）"""
+        if self._binary_client is None:
+            with _lock:
+                if self._binary_client is None:
+                    self._binary_client = TimedRedis(**self._client_options(False))
+        return self._binary_client
+    
+    def get_async_client(self) -> AsyncRedis:
+        """获取异步Redis客户端 - 单例（供事件循环中的网关使用，连接在首次命令时建立）"""
+        if self._async_client is None:
+            with _lock:
+                if self._async_client is None:
+                    self._async_client = TimedAsyncRedis(**self._client_options(True))
+                    logger.info("异步Redis客户端创建成功")
+        return self._async_client
+    
+    def get_async_binary_client(self) -> AsyncRedis:
+        """获取不解码响应的异步Redis客户端 - 单例"""
+        if self._async_binary_client is None:
+            with _lock:
+                if self._async_binary_client is None:
+                    self._async_binary_client = TimedAsyncRedis(**self._client_options(False))
+        return self._async_binary_client
+    
+    async def close_async(self):
+        """关闭异步Redis连接（需在事件循环中调用）"""
+        client, self._async_client = self._async_client, None
+        binary_client, self._async_binary_client = self._async_binary_client, None
+        if binary_client is not None:
+            await binary_client.aclose()
+        if client is not None:
+            await client.aclose()
+            logger.info("异步Redis连接已关闭")
+    
     def close(self):
         """关闭Redis连接"""
         with _lock:
+            if self._binary_client:
+                self._binary_client.close()
+                self._binary_client = None
             if self._redis_client:
                 self._redis_client.close()
                 self._redis_client = None
@@ -139,6 +357,20 @@ class RedisManager:
 db_manager = DatabaseManager()
 redis_manager = RedisManager()
 
+
+@metrics.register_collector
+def _collect_pool_metrics():
+    """连接池状态（引擎尚未创建时不输出）"""
+    if _engine is None:
+        return []
+    pool = _engine.pool
+    return [
+        ("db_pool_connections", {"state": "size"}, pool.size()),
+        ("db_pool_connections", {"state": "checked_in"}, pool.checkedin()),
+        ("db_pool_connections", {"state": "checked_out"}, pool.checkedout()),
+        ("db_pool_connections", {"state": "overflow"}, max(pool.overflow(), 0)),
+    ]
+
 def get_db() -> Generator[Session, None, None]:
     """获取数据库会话 - 依赖注入"""
     session = db_manager.create_session()
@@ -147,22 +379,210 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         session.close()
 
+class OffloadedSession:
+    """
+    未启用异步引擎时 get_async_db 提供的会话：接口与 AsyncSession 的常用部分一致，
+    语句在线程池中用同步Session执行（结果在线程中取完），事件循环不被阻塞
+    """
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    def add(self, instance: Any) -> None:
+        self.sync_session.add(instance)
+
+    def _execute(self, statement, params=None, **kwargs):
+        # freeze() 在线程中取完所有行，返回的结果在事件循环中读取不再访问连接
+        return self.sync_session.execute(statement, params, **kwargs).freeze()
+
+    async def execute(self, statement, params=None, **kwargs):
+        frozen = await run_sync(self._execute, statement, params, **kwargs)
+        return frozen()
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return (await self.execute(statement, params, **kwargs)).scalar()
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return (await self.execute(statement, params, **kwargs)).scalars()
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_sync(self.sync_session.get, entity, ident, **kwargs)
+
+    async def flush(self) -> None:
+        await run_sync(self.sync_session.flush)
+
+    async def commit(self) -> None:
+        await run_sync(self.sync_session.commit)
+
+    async def rollback(self) -> None:
+        await run_sync(self.sync_session.rollback)
+
+    async def refresh(self, instance: Any) -> None:
+        await run_sync(self.sync_session.refresh, instance)
+
+    async def close(self) -> None:
+        await run_sync(self.sync_session.close)
+
+
+AsyncDB = Union[AsyncSession, OffloadedSession]
+
+
+async def get_async_db() -> AsyncGenerator[AsyncDB, None]:
+    """获取异步数据库会话 - 依赖注入
+
+    配置了异步驱动时为 AsyncSession（I/O 直接在事件循环中等待），
+    否则回退为在线程池中执行的同步会话；两者都按 SQLAlchemy 2.0 风格使用（await db.execute(select(...))）
+    """
+    if db_manager.async_enabled():
+        async with db_manager.create_async_session() as session:
+            yield session
+    else:
+        session = OffloadedSession(db_manager.create_session())
+        try:
+            yield session
+        finally:
+            await session.close()
+
+READ_YOUR_WRITES_SECONDS = config.get('database.mysql.read_your_writes_seconds', 5)
+PIN_KEY_PREFIX = "dbpin:"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def _pin_key(headers: dict, client_host: Optional[str]) -> str:
+    """
+    调用方标识：有 Authorization 时取其摘要（同一用户的多个请求），否则取连接对端地址
+    不读取 X-Forwarded-For：该头由客户端控制（代理改写对端地址的方式见 rate_limiter.get_client_ip）
+    """
+    identity = headers.get("authorization") or client_host or "unknown"
+    digest = hashlib.blake2b(identity.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{PIN_KEY_PREFIX}{digest}"
+
+
+def _request_pin_key(request: Request) -> str:
+    return _pin_key(request.headers, request.client.host if request.client else None)
+
+
+def _pinned(request: Request) -> bool:
+    """调用方最近是否写入过（写入后的一段时间内读主库，保证读到自己的写入）"""
+    try:
+        return bool(redis_manager.get_client().exists(_request_pin_key(request)))
+    except Exception as e:
+        logger.warning(f"读取主库固定标记失败，本次读主库: {e}")
+        return True
+
+
+async def _pinned_async(request: Request) -> bool:
+    try:
+        return bool(await redis_manager.get_async_client().exists(_request_pin_key(request)))
+    except Exception as e:
+        logger.warning(f"读取主库固定标记失败，本次读主库: {e}")
+        return True
+
+
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    """获取只读数据库会话 - 依赖注入
+
+    配置了从库时查询发往从库；调用方最近写入过（read_your_writes_seconds 内）则仍读主库
+    """
+    if db_manager.get_replica_engines() and not _pinned(request):
+        session = db_manager.create_read_session()
+    else:
+        session = db_manager.create_session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+async def get_async_read_db(request: Request) -> AsyncGenerator[AsyncDB, None]:
+    """获取只读异步数据库会话 - 依赖注入（从库路由规则同 get_read_db）"""
+    read_only = bool(db_manager.get_replica_engines()) and not await _pinned_async(request)
+    if db_manager.async_enabled():
+        session = db_manager.create_async_read_session() if read_only else db_manager.create_async_session()
+        async with session:
+            yield session
+    else:
+        offloaded = OffloadedSession(
+            db_manager.create_read_session() if read_only else db_manager.create_session()
+        )
+        try:
+            yield offloaded
+        finally:
+            await offloaded.close()
+
+
+class ReadYourWritesMiddleware:
+    """
+    写请求（POST/PUT/PATCH/DELETE）成功后，把该调用方固定到主库 read_your_writes_seconds 秒，
+    避免从库复制延迟导致刚写入的数据读不到；未配置从库时直接透传
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in WRITE_METHODS
+            or not db_manager.get_replica_engines()
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+        if status_code < 400:
+            headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+            client = scope.get("client")
+            try:
+                await redis_manager.get_async_client().set(
+                    _pin_key(headers, client[0] if client else None), 1, ex=READ_YOUR_WRITES_SECONDS
+                )
+            except Exception as e:
+                logger.warning(f"设置主库固定标记失败: {e}")
+
+
+def insert_or_increment(
+    dialect_name: str,
+    model,
+    conflict_columns: Sequence[str],
+    increment_columns: Sequence[str]
+) -> Insert:
+    """
+    多行 INSERT，唯一键冲突时把插入值累加到已有行的 increment_columns 上
+    MySQL 使用 ON DUPLICATE KEY UPDATE，SQLite 使用 ON CONFLICT (conflict_columns) DO UPDATE
+    """
+    table = model.__table__
+    if dialect_name == "sqlite":
+        stmt = sqlite_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=list(conflict_columns),
+            set_={name: table.c[name] + stmt.excluded[name] for name in increment_columns}
+        )
+    stmt = mysql_insert(table)
+    return stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in increment_columns})
+
+
 def get_redis() -> Redis:
     """获取Redis客户端 - 依赖注入"""
     return redis_manager.get_client()
 
 def init_db():
-    """初始化数据库，创建所有表"""
+    """初始化数据库：执行尚未执行的版本化迁移（app/migrations）"""
     try:
-        # 导入所有模型以确保它们被注册
-        from .admin import models as admin_models
+        from . import migrations
         
-        # 创建所有表
         engine = db_manager.get_engine()
-        Base.metadata.create_all(bind=engine)
-        logger.info("数据库表创建成功")
+        migrations.upgrade(engine)
     except Exception as e:
-        logger.error(f"数据库表创建失败: {e}")
+        logger.error(f"数据库迁移失败: {e}")
         raise
 
 def close_db():
@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func
+from sqlalchemy import func, select
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
-from app.database import get_db
+from app.database import AsyncDB, get_async_read_db, get_db
 from app.admin import models as admin_models
 from app.admin import crud as admin_crud
 from app.cache import cache_manager
+from app.utils import call_counter, key_filter, key_principal, quota, usage_counter
 from app.auth import get_current_user
 from app.utils.webconfig_manager import get_config
 import logging
@@ -105,54 +106,60 @@ def get_api_pricing_options(api):
         logger.error(f"获取API价格选项失败: {e}")
         return []
 
+# ==================== 查询条件 ====================
+
+def _public_api_filters():
+    """前台可见的API：已启用且公开"""
+    return (
+        admin_models.API.is_active == True,
+        admin_models.API.is_public == True
+    )
+
+def _category_counts_query():
+    """各分类下前台可见的API数量（按数量降序）"""
+    count = func.count(admin_models.API.id)
+    return select(
+        admin_models.APICategory.name,
+        count.label('count')
+    ).join(
+        admin_models.API, admin_models.APICategory.id == admin_models.API.category_id
+    ).where(*_public_api_filters()).group_by(admin_models.APICategory.name).order_by(count.desc())
+
 # ==================== 首页统计 ====================
 
 @router.get("/stats")
-async def get_home_stats(db: Session = Depends(get_db)):
+async def get_home_stats(db: AsyncDB = Depends(get_async_read_db)):
     """获取首页统计信息"""
     try:
+        API = admin_models.API
+        
         # 获取基本统计
-        total_apis = db.query(admin_models.API).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).count()
+        total_apis = await db.scalar(
+            select(func.count(API.id)).where(*_public_api_filters())
+        )
         
-        total_users = db.query(admin_models.User).filter(
-            admin_models.User.is_active == True
-        ).count()
+        total_users = await db.scalar(
+            select(func.count(admin_models.User.id)).where(admin_models.User.is_active == True)
+        )
         
-        total_calls = db.query(admin_models.API).with_entities(
-            func.sum(admin_models.API.call_count)
-        ).scalar() or 0
+        # 总调用次数包含尚未合并的分片计数
+        total_calls = await db.scalar(call_counter.total_calls_sum()) or 0
         
         # 获取热门API接口
-        popular_apis = db.query(admin_models.API).options(
-            joinedload(admin_models.API.category)
-        ).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).order_by(admin_models.API.call_count.desc()).limit(10).all()
+        api_calls = call_counter.total_calls_expr().label("total_calls")
+        popular_apis = (await db.execute(
+            select(API, api_calls).options(joinedload(API.category)).where(*_public_api_filters())
+            .order_by(api_calls.desc()).limit(10)
+        )).all()
         
         # 获取最新API接口
-        latest_apis = db.query(admin_models.API).options(
-            joinedload(admin_models.API.category)
-        ).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).order_by(admin_models.API.created_at.desc()).limit(5).all()
+        latest_apis = (await db.execute(
+            select(API).options(joinedload(API.category)).where(*_public_api_filters())
+            .order_by(API.created_at.desc()).limit(5)
+        )).scalars().all()
         
         # 获取分类统计
-        categories = db.query(
-            admin_models.APICategory.name,
-            func.count(admin_models.API.id).label('count')
-        ).join(
-            admin_models.API, admin_models.APICategory.id == admin_models.API.category_id
-        ).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).group_by(admin_models.APICategory.name).order_by(
-            func.count(admin_models.API.id).desc()
-        ).limit(10).all()
+        categories = (await db.execute(_category_counts_query().limit(10))).all()
         
         return {
             "total_apis": total_apis,
@@ -164,9 +171,9 @@ async def get_home_stats(db: Session = Depends(get_db)):
                     "title": api.title,
                     "alias": api.alias,
                     "description": api.description,
-                    "call_count": api.call_count,
+                    "call_count": int(calls or 0),
                     "category": api.category.name if api.category else None
-                } for api in popular_apis
+                } for api, calls in popular_apis
             ],
             "latest_apis": [
                 {
@@ -208,20 +215,17 @@ async def search_apis(
     is_free: Optional[bool] = Query(None, description="是否免费"),
     skip: int = Query(0, ge=0, description="跳过的记录数"),
     limit: int = Query(20, ge=1, le=100, description="返回的记录数"),
-    db: Session = Depends(get_db)
+    db: AsyncDB = Depends(get_async_read_db)
 ):
     """搜索API接口"""
     try:
         # 构建查询
-        query = db.query(admin_models.API).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        )
+        query = select(admin_models.API).where(*_public_api_filters())
         
         # 关键词搜索
         if keyword and keyword.strip():
             keyword = keyword.strip()
-            query = query.filter(
+            query = query.where(
                 admin_models.API.title.contains(keyword) | 
                 admin_models.API.description.contains(keyword) |
                 admin_models.API.alias.contains(keyword)
@@ -229,29 +233,32 @@ async def search_apis(
         
         # 分类筛选
         if category:
-            query = query.join(admin_models.APICategory).filter(
+            query = query.join(admin_models.APICategory).where(
                 admin_models.APICategory.name == category
             )
         
         # 请求方式筛选
         if method:
-            query = query.filter(admin_models.API.method == method)
+            query = query.where(admin_models.API.method == method)
         
         # 是否免费筛选
         if is_free is not None:
-            query = query.filter(admin_models.API.is_free == is_free)
+            query = query.where(admin_models.API.is_free == is_free)
         
         # 获取总数
-        total = query.count()
+        total = await db.scalar(select(func.count()).select_from(query.subquery()))
         
-        # 执行查询（分页）
-        apis = query.options(joinedload(admin_models.API.category)).order_by(
-            admin_models.API.call_count.desc()
-        ).offset(skip).limit(limit).all()
+        # 执行查询（分页），调用次数包含尚未合并的分片计数
+        api_calls = call_counter.total_calls_expr().label("total_calls")
+        apis = (await db.execute(
+            query.add_columns(api_calls).options(joinedload(admin_models.API.category)).order_by(
+                api_calls.desc()
+            ).offset(skip).limit(limit)
+        )).all()
         
         # 转换为响应格式
         results = []
-        for api in apis:
+        for api, calls in apis:
             api_dict = {
                 "id": api.id,
                 "title": api.title,
@@ -269,7 +276,7 @@ async def search_apis(
                 "is_active": api.is_active,
                 "is_public": api.is_public,
                 "is_free": api.is_free,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "category_id": api.category_id,
                 "category": api.category.name if api.category else None,
                 "tags": api.tags or "[]",
@@ -309,20 +316,10 @@ async def search_apis(
 # ==================== 分类浏览 ====================
 
 @router.get("/categories")
-async def get_categories(db: Session = Depends(get_db)):
+async def get_categories(db: AsyncDB = Depends(get_async_read_db)):
     """获取所有分类"""
     try:
-        categories = db.query(
-            admin_models.APICategory.name,
-            func.count(admin_models.API.id).label('count')
-        ).join(
-            admin_models.API, admin_models.APICategory.id == admin_models.API.category_id
-        ).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).group_by(admin_models.APICategory.name).order_by(
-            func.count(admin_models.API.id).desc()
-        ).all()
+        categories = (await db.execute(_category_counts_query())).all()
         
         return [
             {
@@ -348,29 +345,26 @@ async def get_apis_by_category(
     category_name: str,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: AsyncDB = Depends(get_async_read_db)
 ):
     """获取指定分类下的API接口"""
     try:
-        apis = db.query(admin_models.API).join(
-            admin_models.APICategory, admin_models.APICategory.id == admin_models.API.category_id
-        ).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True,
-            admin_models.APICategory.name == category_name
-        ).options(joinedload(admin_models.API.category)).offset(skip).limit(limit).all()
-        
-        total = db.query(admin_models.API).join(
-            admin_models.APICategory, admin_models.APICategory.id == admin_models.API.category_id
-        ).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True,
-            admin_models.APICategory.name == category_name
-        ).count()
+        conditions = (*_public_api_filters(), admin_models.APICategory.name == category_name)
+        apis = (await db.execute(
+            select(admin_models.API, call_counter.total_calls_expr()).join(
+                admin_models.APICategory, admin_models.APICategory.id == admin_models.API.category_id
+            ).where(*conditions).options(joinedload(admin_models.API.category)).offset(skip).limit(limit)
+        )).all()
+        
+        total = await db.scalar(
+            select(func.count(admin_models.API.id)).join(
+                admin_models.APICategory, admin_models.APICategory.id == admin_models.API.category_id
+            ).where(*conditions)
+        )
         
         # 转换为响应格式
         items = []
-        for api in apis:
+        for api, calls in apis:
             api_dict = {
                 "id": api.id,
                 "title": api.title,
@@ -382,7 +376,7 @@ async def get_apis_by_category(
                 "is_free": api.is_free,
                 "category": api.category.name if api.category else None,
                 "tags": api.tags,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "created_at": api.created_at
             }
             items.append(api_dict)
@@ -411,15 +405,16 @@ async def get_apis_by_category(
 # ==================== 标签浏览 ====================
 
 @router.get("/tags")
-async def get_tags(db: Session = Depends(get_db)):
+async def get_tags(db: AsyncDB = Depends(get_async_read_db)):
     """获取所有标签"""
     try:
         # 从API接口中提取标签
-        apis = db.query(admin_models.API.tags).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True,
-            admin_models.API.tags.is_not(None)
-        ).all()
+        apis = (await db.execute(
+            select(admin_models.API.tags).where(
+                *_public_api_filters(),
+                admin_models.API.tags.is_not(None)
+            )
+        )).all()
         
         # 统计标签使用次数
         tag_count = {}
@@ -459,7 +454,7 @@ async def get_apis_by_tag(
 ):
     """获取指定标签下的API接口"""
     try:
-        apis = db.query(admin_models.API).filter(
+        apis = db.query(admin_models.API, call_counter.total_calls_expr()).filter(
             admin_models.API.is_active == True,
             admin_models.API.is_public == True,
             admin_models.API.tags.contains([tag_name])
@@ -473,7 +468,7 @@ async def get_apis_by_tag(
         
         # 转换为响应格式
         items = []
-        for api in apis:
+        for api, calls in apis:
             api_dict = {
                 "id": api.id,
                 "title": api.title,
@@ -485,7 +480,7 @@ async def get_apis_by_tag(
                 "is_free": api.is_free,
                 "category": api.category,
                 "tags": api.tags,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "created_at": api.created_at
             }
             items.append(api_dict)
@@ -516,24 +511,23 @@ async def get_apis_by_tag(
 @router.get("/apis/{api_id}")
 async def get_api_detail(
     api_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncDB = Depends(get_async_read_db)
 ):
     """获取API详情"""
     try:
-        api = db.query(admin_models.API).options(
-            joinedload(admin_models.API.category)
-        ).filter(
-            admin_models.API.id == api_id,
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).first()
+        row = (await db.execute(
+            select(admin_models.API, call_counter.total_calls_expr()).options(
+                joinedload(admin_models.API.category)
+            ).where(admin_models.API.id == api_id, *_public_api_filters())
+        )).first()
         
-        if not api:
+        if not row:
             return {
                 "success": False,
                 "message": "API不存在",
                 "data": {"success": False}
             }
+        api, calls = row
         
         # 转换为响应格式
         api_dict = {
@@ -553,7 +547,7 @@ async def get_api_detail(
             "is_active": api.is_active,
             "is_public": api.is_public,
             "is_free": api.is_free,
-            "call_count": api.call_count,
+            "call_count": int(calls or 0),
             "category_id": api.category_id,
             "category": api.category.name if api.category else None,
             "tags": api.tags or "[]",
@@ -829,6 +823,13 @@ async def purchase_api(
         
         db.commit()
         
+        # 续费改变了到期时间，使密钥主体缓存失效
+        if existing_subscription:
+            key_principal.invalidate_subscription(existing_subscription.id)
+        else:
+            # 事务提交后再登记新密钥，避免回滚后过滤器中留下不存在的密钥
+            key_filter.add(subscription.api_key)
+        
         return {
             "success": True,
             "message": "购买成功",
@@ -851,22 +852,24 @@ async def purchase_api(
 @router.get("/recommendations")
 async def get_recommendations(
     limit: int = Query(10, ge=1, le=50, description="推荐数量"),
-    db: Session = Depends(get_db)
+    db: AsyncDB = Depends(get_async_read_db)
 ):
     """获取推荐API接口"""
     try:
-        # 基于调用次数和成功率推荐
-        apis = db.query(admin_models.API).filter(
-            admin_models.API.is_active == True,
-            admin_models.API.is_public == True
-        ).order_by(
-            admin_models.API.call_count.desc(),
-            admin_models.API.created_at.desc()
-        ).limit(limit).all()
+        # 基于调用次数和成功率推荐（分类随查询一起加载，异步会话不支持延迟加载）
+        api_calls = call_counter.total_calls_expr().label("total_calls")
+        apis = (await db.execute(
+            select(admin_models.API, api_calls).options(
+                joinedload(admin_models.API.category)
+            ).where(*_public_api_filters()).order_by(
+                api_calls.desc(),
+                admin_models.API.created_at.desc()
+            ).limit(limit)
+        )).all()
         
         # 转换为响应格式
         recommendations = []
-        for api in apis:
+        for api, calls in apis:
             # 计算成功率
             
             api_dict = {
@@ -880,7 +883,7 @@ async def get_recommendations(
                 "is_free": api.is_free,
                 "category": api.category,
                 "tags": api.tags,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "created_at": api.created_at
             }
             recommendations.append(api_dict)
@@ -951,16 +954,35 @@ async def call_api(
         # 4. 记录调用日志
         # 5. 更新调用统计
         
-        # 更新调用统计
-        subscription.used_calls += 1
-        if subscription.remaining_calls is not None:
-            subscription.remaining_calls -= 1
-        
-        api.call_count += 1
-        
-        db.commit()
-        
-        # 更新计数：已由 verify_and_record_api_call 内部完成
+        # 扣减剩余次数：与网关一致由Redis原子扣减，Redis不可用时才直接扣减数据库
+        remaining_calls = subscription.remaining_calls
+        result = None
+        if remaining_calls is not None:
+            result = quota.consume(subscription.id, remaining_calls)
+            if result is None:
+                subscription.remaining_calls -= 1
+                remaining_calls = subscription.remaining_calls
+            elif not result[0]:
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="API调用次数已用完"
+                )
+            else:
+                remaining_calls = result[1]
+        
+        # 更新调用统计：在Redis中累加，由后台任务批量刷写；Redis不可用时才直接写入数据库
+        db_decremented = subscription.remaining_calls is not None and result is None
+        used_calls = (subscription.used_calls or 0) + 1
+        if not usage_counter.incr_call(api.id, subscription.id):
+            subscription.used_calls = used_calls
+            call_counter.increment(db, api.id)
+            db.commit()
+        elif db_decremented:
+            db.commit()
+        if db_decremented:
+            # 数据库被直接扣减：由对账任务重置Redis配额，并使缓存的密钥主体失效
+            quota.mark_changed(subscription.id)
+            key_principal.invalidate_subscription(subscription.id)
         
         return {
             "success": True,
@@ -968,8 +990,8 @@ async def call_api(
             "data": {
                 "api_title": api.title,
                 "api_alias": api.alias,
-                "used_calls": subscription.used_calls,
-                "remaining_calls": subscription.remaining_calls,
+                "used_calls": used_calls,
+                "remaining_calls": remaining_calls,
                 "result": "模拟API返回数据"
             }
         }
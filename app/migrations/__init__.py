@@ -0,0 +1,151 @@
+"""
+数据库版本化迁移
+替代直接调用 Base.metadata.create_all：迁移脚本放在 app/migrations/versions/ 下，
+文件名以四位版本号开头（如 0002_api_rate_limit.py），模块内定义 DESCRIPTION 与 upgrade(conn)。
+已执行的版本记录在 schema_migrations 表中，启动时（init_db）按版本号顺序执行尚未执行的迁移。
+
+- 多个worker同时启动时用 MySQL 的 GET_LOCK 串行执行（SQLite 不加锁）
+- 迁移应可重复执行（加列、建索引前先检查是否已存在），以兼容由旧版 create_all 创建的库
+- MySQL 的DDL会隐式提交，迁移中途失败时已执行的语句不会回滚；修正后重新启动即可继续
+"""
+import importlib
+import logging
+import pkgutil
+from typing import Callable, List, Set
+from sqlalchemy import Column, DateTime, Index, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_PACKAGE = "app.migrations.versions"
+LOCK_NAME = "schema_migrations"
+LOCK_TIMEOUT = 60
+
+_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    _metadata,
+    Column("version", String(20), primary_key=True, comment="迁移版本号"),
+    Column("description", String(200), comment="迁移说明"),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now(), comment="执行时间"),
+)
+
+
+class Migration:
+    """versions/ 下的一个迁移脚本"""
+
+    def __init__(self, version: str, description: str, upgrade: Callable[[Connection], None]):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+
+
+def discover() -> List[Migration]:
+    """扫描 versions/ 下的迁移脚本，按版本号排序"""
+    package = importlib.import_module(VERSIONS_PACKAGE)
+    migrations = []
+    for info in sorted(pkgutil.iter_modules(package.__path__), key=lambda m: m.name):
+        version = info.name.split("_", 1)[0]
+        if not version.isdigit():
+            continue
+        module = importlib.import_module(f"{VERSIONS_PACKAGE}.{info.name}")
+        migrations.append(Migration(version, getattr(module, "DESCRIPTION", info.name), module.upgrade))
+    return migrations
+
+
+# ==================== 迁移脚本使用的辅助函数 ====================
+
+def has_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    return any(c["name"] == column_name for c in inspect(conn).get_columns(table_name))
+
+
+def has_index(conn: Connection, table_name: str, index_name: str) -> bool:
+    return any(i["name"] == index_name for i in inspect(conn).get_indexes(table_name))
+
+
+def add_column(conn: Connection, column: Column) -> bool:
+    """为已存在的表添加模型中定义的列（已存在时跳过），返回是否添加"""
+    table_name = column.table.name
+    if has_column(conn, table_name, column.name):
+        return False
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {ddl}"))
+    logger.info(f"已添加列 {table_name}.{column.name}")
+    return True
+
+
+def drop_column(conn: Connection, table_name: str, column_name: str) -> bool:
+    """删除已存在的列（不存在时跳过），返回是否删除"""
+    if not has_column(conn, table_name, column_name):
+        return False
+    conn.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {column_name}"))
+    logger.info(f"已删除列 {table_name}.{column_name}")
+    return True
+
+
+def create_index(conn: Connection, index: Index) -> bool:
+    """创建模型中定义的索引（已存在时跳过），返回是否创建"""
+    if has_index(conn, index.table.name, index.name):
+        return False
+    index.create(conn)
+    logger.info(f"已创建索引 {index.table.name}.{index.name}")
+    return True
+
+
+# ==================== 执行迁移 ====================
+
+def _acquire_lock(conn: Connection) -> bool:
+    if conn.dialect.name != "mysql":
+        return False
+    acquired = conn.execute(text("SELECT GET_LOCK(:name, :timeout)"), {"name": LOCK_NAME, "timeout": LOCK_TIMEOUT}).scalar()
+    if acquired != 1:
+        raise RuntimeError(f"等待数据库迁移锁超时（{LOCK_TIMEOUT}秒）")
+    return True
+
+
+def _release_lock(conn: Connection) -> None:
+    try:
+        conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+    except Exception as e:
+        logger.warning(f"释放数据库迁移锁失败: {e}")
+
+
+def applied_versions(conn: Connection) -> Set[str]:
+    """已执行的迁移版本"""
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade(engine: Engine) -> List[str]:
+    """按版本号顺序执行尚未执行的迁移，返回本次执行的版本号"""
+    executed: List[str] = []
+    with engine.connect() as conn:
+        locked = _acquire_lock(conn)
+        try:
+            _metadata.create_all(conn)
+            conn.commit()
+            # 加锁后再读取，其他worker已执行的迁移不会重复执行
+            done = applied_versions(conn)
+            for migration in discover():
+                if migration.version in done:
+                    continue
+                logger.info(f"执行数据库迁移 {migration.version}: {migration.description}")
+                migration.upgrade(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=migration.version,
+                    description=migration.description[:200]
+                ))
+                conn.commit()
+                executed.append(migration.version)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if locked:
+                _release_lock(conn)
+    if executed:
+        logger.info(f"数据库迁移完成: {', '.join(executed)}")
+    else:
+        logger.info("数据库结构已是最新版本")
+    return executed
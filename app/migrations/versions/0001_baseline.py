@@ -0,0 +1,15 @@
+"""
+基础表结构：创建模型中定义的所有表（已存在的表跳过）
+新库由此得到完整的当前结构，后续迁移中的加列、建索引会检查后跳过；
+已由旧版 create_all 创建的库只补建缺失的表，已有表的变更由后续迁移完成。
+"""
+from sqlalchemy.engine import Connection
+
+DESCRIPTION = "创建基础表"
+
+
+def upgrade(conn: Connection) -> None:
+    # 导入 models 时所有模型注册到 Base.metadata
+    from app.admin import models
+
+    models.Base.metadata.create_all(bind=conn)
@@ -0,0 +1,11 @@
+"""apis 表新增 rate_limit_per_minute 列（create_all 不会为已存在的表加列）"""
+from sqlalchemy.engine import Connection
+from app.migrations import add_column
+
+DESCRIPTION = "apis 表新增每分钟调用上限列"
+
+
+def upgrade(conn: Connection) -> None:
+    from app.admin import models
+
+    add_column(conn, models.API.__table__.c.rate_limit_per_minute)
@@ -0,0 +1,31 @@
+"""
+热点查询的组合索引
+- subscriptions(user_id, api_id, status)：购买、更新密钥时查找有效订阅
+- subscriptions(api_key, status, end_date, remaining_calls, user_id, api_id)：密钥验证的覆盖索引
+- orders(user_id, created_at)：用户订单列表
+- system_logs(actor_id, action, created_at)：用户最后登录时间
+- apis(is_active, is_public, call_count)：前台列表与热门排序
+验证索引是否生效：python scripts/explain_hot_queries.py
+"""
+from sqlalchemy.engine import Connection
+from app.migrations import create_index
+
+DESCRIPTION = "热点查询组合索引"
+
+INDEXES = (
+    ("subscriptions", "ix_subscriptions_user_api_status"),
+    ("subscriptions", "ix_subscriptions_key_cover"),
+    ("orders", "ix_orders_user_created"),
+    ("system_logs", "ix_system_logs_actor_action_created"),
+    ("apis", "ix_apis_active_public_calls"),
+)
+
+
+def upgrade(conn: Connection) -> None:
+    # 导入 models 时所有模型注册到 Base.metadata
+    from app.admin import models
+
+    for table_name, index_name in INDEXES:
+        table = models.Base.metadata.tables[table_name]
+        index = next(i for i in table.indexes if i.name == index_name)
+        create_index(conn, index)
@@ -0,0 +1,10 @@
+"""api_call_counters 分片计数表（apis.call_count 热点行拆分）"""
+from sqlalchemy.engine import Connection
+
+DESCRIPTION = "新增API调用次数分片计数表"
+
+
+def upgrade(conn: Connection) -> None:
+    from app.admin import models
+
+    models.APICallCounter.__table__.create(bind=conn, checkfirst=True)
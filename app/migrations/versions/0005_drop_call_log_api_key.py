@@ -0,0 +1,9 @@
+"""api_call_logs 表删除 api_key 列（明细日志不再保存API密钥明文）"""
+from sqlalchemy.engine import Connection
+from app.migrations import drop_column
+
+DESCRIPTION = "api_call_logs 表删除API密钥明文列"
+
+
+def upgrade(conn: Connection) -> None:
+    drop_column(conn, "api_call_logs", "api_key")
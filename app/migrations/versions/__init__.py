@@ -0,0 +1 @@
+"""数据库迁移脚本（文件名以四位版本号开头）"""
@@ -8,7 +8,9 @@ from app.admin import models as admin_models
 from app.admin import crud as admin_crud
 from . import schemas
 from app.cache import cache_manager
+from app.utils import call_counter, key_filter, key_principal
 from app.utils.webconfig_manager import get_config, ConfigKeys
+from app.utils.pagination import paginate
 from apis.tcaptcha.core import check_tencent_captcha
 import logging
 from datetime import datetime, timedelta
@@ -306,6 +308,8 @@ async def get_user_logs(
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
     action: Optional[str] = Query(None, description="动作筛选：login/logout/recharge/consume 等"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页返回的 next_cursor），传入时忽略 skip"),
+    with_total: bool = Query(True, description="是否统计总数，深分页时可关闭"),
     current_user: schemas.User = Depends(get_user_module_access),
     db: Session = Depends(get_db)
 ):
@@ -324,8 +328,8 @@ async def get_user_logs(
         if action:
             q = q.filter(admin_models.SystemLog.action == action)
 
-        total = q.count()
-        logs = q.order_by(admin_models.SystemLog.created_at.desc()).offset(skip).limit(limit).all()
+        result = paginate(q, admin_models.SystemLog, limit, skip, cursor, with_total)
+        logs = result.items
 
         items = []
         for log in logs:
@@ -339,10 +343,13 @@ async def get_user_logs(
 
         return schemas.PaginatedResponse(
             items=items,
-            total=total,
+            total=result.total,
             skip=skip,
-            limit=limit
+            limit=limit,
+            next_cursor=result.next_cursor
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取用户日志失败: {e}")
         raise HTTPException(
@@ -423,11 +430,13 @@ async def get_apis(
             )
         
         total = apis.count()
-        apis = apis.options(joinedload(admin_models.API.category)).offset(skip).limit(limit).all()
+        apis = apis.add_columns(call_counter.total_calls_expr()).options(
+            joinedload(admin_models.API.category)
+        ).offset(skip).limit(limit).all()
         
         # 转换为前台展示格式
         items = []
-        for api in apis:
+        for api, calls in apis:
             api_dict = {
                 "id": api.id,
                 "title": api.title,
@@ -440,7 +449,7 @@ async def get_apis(
                 "price_type": api.price_type,
                 "category": api.category.name if api.category else None,
                 "tags": api.tags,
-                "call_count": api.call_count,
+                "call_count": int(calls or 0),
                 "created_at": api.created_at
             }
             items.append(api_dict)
@@ -470,7 +479,7 @@ async def get_api_detail(
 ):
     """获取API接口详情"""
     try:
-        api = db.query(admin_models.API).options(
+        row = db.query(admin_models.API, call_counter.total_calls_expr()).options(
             joinedload(admin_models.API.category)
         ).filter(
             admin_models.API.id == api_id,
@@ -478,8 +487,9 @@ async def get_api_detail(
             admin_models.API.is_public == True
         ).first()
         
-        if not api:
+        if not row:
             return schemas.ResponseModel(success=False, message="API接口不存在")
+        api, calls = row
         
         # 转换为前台展示格式
         api_detail = {
@@ -494,7 +504,7 @@ async def get_api_detail(
             "price_type": api.price_type,
             "category": api.category.name if api.category else None,
             "tags": api.tags,
-            "call_count": api.call_count,
+            "call_count": int(calls or 0),
             "created_at": api.created_at,
             "updated_at": api.updated_at
         }
@@ -555,6 +565,7 @@ async def subscribe_api(
         
         # 清除相关缓存
         cache_manager.clear_pattern(f"user:*{current_user.id}*")
+        key_filter.add(db_subscription.api_key)
         
         return schemas.ResponseModel(
             success=True,
@@ -595,6 +606,7 @@ async def unsubscribe_api(
         
         # 清除相关缓存
         cache_manager.clear_pattern(f"user:*{current_user.id}*")
+        key_principal.invalidate_subscription(subscription.id)
         
         return schemas.ResponseModel(
             success=True,
@@ -651,12 +663,16 @@ async def update_api_key(
             )
         
         # 更新API密钥
+        old_api_key = subscription.api_key
         subscription.api_key = new_api_key
         subscription.updated_at = datetime.utcnow()
         db.commit()
         
         # 清除相关缓存
         cache_manager.clear_pattern(f"user:*{current_user.id}*")
+        key_principal.invalidate_api_key(old_api_key)
+        key_principal.invalidate_subscription(subscription.id)
+        key_filter.add(new_api_key)
         
         return schemas.ResponseModel(
             success=True,
@@ -204,9 +204,10 @@ class ErrorResponseModel(BaseModel):
 
 class PaginatedResponse(BaseModel):
     items: List[dict]
-    total: int
+    total: Optional[int] = None  # 未统计总数（with_total=false）时为空
     skip: int
     limit: int
+    next_cursor: Optional[str] = None  # 下一页游标，没有下一页时为空
 
 # API搜索和过滤模式
 class APISearch(BaseModel):
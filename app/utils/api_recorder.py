@@ -1,74 +1,22 @@
 """
 简化的API调用记录工具类
 只记录核心统计信息：API调用次数和用户使用次数
+计数先在Redis中累加，由后台任务批量刷写到MySQL（见 usage_counter）
+剩余调用次数由Redis Lua脚本原子扣减（见 quota）
+鉴权与计量的入口是网关（app.utils.gateway），这里只保留网关使用的校验与记录函数
 """
 import logging
+from datetime import datetime, timezone
 from typing import Optional
+from sqlalchemy import case
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status, Request
-from app.database import get_db
 from app.admin import models as admin_models
-from app.admin import crud
+from app.utils import call_counter, key_principal, quota, usage_counter
+from app.utils.key_principal import KeyPrincipal
 
 logger = logging.getLogger(__name__)
 
-def verify_and_record_api_call(
-    api_id: int,
-    request: Request = None,
-    api_key: str = None
-) -> Optional[admin_models.Subscription]:
-    """
-    验证API密钥并记录API调用统计
-    支持免费API（无需API密钥）
-    
-    Args:
-        api_key: API密钥
-        api_id: API ID
-        
-    Returns:
-        Subscription: 验证成功的订阅信息（免费API返回None）
-        
-    Raises:
-        HTTPException: 验证失败时抛出异常
-    """
-    db = next(get_db())
-    
-    try:
-        # 首先检查API是否为免费API
-        api = db.query(admin_models.API).filter(admin_models.API.id == api_id).first()
-        if not api:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="API接口不存在"
-            )
-        
-        # 检查API是否可用
-        if not api.is_active:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="API接口不可用"
-            )
-        
-        # 如果是免费API，直接记录调用并返回
-        if api.is_free:
-            record_free_api_call(api_id, db)
-            return None
-        
-        # 非免费API需要验证密钥
-        if api_key is None and request is not None:
-            api_key = extract_api_key_from_request(request)
-        
-        # 验证API密钥和API状态
-        subscription = verify_api_key(api_key, api_id, db)
-        
-        # 记录API调用统计
-        record_api_call(api_key, api_id, db)
-        
-        return subscription
-    finally:
-        db.close()
-
-
 def extract_api_key_from_request(request: Request) -> str:
     """从请求中提取 API Key，支持多种传递方式。
     优先级：query(apiKey|api_key) > headers(X-API-KEY) > Authorization: ApiKey <key>
@@ -95,59 +43,59 @@ def extract_api_key_from_request(request: Request) -> str:
         headers={"WWW-Authenticate": "ApiKey"}
     )
 
-def try_extract_api_key_from_request(request: Request) -> str:
-    """尝试从请求中提取 API Key，如果没有则返回None（用于免费API）"""
-    try:
-        return extract_api_key_from_request(request)
-    except HTTPException:
-        return None
-
 def record_api_call(
     api_key: str,
     api_id: int,
-    db: Session
+    db: Session,
+    principal: Optional[KeyPrincipal] = None,
+    decrement_remaining: bool = True
 ) -> bool:
     """
     记录API调用统计 - 只更新核心计数
     
+    在Redis中累加，由后台任务批量刷写；Redis不可用时直接执行 UPDATE ... SET x = x + 1
+    （剩余次数通常已在网关中由Redis扣减；仅当Redis扣减也失败时，回退路径才扣减数据库）
+    
     Args:
         api_key: API密钥
         api_id: API ID
         db: 数据库会话
+        principal: 已验证的密钥主体（为空时按api_key从缓存获取）
+        decrement_remaining: 回退路径是否扣减数据库中的剩余次数（Redis已扣减时为False）
         
     Returns:
         bool: 记录是否成功
     """
     try:
-        # 根据api_id查找API信息
-        api = db.query(admin_models.API).filter(
-            admin_models.API.id == api_id
-        ).first()
+        if principal is None:
+            principal = key_principal.get_principal(db, api_key)
         
-        if not api:
-            logger.warning(f"未找到API ID对应的接口: {api_id}")
-            return False
-        
-        # 根据api_key查找订阅信息
-        subscription = db.query(admin_models.Subscription).filter(
-            admin_models.Subscription.api_key == api_key
-        ).first()
-        
-        if not subscription:
+        if not principal:
             logger.warning(f"未找到API密钥对应的订阅: {api_key}")
             return False
         
-        # 更新API调用统计
-        api.call_count += 1
+        if usage_counter.incr_call(api_id, principal.subscription_id):
+            return True
+        
+        # 更新API调用统计（分片计数）
+        call_counter.increment(db, api_id)
         
         # 更新订阅使用统计
-        subscription.used_calls += 1
-        if subscription.remaining_calls is not None and subscription.remaining_calls > 0:
-            subscription.remaining_calls -= 1
+        values = {admin_models.Subscription.used_calls: admin_models.Subscription.used_calls + 1}
+        decrement_remaining = decrement_remaining and principal.remaining_calls is not None
+        if decrement_remaining:
+            remaining = admin_models.Subscription.remaining_calls
+            values[remaining] = case((remaining > 0, remaining - 1), else_=remaining)
+        db.query(admin_models.Subscription).filter(
+            admin_models.Subscription.id == principal.subscription_id
+        ).update(values, synchronize_session=False)
         
         db.commit()
+        if decrement_remaining:
+            # 数据库被直接扣减，由对账任务按数据库值重置Redis配额
+            quota.mark_changed(principal.subscription_id)
         
-        logger.info(f"API调用已记录: user_id={subscription.user_id}, api_id={api.id}")
+        logger.info(f"API调用已记录: user_id={principal.user_id}, api_id={api_id}")
         return True
         
     except Exception as e:
@@ -167,21 +115,14 @@ def record_free_api_call(api_id: int, db: Session) -> bool:
         bool: 记录是否成功
     """
     try:
-        # 根据api_id查找API信息
-        api = db.query(admin_models.API).filter(
-            admin_models.API.id == api_id
-        ).first()
-        
-        if not api:
-            logger.warning(f"未找到API ID对应的接口: {api_id}")
-            return False
-        
-        # 更新API调用统计
-        api.call_count += 1
+        if usage_counter.incr_call(api_id):
+            return True
         
+        # Redis不可用时直接写入数据库（分片计数）
+        call_counter.increment(db, api_id)
         db.commit()
         
-        logger.info(f"免费API调用已记录: api_id={api.id}")
+        logger.info(f"免费API调用已记录: api_id={api_id}")
         return True
         
     except Exception as e:
@@ -189,64 +130,30 @@ def record_free_api_call(api_id: int, db: Session) -> bool:
         db.rollback()
         return False
 
-def verify_api_key(api_key: str, api_id: int, db: Session) -> admin_models.Subscription:
+def check_principal(principal: KeyPrincipal, api_id: int) -> None:
     """
-    验证API密钥和API状态并返回订阅信息
+    校验密钥主体的订阅、用户与API状态（纯内存判断）
     
-    Args:
-        api_key: API密钥
-        api_id: API ID
-        db: 数据库会话
-        
-    Returns:
-        Subscription: 验证成功的订阅信息
-        
     Raises:
         HTTPException: 验证失败时抛出异常
     """
-    from datetime import datetime, timezone
-    
-    # 1. 检查API密钥格式
-    if not api_key or len(api_key.strip()) == 0:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, 
-            detail="API密钥不能为空", 
-            headers={"WWW-Authenticate": "ApiKey"}
-        )
-
-    # 2. 查找订阅记录
-    subscription = crud.SubscriptionCRUD.get_by_api_key(db, api_key)
-    # print("subscription",subscription.api_id)
-    if not subscription:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, 
-            detail="API密钥不存在", 
-            headers={"WWW-Authenticate": "ApiKey"}
-        )
-
-    # 3. 检查订阅状态
-    if subscription.status != "active":
+    # 1. 检查订阅状态
+    if principal.status != "active":
         status_messages = {
             "expired": "订阅已过期", 
             "cancelled": "订阅已取消", 
             "suspended": "订阅已暂停"
         }
-        message = status_messages.get(subscription.status, f"订阅状态异常: {subscription.status}")
+        message = status_messages.get(principal.status, f"订阅状态异常: {principal.status}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, 
             detail=message, 
             headers={"WWW-Authenticate": "ApiKey"}
         )
 
-    # 4. 检查订阅是否到期
+    # 2. 检查订阅是否到期（无时区的end_date按UTC处理）
     current_time = datetime.now(timezone.utc)
-    
-    # 确保end_date有时区信息
-    end_date = subscription.end_date
-    # print(end_date)
-    if end_date.tzinfo is None:
-        # 如果end_date没有时区信息，假设它是UTC时间
-        end_date = end_date.replace(tzinfo=timezone.utc)
+    end_date = principal.end_date_utc
     
     if end_date <= current_time:
         raise HTTPException(
@@ -255,53 +162,51 @@ def verify_api_key(api_key: str, api_id: int, db: Session) -> admin_models.Subsc
             headers={"WWW-Authenticate": "ApiKey"}
         )
 
-    # 5. 检查用户状态
-    if not subscription.user or not subscription.user.is_active:
+    # 3. 检查用户状态
+    if not principal.user_is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, 
             detail="用户账户已被禁用", 
             headers={"WWW-Authenticate": "ApiKey"}
         )
 
-    # 6. 检查订阅是否匹配指定的API
-    if subscription.api_id != api_id:
+    # 4. 检查订阅是否匹配指定的API
+    if principal.api_id != api_id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="API密钥不匹配此接口", 
             headers={"WWW-Authenticate": "ApiKey"}
         )
 
-    # 7. 查找并检查API状态
-    api = db.query(admin_models.API).filter(admin_models.API.id == api_id).first()
-    if not api:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, 
-            detail="API接口不存在"
-        )
-
-    # 8. 检查API是否可用
-    if not api.is_active:
+    # 5. 检查API是否可用
+    if not principal.api_is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, 
             detail="API接口不可用", 
             headers={"WWW-Authenticate": "ApiKey"}
         )
 
-    # 9. 检查API是否已废弃
-    if hasattr(api, 'deprecated') and api.deprecated:
+    # 6. 检查API是否已废弃
+    if principal.api_deprecated:
         raise HTTPException(
             status_code=status.HTTP_410_GONE, 
             detail="API接口已废弃，请使用新版本", 
             headers={"WWW-Authenticate": "ApiKey"}
         )
 
-    # 10. 检查调用次数限制（如果有）
-    if subscription.remaining_calls is not None and subscription.remaining_calls <= 0:
+def apply_quota_result(principal: KeyPrincipal, result) -> Optional[int]:
+    """处理配额扣减结果，次数已用完时抛出429"""
+    # Redis不可用时回退到密钥主体中的剩余次数判断
+    if result is None:
+        allowed, remaining = principal.remaining_calls > 0, None
+    else:
+        allowed, remaining = result
+    
+    if not allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS, 
             detail="API调用次数已用完", 
             headers={"WWW-Authenticate": "ApiKey"}
         )
-
-    return subscription
-
+    
+    return remaining
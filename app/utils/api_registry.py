@@ -0,0 +1,224 @@
+"""
+开放API注册表
+启动时扫描 apis/* 下的每个包，按别名（core.py 中的 API_ALIAS，缺省为包名）绑定到 apis 表中的记录，
+在内存中维护一份只读的元数据表，网关验证时只需一次字典查找。
+
+- 新增API只需放入一个包含 api.py（导出 router）的包，并在后台创建同别名的API记录
+- 包加载失败默认中止启动（与逐个导入时一致）；app.registry.skip_failed_packages 开启后改为记录错误并跳过
+- 没有同别名记录的包按接口地址（/api/<路由前缀>）匹配数据库记录并告警，提示在 core.py 中设置 API_ALIAS
+- router 下的路由都经过网关鉴权与计量；无需鉴权的页面（示例页等）放在可选的 public_router 中
+- 元数据表整体替换（不可变的 MappingProxyType），读取无需加锁
+- API变更通过失效总线通知所有worker刷新；周期任务兜底
+"""
+import importlib
+import logging
+import pkgutil
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+from fastapi import APIRouter
+from app.config import config
+from app.database import db_manager
+from app.admin import models as admin_models
+from app.utils import invalidation
+
+logger = logging.getLogger(__name__)
+
+APIS_PACKAGE = "apis"
+
+REFRESH_INTERVAL = config.get('app.registry.refresh_interval', 30)
+# 别名未绑定时按需刷新的最小间隔（秒），避免不存在的别名反复触发数据库查询
+MISS_REFRESH_INTERVAL = config.get('app.registry.miss_refresh_interval', 5)
+SKIP_FAILED_PACKAGES = config.get('app.registry.skip_failed_packages', False)
+
+_EMPTY: Mapping[Any, Mapping[str, Any]] = MappingProxyType({})
+
+
+class APIModule:
+    """apis/* 下发现的一个API包"""
+
+    def __init__(self, name: str, alias: str, router: APIRouter, public_router: Optional[APIRouter] = None):
+        self.name = name
+        self.alias = alias
+        self.router = router
+        self.public_router = public_router
+
+
+_modules: Dict[str, APIModule] = {}
+# 路由前缀（/api 之后的第一段）-> 别名
+_prefix_aliases: Dict[str, str] = {}
+_by_alias: Mapping[str, Mapping[str, Any]] = _EMPTY
+_by_id: Mapping[int, Mapping[str, Any]] = _EMPTY
+_refresh_lock = threading.Lock()
+_last_refresh = 0.0
+# 上次报告的别名不一致情况（内容变化时才再次告警，避免周期刷新刷屏）
+_last_report: Tuple[Tuple[str, ...], Tuple[str, ...]] = ((), ())
+
+
+def _package_alias(name: str) -> Optional[str]:
+    """包的别名：core.py 中的 API_ALIAS（没有 core 模块或未设置时返回None）"""
+    try:
+        core = importlib.import_module(f"{APIS_PACKAGE}.{name}.core")
+    except ModuleNotFoundError as e:
+        if e.name != f"{APIS_PACKAGE}.{name}.core":
+            raise
+        return None
+    return getattr(core, "API_ALIAS", None)
+
+
+def discover() -> Dict[str, APIModule]:
+    """扫描 apis/* 包（结果缓存，只扫描一次）"""
+    if _modules:
+        return _modules
+
+    package = importlib.import_module(APIS_PACKAGE)
+    modules: Dict[str, APIModule] = {}
+    prefix_aliases: Dict[str, str] = {}
+    for info in sorted(pkgutil.iter_modules(package.__path__), key=lambda m: m.name):
+        if not info.ispkg:
+            continue
+        name = info.name
+        try:
+            api_module = importlib.import_module(f"{APIS_PACKAGE}.{name}.api")
+        except Exception as e:
+            if not SKIP_FAILED_PACKAGES:
+                raise
+            logger.error(f"加载API包失败，已跳过 {name}: {e}")
+            continue
+        router = getattr(api_module, "router", None)
+        if not isinstance(router, APIRouter):
+            logger.warning(f"API包 {name} 未导出 router，已跳过")
+            continue
+        alias = _package_alias(name) or name
+        public_router = getattr(api_module, "public_router", None)
+        modules[alias] = APIModule(name, alias, router, public_router)
+        prefix_aliases[router.prefix.strip("/") or name] = alias
+
+    # 全部加载成功后再登记，加载失败中止时不留下部分结果
+    _modules.update(modules)
+    _prefix_aliases.update(prefix_aliases)
+
+    logger.info(f"发现 {len(_modules)} 个API包: {', '.join(_modules)}")
+    return _modules
+
+
+def include_routers(app, prefix: str = "/api", dependencies: Optional[Sequence[Any]] = None) -> None:
+    """
+    把发现的API路由注册到应用
+
+    Args:
+        app: FastAPI应用
+        prefix: 路由前缀
+        dependencies: 挂在 router（不含 public_router）上的依赖，即网关鉴权
+    """
+    gated = APIRouter(prefix=prefix, dependencies=list(dependencies or []))
+    for module in discover().values():
+        gated.include_router(module.router, tags=["API"])
+        if module.public_router is not None:
+            app.include_router(module.public_router, prefix=prefix, tags=["API"])
+    app.include_router(gated)
+
+
+def alias_for_prefix(segment: str, default: Optional[str] = None) -> str:
+    """由路由前缀解析API别名（未登记的前缀返回 default，缺省原样返回）"""
+    discover()
+    return _prefix_aliases.get(segment, segment if default is None else default)
+
+
+def _to_state(api) -> Mapping[str, Any]:
+    return MappingProxyType({
+        "id": api.id,
+        "alias": api.alias,
+        "is_active": bool(api.is_active),
+        "is_free": bool(api.is_free),
+        "deprecated": bool(api.deprecated),
+        "rate_limit_per_minute": api.rate_limit_per_minute,
+    })
+
+
+def _endpoint_prefix(endpoint: Optional[str]) -> str:
+    """接口地址中 /api 之后的第一段（如 /api/ip/query -> ip）"""
+    parts = [p for p in urlparse(endpoint or "").path.split("/") if p]
+    if parts and parts[0] == "api":
+        parts = parts[1:]
+    return parts[0] if parts else ""
+
+
+def _bind_modules(by_alias: Dict[str, Mapping[str, Any]], by_prefix: Dict[str, Mapping[str, Any]]):
+    """把没有同别名记录的包按接口地址绑定，返回 (按接口地址绑定的说明, 未绑定的包)"""
+    mismatched: List[str] = []
+    unbound: List[str] = []
+    for alias, module in discover().items():
+        if alias in by_alias:
+            continue
+        state = by_prefix.get(module.router.prefix.strip("/") or module.name)
+        if state is None:
+            unbound.append(alias)
+        else:
+            by_alias[alias] = state
+            mismatched.append(f"{alias} -> {state['alias']}")
+    return mismatched, unbound
+
+
+def _report(mismatched: List[str], unbound: List[str]) -> None:
+    global _last_report
+    report = (tuple(mismatched), tuple(unbound))
+    if report == _last_report:
+        return
+    _last_report = report
+    if mismatched:
+        logger.warning(
+            f"以下API包的别名与数据库记录不一致，已按接口地址绑定（请在 core.py 中设置 API_ALIAS）: {', '.join(mismatched)}"
+        )
+    if unbound:
+        logger.warning(f"以下API包在数据库中没有对应的记录，调用将返回404: {', '.join(unbound)}")
+
+
+def refresh() -> int:
+    """从数据库重新加载元数据表，返回已绑定的API数量"""
+    global _by_alias, _by_id, _last_refresh
+    with _refresh_lock:
+        db = db_manager.create_session()
+        try:
+            API = admin_models.API
+            apis = db.query(
+                API.id, API.alias, API.is_active, API.is_free, API.deprecated, API.rate_limit_per_minute,
+                API.endpoint
+            ).all()
+            states = [(_to_state(api), _endpoint_prefix(api.endpoint)) for api in apis]
+        except Exception as e:
+            logger.error(f"刷新API注册表失败: {e}")
+            return len(_by_alias)
+        finally:
+            db.close()
+
+        by_alias = {state["alias"]: state for state, _ in states}
+        by_prefix = {prefix: state for state, prefix in states if prefix}
+        mismatched, unbound = _bind_modules(by_alias, by_prefix)
+        _by_alias = MappingProxyType(by_alias)
+        _by_id = MappingProxyType({state["id"]: state for state, _ in states})
+        _last_refresh = time.monotonic()
+
+    _report(mismatched, unbound)
+    return len(by_alias)
+
+
+def refresh_on_miss() -> None:
+    """别名/ID未命中时按需刷新（限频）"""
+    if time.monotonic() - _last_refresh >= MISS_REFRESH_INTERVAL:
+        refresh()
+
+
+def get_by_alias(alias: str) -> Optional[Mapping[str, Any]]:
+    """按别名获取API元数据（只读）"""
+    return _by_alias.get(alias)
+
+
+def get_by_id(api_id: int) -> Optional[Mapping[str, Any]]:
+    """按ID获取API元数据（只读）"""
+    return _by_id.get(api_id)
+
+
+invalidation.subscribe("api", lambda api_id: refresh())
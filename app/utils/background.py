@@ -0,0 +1,64 @@
+"""
+后台周期任务
+在应用 lifespan 中启动，按固定间隔把同步任务放到线程池执行，避免阻塞事件循环
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (任务名, asyncio.Task, 同步函数, 关闭时是否再执行一次)
+_tasks: List[Tuple[str, asyncio.Task, Optional[Callable[[], object]], bool]] = []
+
+
+async def _run_periodic(name: str, interval: float, func: Callable[[], object]):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, func)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"后台任务执行失败 {name}: {e}")
+
+
+def start_periodic(name: str, interval: float, func: Callable[[], object], run_on_stop: bool = False):
+    """启动周期任务（需在事件循环中调用）
+
+    Args:
+        name: 任务名（用于日志）
+        interval: 执行间隔（秒）
+        func: 同步函数，在线程池中执行
+        run_on_stop: 应用关闭时是否再执行一次（如刷写缓冲数据）
+    """
+    task = asyncio.create_task(_run_periodic(name, interval, func))
+    _tasks.append((name, task, func, run_on_stop))
+    logger.info(f"后台任务已启动: {name}（间隔 {interval}s）")
+    return task
+
+
+def start_task(name: str, coro: Awaitable[object]):
+    """启动长期运行的协程任务（如消息订阅），应用关闭时随 stop_all 取消"""
+    task = asyncio.create_task(coro)
+    _tasks.append((name, task, None, False))
+    logger.info(f"后台任务已启动: {name}")
+    return task
+
+
+async def stop_all():
+    """停止所有周期任务，并执行需要在关闭时收尾的任务"""
+    loop = asyncio.get_running_loop()
+    for name, task, func, run_on_stop in _tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        if run_on_stop:
+            try:
+                await loop.run_in_executor(None, func)
+            except Exception as e:
+                logger.error(f"后台任务收尾失败 {name}: {e}")
+    _tasks.clear()
@@ -0,0 +1,129 @@
+"""
+API调用次数分片计数
+所有对某个API的调用都累加 apis.call_count 同一行时，InnoDB行锁使写入串行化。
+写入改为累加 api_call_counters 中随机选择的一个分片（api_id, shard），不同写入者大概率落在不同的行上；
+后台任务定期把分片合并回 apis.call_count 并删除已合并的分片。
+
+- 读取总调用次数时需加上尚未合并的分片：total_calls_expr() / total_calls_sum()
+- 合并按 api_id 分批，每批在一个事务中锁定该批API的分片行（FOR UPDATE）、累加到 apis 并删除，
+  与并发写入不会丢失或重复计数，每次只锁定一小部分行
+- 各worker都启动了合并任务，用 MySQL 的 GET_LOCK 保证同一时刻只有一个worker在合并（拿不到锁直接跳过）
+"""
+import logging
+import random
+from typing import Dict, List
+from sqlalchemy import case, delete, func, select, text, tuple_, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from app.config import config
+from app.database import db_manager, insert_or_increment
+from app.admin import models as admin_models
+
+logger = logging.getLogger(__name__)
+
+SHARDS = config.get('app.usage.counter_shards', 16)
+COMPACT_INTERVAL = config.get('app.usage.counter_compact_interval', 300)
+COMPACT_BATCH = config.get('app.usage.counter_compact_batch', 100)
+LOCK_NAME = "api_call_counters_compact"
+
+
+def add(db: Session, api_deltas: Dict[int, int]) -> None:
+    """把各API的调用次数累加到随机分片（不提交，由调用方在同一事务中提交）"""
+    if not api_deltas:
+        return
+    stmt = insert_or_increment(
+        db.get_bind().dialect.name, admin_models.APICallCounter, ("api_id", "shard"), ("count",)
+    )
+    db.execute(stmt, [
+        {"api_id": api_id, "shard": random.randrange(SHARDS), "count": delta}
+        for api_id, delta in api_deltas.items()
+    ])
+
+
+def increment(db: Session, api_id: int, amount: int = 1) -> None:
+    """累加一个API的调用次数（不提交）"""
+    add(db, {api_id: amount})
+
+
+def total_calls_expr():
+    """某个API的总调用次数（apis.call_count + 未合并分片），用于查询列与排序"""
+    API, Counter = admin_models.API, admin_models.APICallCounter
+    pending = select(func.sum(Counter.count)).where(Counter.api_id == API.id).scalar_subquery()
+    return func.coalesce(API.call_count, 0) + func.coalesce(pending, 0)
+
+
+def total_calls_sum():
+    """所有API的总调用次数（标量子查询，可用于 select 或 db.scalar）"""
+    API, Counter = admin_models.API, admin_models.APICallCounter
+    merged = select(func.coalesce(func.sum(API.call_count), 0)).scalar_subquery()
+    pending = select(func.coalesce(func.sum(Counter.count), 0)).scalar_subquery()
+    return select(merged + pending)
+
+
+def _acquire_lock(conn: Connection) -> bool:
+    """获取合并锁（不等待）；非MySQL数据库没有 GET_LOCK，直接返回True"""
+    if conn.dialect.name != "mysql":
+        return True
+    return conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME}).scalar() == 1
+
+
+def _release_lock(conn: Connection) -> None:
+    if conn.dialect.name != "mysql":
+        return
+    try:
+        conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+    except Exception as e:
+        logger.warning(f"释放分片合并锁失败: {e}")
+
+
+def _compact_batch(conn: Connection, api_ids: List[int]) -> int:
+    """合并一批API的分片（一个事务），返回合并的API数量"""
+    API, Counter = admin_models.API, admin_models.APICallCounter
+    rows = conn.execute(
+        select(Counter.api_id, Counter.shard, Counter.count)
+        .where(Counter.api_id.in_(api_ids))
+        .with_for_update()
+    ).all()
+    if not rows:
+        conn.rollback()
+        return 0
+    totals: Dict[int, int] = {}
+    for api_id, _, count in rows:
+        totals[api_id] = totals.get(api_id, 0) + int(count or 0)
+    conn.execute(
+        update(API)
+        .where(API.id.in_(list(totals)))
+        .values(call_count=func.coalesce(API.call_count, 0) + case(totals, value=API.id, else_=0))
+    )
+    # 只删除本次锁定并合并的分片
+    conn.execute(
+        delete(Counter).where(tuple_(Counter.api_id, Counter.shard).in_([(r[0], r[1]) for r in rows]))
+    )
+    conn.commit()
+    return len(totals)
+
+
+def compact_call_counters() -> int:
+    """把分片计数合并到 apis.call_count，返回合并的API数量"""
+    Counter = admin_models.APICallCounter
+    # GET_LOCK 属于连接：整个合并过程使用同一个连接，各批次提交后仍持有锁
+    with db_manager.get_engine().connect() as conn:
+        try:
+            if not _acquire_lock(conn):
+                logger.debug("其它worker正在合并API调用分片计数，跳过")
+                return 0
+        except Exception as e:
+            logger.error(f"获取分片合并锁失败: {e}")
+            return 0
+        merged = 0
+        try:
+            api_ids = list(conn.execute(select(Counter.api_id).distinct()).scalars())
+            conn.commit()
+            for start in range(0, len(api_ids), COMPACT_BATCH):
+                merged += _compact_batch(conn, api_ids[start:start + COMPACT_BATCH])
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"合并API调用分片计数失败: {e}")
+        finally:
+            _release_lock(conn)
+        return merged
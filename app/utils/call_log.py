@@ -0,0 +1,207 @@
+"""
+开放API调用明细日志
+网关在响应发送后把使用事件放入进程内的有界队列（请求路径上只有一次入队），
+由独立的写入线程按批次（每 batch_size 条或每 flush_interval_ms 毫秒）以多行 INSERT 写入 api_call_logs。
+
+- 队列满时直接丢弃并计数，不阻塞请求，也不无限占用内存；丢弃数量可通过 stats() 查看
+- 写入失败的批次同样计入丢弃数量（明细日志只用于统计，不影响计费与计数）
+- 应用关闭时 stop() 会写完队列中剩余的记录
+- 过期明细由周期任务 prune_call_logs 分批删除
+- 不记录API密钥明文，调用方由 subscription_id 标识
+"""
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from sqlalchemy import delete, insert, select
+from app.config import config
+from app.database import db_manager
+from app.admin import models as admin_models
+from app.utils import gateway, metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = config.get('app.call_log.queue_size', 10000)
+BATCH_SIZE = config.get('app.call_log.batch_size', 500)
+FLUSH_INTERVAL_MS = config.get('app.call_log.flush_interval_ms', 200)
+RETENTION_DAYS = config.get('app.call_log.retention_days', 30)
+PRUNE_INTERVAL = config.get('app.call_log.prune_interval', 3600)
+PRUNE_CHUNK = 5000
+# 丢弃告警的最小间隔（秒），避免队列持续溢出时刷屏
+DROP_WARN_INTERVAL = 10
+
+metrics.counter("call_log_dropped_total", "丢弃的调用日志条数（队列已满或写入失败）")
+
+_queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=QUEUE_SIZE)
+_stats_lock = threading.Lock()
+_dropped = 0
+_written = 0
+_last_drop_warning = 0.0
+_writer: Optional[threading.Thread] = None
+
+
+def _count_dropped(amount: int) -> None:
+    global _dropped, _last_drop_warning
+    metrics.inc("call_log_dropped_total", amount=amount)
+    with _stats_lock:
+        _dropped += amount
+        now = time.monotonic()
+        warn = now - _last_drop_warning >= DROP_WARN_INTERVAL
+        if warn:
+            _last_drop_warning = now
+        total = _dropped
+    if warn:
+        logger.warning(f"调用日志队列已满或写入失败，已累计丢弃 {total} 条")
+
+
+def _to_row(event: gateway.UsageEvent) -> Dict[str, Any]:
+    return {
+        "api_id": event.api_id,
+        "subscription_id": event.subscription_id,
+        "user_id": event.user_id,
+        "method": event.method,
+        "path": event.path[:500],
+        "status_code": event.status_code,
+        "latency_ms": event.latency_ms,
+        "response_bytes": event.response_bytes,
+        "client_ip": event.client_ip,
+        "created_at": event.created_at,
+    }
+
+
+def enqueue(event: gateway.UsageEvent) -> bool:
+    """把一次调用放入写入队列（不阻塞），队列已满时丢弃并返回False"""
+    try:
+        _queue.put_nowait(_to_row(event))
+        return True
+    except queue.Full:
+        _count_dropped(1)
+        return False
+
+
+def _write_batch(rows: List[Dict[str, Any]]) -> None:
+    global _written
+    db = db_manager.create_session()
+    try:
+        db.execute(insert(admin_models.APICallLog), rows)
+        db.commit()
+        with _stats_lock:
+            _written += len(rows)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"写入调用日志失败（{len(rows)} 条）: {e}")
+        _count_dropped(len(rows))
+    finally:
+        db.close()
+
+
+def _run_writer() -> None:
+    interval = FLUSH_INTERVAL_MS / 1000
+    batch: List[Dict[str, Any]] = []
+    deadline = time.monotonic() + interval
+    stopping = False
+    while not stopping:
+        timeout = deadline - time.monotonic()
+        try:
+            row = _queue.get(timeout=timeout) if timeout > 0 else _queue.get_nowait()
+            if row is None:
+                stopping = True
+            else:
+                batch.append(row)
+        except queue.Empty:
+            pass
+
+        if batch and (stopping or len(batch) >= BATCH_SIZE or time.monotonic() >= deadline):
+            _write_batch(batch)
+            batch = []
+        if time.monotonic() >= deadline or not batch:
+            deadline = time.monotonic() + interval
+
+    # 停止标记之后仍可能有入队的记录
+    rest: List[Dict[str, Any]] = []
+    while True:
+        try:
+            row = _queue.get_nowait()
+        except queue.Empty:
+            break
+        if row is not None:
+            rest.append(row)
+    for i in range(0, len(rest), BATCH_SIZE):
+        _write_batch(rest[i:i + BATCH_SIZE])
+
+
+def start() -> None:
+    """启动写入线程（在 lifespan 中调用）"""
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    _writer = threading.Thread(target=_run_writer, name="call-log-writer", daemon=True)
+    _writer.start()
+    logger.info(f"调用日志写入线程已启动（批量 {BATCH_SIZE} 条 / {FLUSH_INTERVAL_MS}ms）")
+
+
+def stop(timeout: float = 10.0) -> None:
+    """停止写入线程，写完队列中剩余的记录"""
+    global _writer
+    if _writer is None:
+        return
+    try:
+        _queue.put(None, timeout=timeout)
+    except queue.Full:
+        logger.error("调用日志队列已满，无法发送停止标记")
+    _writer.join(timeout)
+    if _writer.is_alive():
+        logger.warning("调用日志写入线程未在超时内结束")
+    _writer = None
+
+
+def stats() -> Dict[str, int]:
+    """写入队列状态：当前排队数、累计写入数、累计丢弃数"""
+    with _stats_lock:
+        return {
+            "queued": _queue.qsize(),
+            "capacity": QUEUE_SIZE,
+            "written": _written,
+            "dropped": _dropped,
+        }
+
+
+@metrics.register_collector
+def _collect_queue():
+    return [metrics.queue_depth("call_log", _queue.qsize())]
+
+
+def prune_call_logs() -> int:
+    """分批删除超过保留天数的调用明细，返回删除的行数"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+    Log = admin_models.APICallLog
+    total = 0
+    db = db_manager.create_session()
+    try:
+        while True:
+            ids = db.execute(
+                select(Log.id).where(Log.created_at < cutoff).limit(PRUNE_CHUNK)
+            ).scalars().all()
+            if not ids:
+                break
+            db.execute(delete(Log).where(Log.id.in_(ids)))
+            db.commit()
+            total += len(ids)
+            if len(ids) < PRUNE_CHUNK:
+                break
+    except Exception as e:
+        db.rollback()
+        logger.error(f"清理过期调用日志失败: {e}")
+    finally:
+        db.close()
+    if total:
+        logger.info(f"已清理 {total} 条过期调用日志")
+    return total
+
+
+@gateway.subscribe_usage_events
+async def log_api_call(event: gateway.UsageEvent) -> None:
+    """使用事件处理：写入调用明细队列"""
+    enqueue(event)
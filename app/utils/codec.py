@@ -0,0 +1,181 @@
+"""
+缓存值编解码
+写入Redis的缓存值以一个类型字节开头，读取时按类型字节直接解码，不再对每个值尝试 json.loads：
+
+    类型字节 = 压缩算法 << 3 | 值类型（都小于 0x20，不会与旧格式的可打印文本混淆）
+    值类型：str / int / float / bool / JSON / msgpack
+    压缩算法：无 / zlib / zstd / lz4
+
+- 结构（dict/list/tuple）按 app.cache.codec.serializer 序列化：auto（orjson 已安装时用 orjson，否则标准库 json）、
+  orjson、msgpack 或 json；orjson 不支持的值（如超过64位的整数）退回标准库 json
+- 编码后不小于 compress_threshold 字节时按 compression 压缩：auto（依次选择已安装的 zstd、lz4，否则标准库 zlib）、
+  zstd、lz4、zlib 或 none；压缩后没有变小时保留原文
+- orjson、msgpack、zstandard、lz4 都是可选依赖；读到本进程不支持的格式时抛出 ValueError（调用方按未命中处理）
+- 没有类型字节的值（升级前写入的旧缓存）按旧规则解析，随TTL过期后不再出现
+"""
+import json
+import logging
+import zlib
+from typing import Any, Callable, Dict, Tuple, Union
+from app.config import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+# 值类型（低3位）
+STR = 1
+INT = 2
+FLOAT = 3
+BOOL = 4
+JSON = 5
+MSGPACK = 6
+
+# 压缩算法（高位）
+NONE = 0
+ZLIB = 1
+ZSTD = 2
+LZ4 = 3
+
+SERIALIZER = config.get('app.cache.codec.serializer', 'auto')
+COMPRESSION = config.get('app.cache.codec.compression', 'auto')
+COMPRESS_THRESHOLD = config.get('app.cache.codec.compress_threshold', 1024)
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _orjson_dumps(value: Any) -> bytes:
+    try:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return _json_dumps(value)
+
+
+def _json_loads(payload: bytes) -> Any:
+    return orjson.loads(payload) if orjson is not None else json.loads(payload)
+
+
+def _choose_serializer() -> Tuple[int, Callable[[Any], bytes]]:
+    name = SERIALIZER
+    if name == "msgpack" and msgpack is not None:
+        return MSGPACK, lambda value: msgpack.packb(value, use_bin_type=True)
+    if name in ("auto", "orjson") and orjson is not None:
+        return JSON, _orjson_dumps
+    if name not in ("auto", "json"):
+        logger.warning(f"缓存序列化方式 {name} 不可用（未安装或未知），使用标准库 json")
+    return JSON, _json_dumps
+
+
+def _choose_compressor() -> Tuple[int, Callable[[bytes], bytes]]:
+    name = COMPRESSION
+    if name == "none":
+        return NONE, None
+    if name in ("auto", "zstd") and zstandard is not None:
+        return ZSTD, zstandard.ZstdCompressor(level=3).compress
+    if name in ("auto", "lz4") and lz4_frame is not None:
+        return LZ4, lz4_frame.compress
+    if name not in ("auto", "zlib"):
+        logger.warning(f"缓存压缩算法 {name} 不可用（未安装或未知），使用标准库 zlib")
+    return ZLIB, lambda payload: zlib.compress(payload, 1)
+
+
+def _decompressors() -> Dict[int, Callable[[bytes], bytes]]:
+    # 解压与配置无关：其它worker可能用不同配置写入，只要本进程安装了对应的库就能读
+    result = {ZLIB: zlib.decompress}
+    if zstandard is not None:
+        result[ZSTD] = zstandard.ZstdDecompressor().decompress
+    if lz4_frame is not None:
+        result[LZ4] = lz4_frame.decompress
+    return result
+
+
+_STRUCTURE_KIND, _dump_structure = _choose_serializer()
+_COMPRESSION, _compress = _choose_compressor()
+_DECOMPRESS = _decompressors()
+
+
+def encode(value: Any) -> bytes:
+    """编码缓存值：类型字节 + 数据（超过阈值时压缩）"""
+    if isinstance(value, str):
+        kind, payload = STR, value.encode("utf-8")
+    elif isinstance(value, bool):
+        kind, payload = BOOL, b"1" if value else b"0"
+    elif isinstance(value, int):
+        kind, payload = INT, str(value).encode("ascii")
+    elif isinstance(value, float):
+        kind, payload = FLOAT, repr(value).encode("ascii")
+    elif isinstance(value, (dict, list, tuple)):
+        kind, payload = _STRUCTURE_KIND, _dump_structure(value)
+    else:
+        kind, payload = STR, str(value).encode("utf-8")
+
+    compression = NONE
+    if _compress is not None and len(payload) >= COMPRESS_THRESHOLD:
+        packed = _compress(payload)
+        if len(packed) < len(payload):
+            compression, payload = _COMPRESSION, packed
+    return bytes((compression << 3 | kind,)) + payload
+
+
+def _decode_legacy(raw: bytes) -> Any:
+    """旧格式（无类型字节）：按原规则尝试解析JSON，失败时作为字符串"""
+    text = raw.decode("utf-8", errors="replace")
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def decode(raw: Union[bytes, str, None]) -> Any:
+    """解码缓存值（None 表示不存在）"""
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if not raw:
+        return ""
+    header = raw[0]
+    kind, compression = header & 0x07, header >> 3
+    if header >= 0x20 or not STR <= kind <= MSGPACK:
+        return _decode_legacy(raw)
+
+    payload = raw[1:]
+    if compression:
+        decompress = _DECOMPRESS.get(compression)
+        if decompress is None:
+            raise ValueError(f"不支持的缓存压缩算法: {compression}")
+        payload = decompress(payload)
+
+    if kind == STR:
+        return payload.decode("utf-8")
+    if kind == JSON:
+        return _json_loads(payload)
+    if kind == INT:
+        return int(payload)
+    if kind == FLOAT:
+        return float(payload)
+    if kind == BOOL:
+        return payload == b"1"
+    if msgpack is None:
+        raise ValueError("缓存值为 msgpack 格式，但未安装 msgpack")
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
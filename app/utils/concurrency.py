@@ -0,0 +1,54 @@
+"""
+同步代码线程池卸载
+async 路由中调用阻塞代码（同步SQLAlchemy、requests 上游请求等）会冻结整个事件循环，
+统一通过 run_sync 放到有界线程池执行。线程池大小可配置，避免慢上游占满默认线程池。
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+from app.config import config
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MAX_WORKERS = config.get('app.concurrency.max_workers', 64)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """获取共享线程池（延迟创建）"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="api-offload")
+        logger.info(f"线程池已创建: max_workers={MAX_WORKERS}")
+    return _executor
+
+
+async def run_sync(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """在线程池中执行同步函数并等待结果（保留 contextvars 上下文）"""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
+
+
+@metrics.register_collector
+def _collect_executor():
+    """线程池中等待执行的任务数"""
+    if _executor is None:
+        return []
+    return [metrics.queue_depth("executor", _executor._work_queue.qsize())]
+
+
+def shutdown(wait: bool = True) -> None:
+    """关闭线程池（应用关闭时调用）"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
@@ -0,0 +1,292 @@
+"""
+开放API网关
+挂载在 /api 前缀上的统一依赖与中间件，负责所有开放API的鉴权、计量与计时，路由本身只处理业务：
+
+- api_gateway（依赖）：按路径解析API别名（注册表），校验API状态、频率限制、API密钥与剩余次数，
+  通过后把调用信息保存在 request.state.usage_event
+- GatewayMiddleware（ASGI中间件）：记录耗时（含分阶段耗时）、响应状态码与响应字节数，在响应发送完成后异步分发使用事件，
+  调用计数等计量逻辑不在请求的关键路径上
+- subscribe_usage_events：注册使用事件的处理函数（调用计数、调用日志、统计等）
+
+鉴权路径上不执行阻塞I/O：API状态、密钥主体走注册表/进程内缓存/异步Redis，
+只有缓存未命中和Redis不可用时的回退才放到线程池。
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from fastapi import HTTPException, Request, status
+from app.database import db_manager
+from app.utils import api_registry, key_filter, key_principal, latency, metrics, quota, rate_limiter, usage_counter
+from app.utils.api_recorder import (
+    apply_quota_result,
+    check_principal,
+    extract_api_key_from_request,
+    record_api_call,
+    record_free_api_call,
+)
+from app.utils.concurrency import run_sync
+from app.utils.key_principal import KeyPrincipal
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/api"
+
+metrics.counter("api_requests_total", "开放API请求次数", ("api", "status"))
+metrics.histogram("api_request_duration_seconds", "开放API请求耗时（秒）", ("api",))
+
+
+class UsageEvent:
+    """一次开放API调用的使用事件（鉴权通过后创建，响应发送后补全状态码与耗时）"""
+
+    def __init__(
+        self,
+        api_id: int,
+        alias: str,
+        method: str,
+        path: str,
+        client_ip: str,
+        principal: Optional[KeyPrincipal] = None
+    ):
+        self.api_id = api_id
+        self.alias = alias
+        self.method = method
+        self.path = path
+        self.client_ip = client_ip
+        self.api_key = principal.api_key if principal else None
+        self.subscription_id = principal.subscription_id if principal else None
+        self.user_id = principal.user_id if principal else None
+        # 剩余次数已在Redis中扣减（回退记录时不再扣减数据库，避免重复扣减）
+        self.quota_consumed = False
+        self.created_at = datetime.now(timezone.utc)
+        self.status_code: Optional[int] = None
+        self.latency_ms: Optional[float] = None
+        self.response_bytes: int = 0
+        # 分阶段耗时（毫秒）：auth / upstream / serialization
+        self.phases: Dict[str, float] = {}
+
+
+UsageHandler = Callable[[UsageEvent], Awaitable[None]]
+
+_handlers: List[UsageHandler] = []
+_pending: Set[asyncio.Task] = set()
+
+
+def subscribe_usage_events(handler: UsageHandler) -> UsageHandler:
+    """注册使用事件处理函数（async，可作装饰器使用）"""
+    _handlers.append(handler)
+    return handler
+
+
+async def _dispatch(event: UsageEvent) -> None:
+    for handler in _handlers:
+        try:
+            await handler(event)
+        except Exception as e:
+            logger.error(f"使用事件处理失败 {getattr(handler, '__name__', handler)}: {e}")
+
+
+def emit_usage_event(event: UsageEvent) -> None:
+    """在后台分发使用事件（不等待）"""
+    task = asyncio.get_running_loop().create_task(_dispatch(event))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+@metrics.register_collector
+def _collect_pending_events():
+    return [metrics.queue_depth("usage_events", len(_pending))]
+
+
+async def drain_usage_events() -> None:
+    """等待尚未完成的使用事件（应用关闭时调用）"""
+    if _pending:
+        await asyncio.gather(*list(_pending), return_exceptions=True)
+
+
+def _record_with_session(recorder, **kwargs) -> bool:
+    """Redis不可用时的回退：在线程池中用独立会话直接更新数据库"""
+    db = db_manager.create_session()
+    try:
+        return recorder(db=db, **kwargs)
+    finally:
+        db.close()
+
+
+@subscribe_usage_events
+async def count_api_call(event: UsageEvent) -> None:
+    """调用计数：在Redis中累加，Redis不可用时回退到数据库"""
+    if await usage_counter.incr_call_async(event.api_id, event.subscription_id):
+        return
+    if event.subscription_id is None:
+        await run_sync(_record_with_session, record_free_api_call, api_id=event.api_id)
+    else:
+        await run_sync(
+            _record_with_session, record_api_call,
+            api_key=event.api_key, api_id=event.api_id,
+            decrement_remaining=not event.quota_consumed
+        )
+
+
+@subscribe_usage_events
+async def record_latency(event: UsageEvent) -> None:
+    """分阶段延迟直方图"""
+    for phase, elapsed_ms in event.phases.items():
+        latency.record(event.alias, phase, elapsed_ms)
+    if event.latency_ms is not None:
+        latency.record(event.alias, "total", event.latency_ms)
+
+
+async def resolve_api_state(api_id: Optional[int] = None, alias: Optional[str] = None):
+    """按别名（注册表）或ID获取API状态，均未找到时返回None"""
+    if alias is not None:
+        state = api_registry.get_by_alias(alias)
+        if state is None:
+            await run_sync(api_registry.refresh_on_miss)
+            state = api_registry.get_by_alias(alias)
+        return state
+    return await key_principal.get_api_state_async(api_id)
+
+
+async def authorize_api_call(
+    request: Request,
+    api_id: Optional[int] = None,
+    alias: Optional[str] = None,
+    api_key: Optional[str] = None
+) -> Tuple[UsageEvent, Optional[KeyPrincipal]]:
+    """
+    校验一次开放API调用（API状态、频率限制、API密钥、剩余次数），不记录调用计数
+
+    Args:
+        request: 请求对象（用于提取API密钥与频率限制）
+        api_id: API ID（与 alias 二选一）
+        alias: API别名，通过注册表解析
+        api_key: API密钥（为空时从请求中提取）
+
+    Returns:
+        (使用事件, 密钥主体)；免费API的密钥主体为None
+
+    Raises:
+        HTTPException: 验证失败时抛出异常
+    """
+    api_state = await resolve_api_state(api_id, alias)
+    if not api_state:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="API接口不存在"
+        )
+
+    if not api_state["is_active"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="API接口不可用"
+        )
+
+    api_id = api_state["id"]
+    api_limit = api_state.get("rate_limit_per_minute")
+    client_ip = rate_limiter.get_client_ip(request)
+
+    # 免费API：按客户端IP限流
+    if api_state["is_free"]:
+        await rate_limiter.enforce_rate_limit_async(request, api_id, None, api_limit)
+        event = UsageEvent(api_id, api_state["alias"], request.method, request.url.path, client_ip)
+        return event, None
+
+    if api_key is None:
+        api_key = extract_api_key_from_request(request)
+
+    await rate_limiter.enforce_rate_limit_async(request, api_id, api_key, api_limit)
+
+    if not api_key or not api_key.strip():
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API密钥不能为空",
+            headers={"WWW-Authenticate": "ApiKey"}
+        )
+
+    # 过滤器判定未签发的密钥直接拒绝，不访问Redis缓存与数据库
+    principal = None
+    if await key_filter.might_exist_async(api_key):
+        principal = await key_principal.get_principal_async(api_key)
+        if not principal:
+            key_filter.mark_unknown(api_key)
+    if not principal:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API密钥不存在",
+            headers={"WWW-Authenticate": "ApiKey"}
+        )
+    check_principal(principal, api_id)
+
+    result = None
+    if principal.remaining_calls is not None:
+        result = await quota.consume_async(principal.subscription_id, principal.remaining_calls)
+        apply_quota_result(principal, result)
+
+    event = UsageEvent(api_id, api_state["alias"], request.method, request.url.path, client_ip, principal)
+    event.quota_consumed = result is not None
+    return event, principal
+
+
+async def api_gateway(request: Request) -> Optional[KeyPrincipal]:
+    """
+    /api 路由的统一依赖：按路径第一段解析API别名并完成鉴权
+
+    Returns:
+        KeyPrincipal: 验证成功的密钥主体（免费API返回None），同时保存在 request.state.principal
+    """
+    segment = request.scope["path"][len(API_PREFIX):].strip("/").split("/", 1)[0]
+    with latency.phase("auth"):
+        event, principal = await authorize_api_call(request, alias=api_registry.alias_for_prefix(segment))
+    request.state.usage_event = event
+    request.state.principal = principal
+    return principal
+
+
+class GatewayMiddleware:
+    """开放API计时与计量中间件（纯ASGI，不缓冲响应体）"""
+
+    def __init__(self, app, prefix: str = API_PREFIX):
+        self.app = app
+        self.prefix = prefix.rstrip("/") + "/"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        timer, token = latency.start_timer()
+        status_holder = {"code": 500, "bytes": 0}
+        # 与 request.state 共用同一个字典，鉴权依赖写入的使用事件在这里读取
+        state = scope.setdefault("state", {})
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                status_holder["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            latency.reset_timer(token)
+            finished = time.perf_counter()
+            event = state.get("usage_event")
+            if event is not None:
+                alias = event.alias
+            else:
+                # 未登记的前缀统一归为 unknown，避免任意路径产生大量指标标签
+                segment = scope["path"][len(self.prefix):].split("/", 1)[0]
+                alias = api_registry.alias_for_prefix(segment, default="unknown")
+            metrics.inc("api_requests_total", (alias, str(status_holder["code"])))
+            metrics.observe("api_request_duration_seconds", (alias,), finished - timer.started)
+            if event is not None:
+                event.status_code = status_holder["code"]
+                event.latency_ms = (finished - timer.started) * 1000
+                event.response_bytes = status_holder["bytes"]
+                event.phases = dict(timer.phases)
+                if timer.last_phase_end is not None:
+                    event.phases["serialization"] = (finished - timer.last_phase_end) * 1000
+                emit_usage_event(event)
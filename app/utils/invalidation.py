@@ -0,0 +1,180 @@
+"""
+跨worker缓存失效总线（Redis pub/sub）
+状态变更时发布带类型的失效事件，所有worker（含其它节点）订阅后清除各自的进程内缓存。
+
+- 事件类型：subscription / api_key / api / user / webconfig / category / cache（CacheManager 一级缓存）
+- 各模块用 subscribe(kind, handler) 注册本地清除逻辑，value 为 None 表示清除该类型的全部缓存
+- publish() 先在本进程执行清除，再递增版本号并广播；本进程发出的消息收到后忽略
+- 版本号兜底：消息携带递增版本号，订阅频道时以当前共享版本号为基准，之后记录已连续收到的最高版本号；周期检查时若上一次检查
+  已能看到的版本到本次检查仍未收到（不是仍在路上或乱序到达，而是确实丢失），才清除全部本地缓存；
+  断线重连后版本落后时直接清除
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Set
+from app.cache import cache_manager
+from app.config import config
+from app.database import redis_manager
+from app.utils.concurrency import run_sync
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "cache:invalidate"
+VERSION_KEY = "cache:invalidate:version"
+
+KINDS = ("subscription", "api_key", "api", "user", "webconfig", "category", "cache")
+
+VERSION_CHECK_INTERVAL = config.get('app.cache.invalidation_check_interval', 30)
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+# 本worker的标识，用于忽略自己发出的消息
+ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+_handlers: Dict[str, List[Callable[[Optional[Any]], None]]] = {kind: [] for kind in KINDS}
+
+_version_lock = threading.Lock()
+# 已连续收到（或本进程发出）的最高版本号；订阅频道后以当时的共享版本号为基准，订阅之前为None
+_last_version: Optional[int] = None
+# 高于 _last_version、已乱序先到的版本号
+_received_ahead: Set[int] = set()
+# 上一次周期检查时读到的共享版本号（本次检查时仍未连续收到即视为丢失）
+_check_target = 0
+
+_handlers["cache"].append(cache_manager.invalidate_local)
+
+
+def subscribe(kind: str, handler: Callable[[Optional[Any]], None]) -> None:
+    """注册本地失效处理函数（同步函数，在线程池中执行；参数为None表示全部失效）"""
+    if kind not in _handlers:
+        raise ValueError(f"未知的失效事件类型: {kind}")
+    _handlers[kind].append(handler)
+
+
+def _apply(kind: str, value: Optional[Any]) -> None:
+    for handler in _handlers.get(kind, ()):
+        try:
+            handler(value)
+        except Exception as e:
+            logger.error(f"执行本地缓存失效失败 {kind}={value}: {e}")
+
+
+def _apply_all() -> None:
+    for kind in KINDS:
+        _apply(kind, None)
+
+
+def publish(kind: str, value: Optional[Any] = None) -> None:
+    """发布失效事件：立即清除本进程缓存，并通知其它worker"""
+    _apply(kind, value)
+    try:
+        version = cache_manager.redis.incr(VERSION_KEY)
+        cache_manager.redis.publish(CHANNEL, json.dumps({
+            "kind": kind,
+            "value": value,
+            "version": version,
+            "origin": ORIGIN,
+        }, ensure_ascii=False))
+        _on_version(version)
+    except Exception as e:
+        logger.error(f"发布缓存失效事件失败 {kind}={value}: {e}")
+
+
+def _on_version(version: int) -> None:
+    """记录收到的版本号（可能乱序），推进连续收到的最高版本号"""
+    global _last_version
+    with _version_lock:
+        if _last_version is None or version <= _last_version:
+            return
+        _received_ahead.add(version)
+        while _last_version + 1 in _received_ahead:
+            _last_version += 1
+            _received_ahead.discard(_last_version)
+
+
+def _reset_version(version: int) -> None:
+    """清除全部本地缓存后（或订阅频道时）以 version 为新的基准"""
+    global _last_version, _check_target
+    with _version_lock:
+        _last_version = version if _last_version is None else max(_last_version, version)
+        _received_ahead.difference_update([v for v in _received_ahead if v <= _last_version])
+        while _last_version + 1 in _received_ahead:
+            _last_version += 1
+            _received_ahead.discard(_last_version)
+        if _check_target <= _last_version:
+            _check_target = 0
+
+
+async def _handle_message(data: str) -> None:
+    try:
+        event = json.loads(data)
+    except (TypeError, ValueError):
+        logger.warning(f"无效的缓存失效消息: {data}")
+        return
+
+    _on_version(int(event.get("version") or 0))
+    if event.get("origin") != ORIGIN:
+        await run_sync(_apply, event.get("kind"), event.get("value"))
+
+
+async def listen() -> None:
+    """订阅失效频道（在 lifespan 中作为后台任务运行，断线自动重连）"""
+    delay = RECONNECT_DELAY
+    while True:
+        pubsub = None
+        try:
+            client = redis_manager.get_async_client()
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(CHANNEL)
+            # 订阅之后、处理消息之前以当前版本为基准；重连时版本落后说明断线期间丢失了消息，清除全部本地缓存
+            version = int(await client.get(VERSION_KEY) or 0)
+            if _last_version is not None and version > _last_version:
+                await run_sync(_apply_all)
+            _reset_version(version)
+            logger.info("缓存失效总线已连接")
+            delay = RECONNECT_DELAY
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    await _handle_message(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"缓存失效总线断开，{delay:.0f}秒后重连: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        finally:
+            if pubsub is not None:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+
+
+def check_version() -> None:
+    """
+    周期检查版本号（兜底丢失的消息）
+    上一次检查时已存在的版本到本次检查仍未连续收到，说明消息确实丢失，此时清除全部本地缓存；
+    只是仍在路上或乱序到达的消息不会触发清除
+    """
+    global _check_target
+    try:
+        version = int(cache_manager.redis.get(VERSION_KEY) or 0)
+    except Exception as e:
+        logger.warning(f"读取缓存失效版本号失败: {e}")
+        return
+    with _version_lock:
+        if _last_version is None:
+            # 尚未订阅频道，基准由 listen() 订阅时建立
+            return
+        lost = bool(_check_target) and _last_version < _check_target
+        target = _check_target
+        _check_target = version if version > _last_version else 0
+        last = _last_version
+    if lost:
+        logger.warning(f"缓存失效消息丢失（已收到 {last}，应至少为 {target}），清除全部本地缓存")
+        _apply_all()
+        _reset_version(target)
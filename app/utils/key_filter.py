@@ -0,0 +1,194 @@
+"""
+API密钥存在性过滤
+进程内布隆过滤器保存所有已签发的 Subscription.api_key，并对未知密钥做短期负缓存，
+随机/伪造的密钥在微秒级被拒绝，不再触发订阅表的关联查询。
+
+- 启动时从数据库构建，并定期重建（移除已轮换的旧密钥、按数据量重新调整容量）
+- 新签发/轮换的密钥在提交事务后调用 add()：写入本进程的过滤器，同时登记到Redis的“最近签发”有序集合，
+  并通过失效总线（类型 api_key）通知其它worker清除该密钥的负缓存
+- 其它worker的过滤器中没有新密钥时，未命中会先查一次“最近签发”集合再判定为未知
+- 过滤器尚未构建或Redis不可用时，不做拦截（回退到正常查询）
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Iterable, Optional
+from app.cache import LocalLRUCache, cache_manager
+from app.config import config
+from app.database import db_manager, redis_manager
+from app.admin import models as admin_models
+from app.utils import invalidation, metrics
+
+logger = logging.getLogger(__name__)
+
+RECENT_KEY = "keyfilter:recent"
+
+ERROR_RATE = config.get('app.cache.key_filter_error_rate', 0.001)
+REBUILD_INTERVAL = config.get('app.cache.key_filter_rebuild_interval', 3600)
+NEGATIVE_TTL = config.get('app.cache.negative_ttl', 30)
+NEGATIVE_MAX_SIZE = config.get('app.cache.negative_max_size', 10000)
+MIN_CAPACITY = 10000
+# 负缓存条目的命名空间（指标中为 local_negative_key）
+NEGATIVE_NAMESPACE = "negative_key"
+
+
+class BloomFilter:
+    """布隆过滤器（bytearray位图，blake2b 双重哈希）"""
+
+    def __init__(self, capacity: int, error_rate: float = ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str) -> None:
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+_filter: Optional[BloomFilter] = None
+_build_lock = threading.Lock()
+_negative = LocalLRUCache(NEGATIVE_MAX_SIZE)
+
+
+def _iter_api_keys() -> Iterable[str]:
+    db = db_manager.create_session()
+    try:
+        Sub = admin_models.Subscription
+        for (api_key,) in db.query(Sub.api_key).yield_per(5000):
+            yield api_key
+    finally:
+        db.close()
+
+
+def rebuild() -> int:
+    """从数据库重建过滤器，返回密钥数量"""
+    global _filter
+    with _build_lock:
+        started = time.time()
+        try:
+            db = db_manager.create_session()
+            try:
+                total = db.query(admin_models.Subscription.id).count()
+            finally:
+                db.close()
+            bloom = BloomFilter(max(total * 2, MIN_CAPACITY))
+            count = 0
+            for api_key in _iter_api_keys():
+                bloom.add(api_key)
+                count += 1
+            # 构建期间签发的密钥也要包含进来
+            for api_key in _recent_since(started - REBUILD_INTERVAL):
+                bloom.add(api_key)
+        except Exception as e:
+            logger.error(f"构建API密钥过滤器失败: {e}")
+            return 0
+
+        _filter = bloom
+        _prune_recent(started - 2 * REBUILD_INTERVAL)
+        logger.info(f"API密钥过滤器已构建: {count} 个密钥，{bloom.size // 8 // 1024}KB")
+        return count
+
+
+def _recent_since(since: float):
+    try:
+        return cache_manager.redis.zrangebyscore(RECENT_KEY, since, "+inf")
+    except Exception as e:
+        logger.warning(f"读取最近签发的密钥失败: {e}")
+        return []
+
+
+def _prune_recent(before: float) -> None:
+    try:
+        cache_manager.redis.zremrangebyscore(RECENT_KEY, "-inf", before)
+    except Exception as e:
+        logger.warning(f"清理最近签发的密钥失败: {e}")
+
+
+def add(api_key: str) -> None:
+    """登记新签发的API密钥（创建订阅、轮换密钥的事务提交后调用）"""
+    if not api_key:
+        return
+    if _filter is not None:
+        _filter.add(api_key)
+    try:
+        cache_manager.redis.zadd(RECENT_KEY, {api_key: time.time()})
+    except Exception as e:
+        logger.error(f"登记新签发的密钥失败: {e}")
+    # 本进程立即清除负缓存；其它worker中该密钥可能在签发前被判定为未知，同样需要清除
+    invalidation.publish("api_key", api_key)
+
+
+def mark_unknown(api_key: str) -> None:
+    """数据库中不存在的密钥加入负缓存（过滤器误判的密钥同样适用）"""
+    _negative.set(api_key, NEGATIVE_NAMESPACE, True, NEGATIVE_TTL)
+
+
+def _forget_unknown(api_key: Optional[str]) -> None:
+    if api_key is None:
+        _negative.clear()
+    else:
+        _negative.pop(api_key)
+
+
+def _precheck(api_key: str) -> Optional[bool]:
+    """本地判断：True=可能存在，False=已知不存在，None=需要查询最近签发集合"""
+    unknown = _negative.get(api_key) is True
+    metrics.inc("cache_requests_total", (f"local_{NEGATIVE_NAMESPACE}", "hit" if unknown else "miss"))
+    if unknown:
+        return False
+    if _filter is None:
+        return True
+    if api_key in _filter:
+        return True
+    return None
+
+
+def _resolve_recent(api_key: str, score) -> bool:
+    if score is not None:
+        _filter.add(api_key)
+        return True
+    mark_unknown(api_key)
+    return False
+
+
+def might_exist(api_key: str) -> bool:
+    """密钥是否可能存在（False 表示一定未签发，可直接拒绝）"""
+    known = _precheck(api_key)
+    if known is not None:
+        return known
+    try:
+        score = cache_manager.redis.zscore(RECENT_KEY, api_key)
+    except Exception as e:
+        logger.warning(f"查询最近签发的密钥失败，跳过过滤: {e}")
+        return True
+    return _resolve_recent(api_key, score)
+
+
+async def might_exist_async(api_key: str) -> bool:
+    """might_exist 的异步版本（使用异步Redis客户端）"""
+    known = _precheck(api_key)
+    if known is not None:
+        return known
+    try:
+        score = await redis_manager.get_async_client().zscore(RECENT_KEY, api_key)
+    except Exception as e:
+        logger.warning(f"查询最近签发的密钥失败，跳过过滤: {e}")
+        return True
+    return _resolve_recent(api_key, score)
+
+
+# 新签发的密钥：各worker清除本地负缓存（由失效总线执行）
+invalidation.subscribe("api_key", _forget_unknown)
@@ -0,0 +1,445 @@
+"""
+API密钥主体（Key Principal）缓存
+把验证一次API调用所需的订阅、用户、API状态打包成一个对象缓存起来，
+有效密钥的校验不再访问MySQL。
+
+缓存分两级：
+- 进程内 LRU + TTL 缓存（app.cache.LocalLRUCache）：命中时无任何网络开销，TTL较短以限制其它worker修改后的陈旧时间
+- Redis：跨worker/重启共享，按 api_key 存储，并打上 订阅/用户/API 标签（CacheManager 标签集合）用于批量失效
+
+回源写入与失效的竞争：每次失效先递增代数（principal_gen），再删除缓存；回源前读取代数，
+写入时在 WATCH 事务中确认代数未变，查询数据库期间发生过失效则放弃写入，旧数据不会写回缓存。
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+from redis.exceptions import WatchError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.cache import LocalLRUCache, cache_manager, cache_namespace
+from app.config import config
+from app.database import db_manager, redis_manager
+from app.admin import crud
+from app.admin import models as admin_models
+from app.utils import api_registry, codec, invalidation, metrics
+from app.utils.concurrency import run_sync
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_PREFIX = "principal"
+API_STATE_PREFIX = "api_state"
+# 密钥主体缓存的代数：每次失效加一
+GENERATION_KEY = "principal_gen"
+# 读取代数失败（Redis不可用）
+_UNKNOWN = object()
+
+# 进程内缓存时间较短；Redis缓存时间较长，由失效逻辑保证一致
+LOCAL_TTL = config.get('app.cache.principal_local_ttl', 10)
+REDIS_TTL = config.get('app.cache.principal_ttl', 300)
+LOCAL_MAX_SIZE = config.get('app.cache.max_size', 1000)
+
+
+class KeyPrincipal:
+    """API密钥主体：一次调用验证所需的全部状态（__slots__ 轻量对象，不是ORM实体）"""
+
+    FIELDS = (
+        "api_key", "subscription_id", "user_id", "api_id", "status", "end_date",
+        "remaining_calls", "user_is_active", "api_is_active", "api_deprecated", "api_is_free"
+    )
+    __slots__ = FIELDS
+
+    def __init__(
+        self,
+        api_key: str,
+        subscription_id: int,
+        user_id: int,
+        api_id: int,
+        status: str,
+        end_date: Optional[datetime],
+        remaining_calls: Optional[int],
+        user_is_active: bool,
+        api_is_active: bool,
+        api_deprecated: bool,
+        api_is_free: bool
+    ):
+        self.api_key = api_key
+        self.subscription_id = subscription_id
+        self.user_id = user_id
+        self.api_id = api_id
+        self.status = status
+        self.end_date = end_date
+        self.remaining_calls = remaining_calls
+        self.user_is_active = user_is_active
+        self.api_is_active = api_is_active
+        self.api_deprecated = api_deprecated
+        self.api_is_free = api_is_free
+
+    @classmethod
+    def from_row(cls, row) -> "KeyPrincipal":
+        """由 principal_statement 查询的一行构建（用户/API不存在时对应状态为False）"""
+        (api_key, subscription_id, user_id, api_id, status, end_date, remaining_calls,
+         user_is_active, api_is_active, api_deprecated, api_is_free) = row
+        return cls(
+            api_key, subscription_id, user_id, api_id, status, end_date, remaining_calls,
+            bool(user_is_active), bool(api_is_active), bool(api_deprecated), bool(api_is_free)
+        )
+
+    @property
+    def end_date_utc(self) -> Optional[datetime]:
+        """带UTC时区的到期时间（数据库中无时区的时间按UTC处理）"""
+        if self.end_date is None:
+            return None
+        if self.end_date.tzinfo is None:
+            return self.end_date.replace(tzinfo=timezone.utc)
+        return self.end_date
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        if self.end_date is not None:
+            data["end_date"] = self.end_date.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "KeyPrincipal":
+        values = {field: data.get(field) for field in cls.FIELDS}
+        if values["end_date"]:
+            values["end_date"] = datetime.fromisoformat(values["end_date"])
+        return cls(**values)
+
+
+_local_principals = LocalLRUCache(LOCAL_MAX_SIZE)
+_local_api_states = LocalLRUCache(LOCAL_MAX_SIZE)
+
+
+def _local_get(cache: LocalLRUCache, namespace: str, key: Any) -> Any:
+    """读取进程内缓存（未命中返回None），按命名空间记录命中指标"""
+    value = cache.get(key, None)
+    metrics.inc("cache_requests_total", (f"local_{namespace}", "miss" if value is None else "hit"))
+    return value
+
+
+def _principal_key(api_key: str) -> str:
+    return f"{PRINCIPAL_PREFIX}:{api_key}"
+
+
+def _api_tag(api_id: int) -> str:
+    """由某个API派生的缓存（密钥主体、API状态）共用的标签"""
+    return f"api:{api_id}"
+
+
+def _queue_store(pipe, principal: KeyPrincipal) -> None:
+    key = _principal_key(principal.api_key)
+    pipe.setex(key, REDIS_TTL, codec.encode(principal.to_dict()))
+    cache_manager.queue_tags(pipe, key, (
+        f"subscription:{principal.subscription_id}",
+        f"user:{principal.user_id}",
+        _api_tag(principal.api_id),
+    ))
+
+
+def _read_generation() -> Any:
+    """回源数据库之前读取的代数"""
+    try:
+        return cache_manager.binary.get(GENERATION_KEY)
+    except Exception as e:
+        logger.warning(f"读取密钥主体缓存代数失败: {e}")
+        return _UNKNOWN
+
+
+async def _read_generation_async() -> Any:
+    try:
+        return await redis_manager.get_async_binary_client().get(GENERATION_KEY)
+    except Exception as e:
+        logger.warning(f"读取密钥主体缓存代数失败: {e}")
+        return _UNKNOWN
+
+
+def _bump_generation() -> None:
+    try:
+        cache_manager.redis.incr(GENERATION_KEY)
+    except Exception as e:
+        logger.error(f"更新密钥主体缓存代数失败: {e}")
+
+
+def _store_principal(principal: KeyPrincipal, generation: Any) -> bool:
+    """
+    代数仍为 generation 时写入Redis并登记标签（WATCH事务）；
+    返回False表示查询数据库期间发生了失效，principal 已陈旧，不应再缓存
+    """
+    if generation is _UNKNOWN:
+        return True
+    try:
+        with cache_manager.binary.pipeline() as pipe:
+            pipe.watch(GENERATION_KEY)
+            if pipe.get(GENERATION_KEY) != generation:
+                return False
+            pipe.multi()
+            _queue_store(pipe, principal)
+            pipe.execute()
+    except WatchError:
+        return False
+    except Exception as e:
+        logger.error(f"写入密钥主体缓存失败: {e}")
+    return True
+
+
+async def _store_principal_async(principal: KeyPrincipal, generation: Any) -> bool:
+    if generation is _UNKNOWN:
+        return True
+    try:
+        async with redis_manager.get_async_binary_client().pipeline() as pipe:
+            await pipe.watch(GENERATION_KEY)
+            if await pipe.get(GENERATION_KEY) != generation:
+                return False
+            pipe.multi()
+            _queue_store(pipe, principal)
+            await pipe.execute()
+    except WatchError:
+        return False
+    except Exception as e:
+        logger.error(f"写入密钥主体缓存失败: {e}")
+    return True
+
+
+def _principal_select():
+    Sub, User, API = admin_models.Subscription, admin_models.User, admin_models.API
+    return (
+        select(
+            Sub.api_key, Sub.id, Sub.user_id, Sub.api_id, Sub.status, Sub.end_date, Sub.remaining_calls,
+            User.is_active, API.is_active, API.deprecated, API.is_free
+        )
+        .select_from(Sub)
+        .outerjoin(User, User.id == Sub.user_id)
+        .outerjoin(API, API.id == Sub.api_id)
+    )
+
+
+_PRINCIPAL_SELECT = _principal_select()
+
+
+def principal_statement(api_key: str):
+    """
+    按密钥查询主体的单条语句：只取验证需要的列，订阅/用户/API 一次按主键关联，
+    订阅表部分由 ix_subscriptions_key_cover 覆盖索引直接给出（不构建ORM实体）
+    """
+    return _PRINCIPAL_SELECT.where(admin_models.Subscription.api_key == api_key).limit(1)
+
+
+def load_principal(db: Session, api_key: str) -> Optional[KeyPrincipal]:
+    """从数据库加载密钥主体（一次查询），密钥不存在时返回None"""
+    row = db.execute(principal_statement(api_key)).first()
+    return KeyPrincipal.from_row(row) if row is not None else None
+
+
+def get_principal(db: Session, api_key: str) -> Optional[KeyPrincipal]:
+    """按API密钥获取主体：进程内缓存 -> Redis -> MySQL"""
+    principal = _local_get(_local_principals, PRINCIPAL_PREFIX, api_key)
+    if principal is not None:
+        return principal
+
+    data = cache_manager.get(_principal_key(api_key))
+    if isinstance(data, dict):
+        try:
+            principal = KeyPrincipal.from_dict(data)
+            _local_principals.set(api_key, PRINCIPAL_PREFIX, principal, LOCAL_TTL)
+            return principal
+        except Exception as e:
+            logger.warning(f"密钥主体缓存数据无效，回源数据库: {e}")
+
+    generation = _read_generation()
+    principal = load_principal(db, api_key)
+    if principal is None:
+        return None
+    if _store_principal(principal, generation):
+        _local_principals.set(api_key, PRINCIPAL_PREFIX, principal, LOCAL_TTL)
+    return principal
+
+
+def get_api_state(db: Session, api_id: int) -> Optional[Dict[str, Any]]:
+    """获取API的可用状态（is_active/is_free/deprecated/频率上限）：注册表 -> 两级缓存 -> MySQL"""
+    state = api_registry.get_by_id(api_id)
+    if state is not None:
+        return state
+
+    state = _local_get(_local_api_states, API_STATE_PREFIX, api_id)
+    if state is not None:
+        return state
+
+    state = cache_manager.get(f"{API_STATE_PREFIX}:{api_id}")
+    if not isinstance(state, dict):
+        api = crud.APICRUD.get_by_id(db, api_id)
+        if not api:
+            return None
+        state = _api_state(api)
+        cache_manager.set(f"{API_STATE_PREFIX}:{api_id}", state, REDIS_TTL, tags=(_api_tag(api_id),))
+    _local_api_states.set(api_id, API_STATE_PREFIX, state, LOCAL_TTL)
+    return state
+
+
+def _api_state(api) -> Dict[str, Any]:
+    return {
+        "id": api.id,
+        "alias": api.alias,
+        "is_active": bool(api.is_active),
+        "is_free": bool(api.is_free),
+        "deprecated": bool(api.deprecated),
+        "rate_limit_per_minute": api.rate_limit_per_minute,
+    }
+
+
+def _load_with_session(loader: Callable[[Session, Any], Any], key: Any) -> Any:
+    db = db_manager.create_session()
+    try:
+        return loader(db, key)
+    finally:
+        db.close()
+
+
+async def _get_cached_async(redis_key: str) -> Optional[Dict[str, Any]]:
+    try:
+        raw = await redis_manager.get_async_binary_client().get(redis_key)
+        metrics.inc("cache_requests_total", (cache_namespace(redis_key), "hit" if raw else "miss"))
+        data = codec.decode(raw)
+        return data if isinstance(data, dict) else None
+    except Exception as e:
+        logger.error(f"读取缓存失败 {redis_key}: {e}")
+        return None
+
+
+async def get_principal_async(api_key: str) -> Optional[KeyPrincipal]:
+    """
+    get_principal 的异步版本：进程内缓存与Redis在事件循环中读取（异步Redis客户端），
+    都未命中时查询数据库（启用异步引擎时直接await，否则放到线程池）
+    """
+    principal = _local_get(_local_principals, PRINCIPAL_PREFIX, api_key)
+    if principal is not None:
+        return principal
+
+    data = await _get_cached_async(_principal_key(api_key))
+    if data is not None:
+        try:
+            principal = KeyPrincipal.from_dict(data)
+            _local_principals.set(api_key, PRINCIPAL_PREFIX, principal, LOCAL_TTL)
+            return principal
+        except Exception as e:
+            logger.warning(f"密钥主体缓存数据无效，回源数据库: {e}")
+
+    if not db_manager.async_enabled():
+        return await run_sync(_load_with_session, get_principal, api_key)
+
+    generation = await _read_generation_async()
+    async with db_manager.create_async_session() as db:
+        row = (await db.execute(principal_statement(api_key))).first()
+    if row is None:
+        return None
+    principal = KeyPrincipal.from_row(row)
+    if await _store_principal_async(principal, generation):
+        _local_principals.set(api_key, PRINCIPAL_PREFIX, principal, LOCAL_TTL)
+    return principal
+
+
+async def get_api_state_async(api_id: int) -> Optional[Dict[str, Any]]:
+    """get_api_state 的异步版本"""
+    state = api_registry.get_by_id(api_id)
+    if state is not None:
+        return state
+
+    state = _local_get(_local_api_states, API_STATE_PREFIX, api_id)
+    if state is not None:
+        return state
+
+    state = await _get_cached_async(f"{API_STATE_PREFIX}:{api_id}")
+    if state is not None:
+        _local_api_states.set(api_id, API_STATE_PREFIX, state, LOCAL_TTL)
+        return state
+
+    if not db_manager.async_enabled():
+        return await run_sync(_load_with_session, get_api_state, api_id)
+
+    API = admin_models.API
+    async with db_manager.create_async_session() as db:
+        api = (await db.execute(
+            select(API.id, API.alias, API.is_active, API.is_free, API.deprecated, API.rate_limit_per_minute)
+            .where(API.id == api_id)
+        )).first()
+    if not api:
+        return None
+    state = _api_state(api)
+    try:
+        key = f"{API_STATE_PREFIX}:{api_id}"
+        pipe = redis_manager.get_async_binary_client().pipeline(transaction=False)
+        pipe.setex(key, REDIS_TTL, codec.encode(state))
+        cache_manager.queue_tags(pipe, key, (_api_tag(api_id),))
+        await pipe.execute()
+    except Exception as e:
+        logger.error(f"写入API状态缓存失败: {e}")
+    _local_api_states.set(api_id, API_STATE_PREFIX, state, LOCAL_TTL)
+    return state
+
+
+def invalidate_api_key(api_key: str) -> None:
+    """使单个API密钥的主体缓存失效"""
+    if not api_key:
+        return
+    _bump_generation()
+    cache_manager.delete(_principal_key(api_key))
+    invalidation.publish("api_key", api_key)
+
+
+def invalidate_subscription(subscription_id: int) -> None:
+    """订阅变更（状态、到期时间、次数、密钥）后调用"""
+    _bump_generation()
+    cache_manager.invalidate_tag(f"subscription:{subscription_id}")
+    invalidation.publish("subscription", subscription_id)
+
+
+def invalidate_user(user_id: int) -> None:
+    """用户变更（启用/禁用、删除）后调用"""
+    _bump_generation()
+    cache_manager.invalidate_tag(f"user:{user_id}")
+    invalidation.publish("user", user_id)
+
+
+def invalidate_api(api_id: int) -> None:
+    """API变更（启用/禁用、免费、废弃、删除）后调用：清除该API派生的密钥主体与API状态缓存"""
+    _bump_generation()
+    cache_manager.invalidate_tag(_api_tag(api_id))
+    cache_manager.delete(f"{API_STATE_PREFIX}:{api_id}")
+    invalidation.publish("api", api_id)
+
+
+def _evict_principals(predicate: Callable[[KeyPrincipal], bool], value: Optional[Any]) -> None:
+    if value is None:
+        _local_principals.clear()
+    else:
+        _local_principals.pop_where(predicate)
+
+
+def _evict_api_key(api_key: Optional[str]) -> None:
+    if api_key is None:
+        _local_principals.clear()
+    else:
+        _local_principals.pop(api_key)
+
+
+def _evict_subscription(subscription_id: Optional[int]) -> None:
+    _evict_principals(lambda p: p.subscription_id == subscription_id, subscription_id)
+
+
+def _evict_user(user_id: Optional[int]) -> None:
+    _evict_principals(lambda p: p.user_id == user_id, user_id)
+
+
+def _evict_api(api_id: Optional[int]) -> None:
+    _evict_principals(lambda p: p.api_id == api_id, api_id)
+    if api_id is None:
+        _local_api_states.clear()
+    else:
+        _local_api_states.pop(api_id)
+
+
+# 本进程缓存的失效处理（由失效总线在各worker中执行）
+invalidation.subscribe("api_key", _evict_api_key)
+invalidation.subscribe("subscription", _evict_subscription)
+invalidation.subscribe("user", _evict_user)
+invalidation.subscribe("api", _evict_api)
@@ -0,0 +1,272 @@
+"""
+开放API分阶段延迟直方图
+按 API别名 × 阶段 维护对数分桶直方图（固定桶边界，可直接相加合并），用于统计 p50/p95/p99：
+
+- auth：网关鉴权（API状态、频率限制、密钥、剩余次数）
+- upstream：业务处理中的上游/阻塞调用（MMDB查询、远程接口等，通过 run_upstream 执行）
+- serialization：上游返回后到响应发送完毕（结果处理、JSON序列化与发送）
+- total：整个请求
+
+请求内的阶段耗时记在 PhaseTimer 上（通过 contextvar 传递），响应结束后随使用事件进入进程内直方图；
+后台任务定期把增量以 HINCRBY 合并到Redis的小时分桶哈希中，所有worker的数据自然汇总，查询时再合并多个小时。
+"""
+import contextvars
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from app.cache import cache_manager
+from app.config import config
+from app.utils import metrics
+from app.utils.concurrency import run_sync
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("auth", "upstream", "serialization", "total")
+
+metrics.counter("upstream_calls_total", "上游调用次数（按来源与结果）", ("source", "outcome"))
+metrics.histogram("upstream_call_duration_seconds", "上游调用耗时（秒）", ("source",))
+
+KEY_PREFIX = "latency:"
+FLUSH_INTERVAL = config.get('app.latency.flush_interval', 10)
+# 小时分桶的保留小时数（也是统计接口可查询的最大小时数）
+RETENTION_HOURS = config.get('app.latency.retention_hours', 72)
+KEY_TTL = RETENTION_HOURS * 3600
+
+# 桶边界：MIN_MS * GROWTH^i，约 0.05ms ~ 2min，分位数相对误差 < 5%
+MIN_MS = 0.05
+GROWTH = 1.1
+BUCKETS = int(math.ceil(math.log(120000 / MIN_MS) / math.log(GROWTH))) + 1
+_LOG_GROWTH = math.log(GROWTH)
+
+
+def bucket_index(value_ms: float) -> int:
+    """耗时所在的桶序号（超出范围的归入首/末桶）"""
+    if value_ms <= MIN_MS:
+        return 0
+    return min(int(math.log(value_ms / MIN_MS) / _LOG_GROWTH) + 1, BUCKETS - 1)
+
+
+def bucket_upper(index: int) -> float:
+    """桶的上边界（毫秒）"""
+    return MIN_MS * GROWTH ** index
+
+
+class LogHistogram:
+    """对数分桶直方图（桶边界固定，同类直方图可直接相加合并）"""
+
+    __slots__ = ("counts", "count", "sum_ms", "max_ms")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * BUCKETS
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, value_ms: float) -> None:
+        self.counts[bucket_index(value_ms)] += 1
+        self.count += 1
+        self.sum_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def merge(self, other: "LogHistogram") -> None:
+        for i, n in enumerate(other.counts):
+            if n:
+                self.counts[i] += n
+        self.count += other.count
+        self.sum_ms += other.sum_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    def percentile(self, p: float) -> float:
+        """分位数（返回所在桶的几何中点，不超过最大值）"""
+        if not self.count:
+            return 0.0
+        rank = max(int(math.ceil(self.count * p / 100)), 1)
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                value = bucket_upper(i) / math.sqrt(GROWTH) if i else MIN_MS
+                return min(value, self.max_ms) if self.max_ms else value
+        return self.max_ms
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.sum_ms / self.count, 2) if self.count else 0,
+            "p50_ms": round(self.percentile(50), 2),
+            "p95_ms": round(self.percentile(95), 2),
+            "p99_ms": round(self.percentile(99), 2),
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+class PhaseTimer:
+    """单个请求的分阶段计时"""
+
+    __slots__ = ("started", "phases", "last_phase_end")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.last_phase_end: Optional[float] = None
+
+    def add(self, phase: str, elapsed_ms: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed_ms
+        self.last_phase_end = time.perf_counter()
+
+
+_current_timer: contextvars.ContextVar[Optional[PhaseTimer]] = contextvars.ContextVar(
+    "latency_phase_timer", default=None
+)
+
+
+def start_timer() -> Tuple[PhaseTimer, contextvars.Token]:
+    """为当前请求创建计时器（网关中间件调用）"""
+    timer = PhaseTimer()
+    return timer, _current_timer.set(timer)
+
+
+def reset_timer(token: contextvars.Token) -> None:
+    _current_timer.reset(token)
+
+
+@contextmanager
+def phase(name: str):
+    """把代码块的耗时计入当前请求的指定阶段（不在网关请求内时不记录）"""
+    timer = _current_timer.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(name, (time.perf_counter() - started) * 1000)
+
+
+async def run_upstream(func, *args, **kwargs):
+    """在线程池中执行上游/阻塞调用，耗时计入 upstream 阶段"""
+    source = getattr(func, "__name__", "unknown")
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with phase("upstream"):
+            result = await run_sync(func, *args, **kwargs)
+        outcome = "ok"
+        return result
+    finally:
+        metrics.inc("upstream_calls_total", (source, outcome))
+        metrics.observe("upstream_call_duration_seconds", (source,), time.perf_counter() - started)
+
+
+# (API别名, 阶段) -> 尚未刷写到Redis的增量
+_pending: Dict[Tuple[str, str], LogHistogram] = {}
+_pending_lock = threading.Lock()
+
+
+def record(alias: str, phase_name: str, value_ms: float) -> None:
+    """记录一次阶段耗时到进程内直方图"""
+    key = (alias, phase_name)
+    with _pending_lock:
+        hist = _pending.get(key)
+        if hist is None:
+            hist = _pending[key] = LogHistogram()
+        hist.record(value_ms)
+
+
+@metrics.register_collector
+def _collect_pending():
+    return [metrics.queue_depth("latency_histograms", len(_pending))]
+
+
+def _hour_key(moment: datetime) -> str:
+    return moment.strftime("%Y%m%d%H")
+
+
+def _restore(pending: Dict[Tuple[str, str], LogHistogram]) -> None:
+    """刷写失败时把增量放回缓冲，下次重试"""
+    with _pending_lock:
+        for key, hist in pending.items():
+            entry = _pending.get(key)
+            if entry is None:
+                _pending[key] = hist
+            else:
+                entry.merge(hist)
+
+
+def flush_histograms() -> int:
+    """把进程内增量以 HINCRBY 合并到Redis当前小时的哈希中，返回写入的直方图数量"""
+    global _pending
+    with _pending_lock:
+        if not _pending:
+            return 0
+        pending, _pending = _pending, {}
+
+    hour = _hour_key(datetime.now(timezone.utc))
+    try:
+        pipe = cache_manager.redis.pipeline(transaction=False)
+        for (alias, phase_name), hist in pending.items():
+            key = f"{KEY_PREFIX}{hour}:{alias}:{phase_name}"
+            for i, n in enumerate(hist.counts):
+                if n:
+                    pipe.hincrby(key, str(i), n)
+            pipe.hincrby(key, "count", hist.count)
+            pipe.hincrbyfloat(key, "sum", hist.sum_ms)
+            pipe.expire(key, KEY_TTL)
+            # 最大值不能相加合并，单独用有序集合保存（ZADD GT 只保留更大的值）
+            pipe.zadd(f"{KEY_PREFIX}{hour}:max", {f"{alias}:{phase_name}": hist.max_ms}, gt=True)
+        pipe.expire(f"{KEY_PREFIX}{hour}:max", KEY_TTL)
+        pipe.execute()
+        return len(pending)
+    except Exception as e:
+        logger.error(f"刷写延迟直方图失败: {e}")
+        _restore(pending)
+        return 0
+
+
+def _to_histogram(data: Dict[str, str], max_ms: float) -> LogHistogram:
+    hist = LogHistogram()
+    for field, value in data.items():
+        if field == "count":
+            hist.count = int(value)
+        elif field == "sum":
+            hist.sum_ms = float(value)
+        elif field.isdigit() and int(field) < BUCKETS:
+            hist.counts[int(field)] = int(value)
+    hist.max_ms = max_ms
+    return hist
+
+
+def get_histograms(hours: int = 1, alias: Optional[str] = None) -> Dict[str, Dict[str, dict]]:
+    """合并最近 hours 个小时（含当前小时）所有worker的直方图，返回 {别名: {阶段: 统计}}"""
+    now = datetime.now(timezone.utc)
+    merged: Dict[Tuple[str, str], LogHistogram] = {}
+    for offset in range(hours):
+        prefix = f"{KEY_PREFIX}{_hour_key(now - timedelta(hours=offset))}:"
+        # 最大值有序集合同时是该小时的直方图索引，无需 SCAN
+        maxima = cache_manager.redis.zrange(f"{prefix}max", 0, -1, withscores=True)
+        names = [name for name, _ in maxima if alias is None or name.rsplit(":", 1)[0] == alias]
+        if not names:
+            continue
+        pipe = cache_manager.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.hgetall(f"{prefix}{name}")
+        max_by_name = dict(maxima)
+        for name, data in zip(names, pipe.execute()):
+            if not data:
+                continue
+            api_alias, phase_name = name.rsplit(":", 1)
+            hist = _to_histogram(data, float(max_by_name[name]))
+            target = merged.get((api_alias, phase_name))
+            if target is None:
+                merged[(api_alias, phase_name)] = hist
+            else:
+                target.merge(hist)
+
+    result: Dict[str, Dict[str, dict]] = {}
+    for (api_alias, phase_name), hist in sorted(merged.items()):
+        result.setdefault(api_alias, {})[phase_name] = hist.summary()
+    return result
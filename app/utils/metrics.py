@@ -0,0 +1,186 @@
+"""
+进程内指标（Prometheus 文本格式）
+计数器与直方图按线程分片：每个线程只写自己的字典（无锁，GIL下单写者安全），
+抓取时汇总所有线程的分片；队列深度、连接池状态等瞬时值由抓取时执行的采集函数提供。
+
+- inc(name, labels)：计数器累加
+- observe(name, labels, seconds)：直方图记录（固定桶边界，单位秒）
+- register_collector(func)：注册抓取时执行的采集函数，返回 [(指标名, 标签, 值)]
+- render()：生成 text/plain; version=0.0.4 格式的指标文本
+
+每个worker进程独立计数，多worker部署时由Prometheus按实例分别抓取。
+"""
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class _Metric:
+    __slots__ = ("name", "kind", "help", "label_names", "buckets")
+
+    def __init__(self, name: str, kind: str, help: str, label_names: Sequence[str], buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) if buckets else None
+
+
+_metrics: Dict[str, _Metric] = {}
+_gauges: Dict[str, _Metric] = {}
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+# 每个线程一个分片：{指标名: {标签值: 计数}}；直方图的值为 [各桶计数..., 总数, 合计]
+_shards: List[Dict[str, Dict[Labels, object]]] = []
+_shards_lock = threading.Lock()
+_local = threading.local()
+
+
+def counter(name: str, help: str, label_names: Sequence[str] = ()) -> None:
+    """声明计数器"""
+    _metrics[name] = _Metric(name, "counter", help, label_names)
+
+
+def histogram(name: str, help: str, label_names: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> None:
+    """声明直方图（单位秒）"""
+    _metrics[name] = _Metric(name, "histogram", help, label_names, buckets)
+
+
+def gauge(name: str, help: str, label_names: Sequence[str] = ()) -> None:
+    """声明瞬时值（由采集函数在抓取时提供）"""
+    _gauges[name] = _Metric(name, "gauge", help, label_names)
+
+
+gauge("background_queue_depth", "后台队列中等待处理的条目数", ("queue",))
+
+
+def queue_depth(queue: str, depth: int) -> Sample:
+    """后台队列深度样本（供采集函数使用）"""
+    return ("background_queue_depth", {"queue": queue}, depth)
+
+
+def register_collector(func: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+    """注册抓取时执行的采集函数（可作装饰器使用）"""
+    _collectors.append(func)
+    return func
+
+
+def _shard() -> Dict[str, Dict[Labels, object]]:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def inc(name: str, labels: Labels = (), amount: float = 1) -> None:
+    """计数器累加（只写当前线程的分片）"""
+    shard = _shard()
+    values = shard.get(name)
+    if values is None:
+        values = shard[name] = {}
+    values[labels] = values.get(labels, 0) + amount
+
+
+def observe(name: str, labels: Labels, seconds: float) -> None:
+    """直方图记录一次观测值（秒）"""
+    metric = _metrics.get(name)
+    if metric is None:
+        return
+    shard = _shard()
+    values = shard.get(name)
+    if values is None:
+        values = shard[name] = {}
+    data = values.get(labels)
+    if data is None:
+        data = values[labels] = [0] * (len(metric.buckets) + 2)
+    for i, bound in enumerate(metric.buckets):
+        if seconds <= bound:
+            data[i] += 1
+            break
+    data[-2] += 1
+    data[-1] += seconds
+
+
+def _merge() -> Dict[str, Dict[Labels, object]]:
+    with _shards_lock:
+        shards = list(_shards)
+    merged: Dict[str, Dict[Labels, object]] = {}
+    for shard in shards:
+        for name, values in list(shard.items()):
+            target = merged.setdefault(name, {})
+            for labels, value in list(values.items()):
+                if isinstance(value, list):
+                    current = target.get(labels)
+                    if current is None:
+                        target[labels] = list(value)
+                    else:
+                        for i, v in enumerate(value):
+                            current[i] += v
+                else:
+                    target[labels] = target.get(labels, 0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render() -> str:
+    """汇总所有线程分片与采集函数，生成指标文本"""
+    lines: List[str] = []
+    merged = _merge()
+    for name, metric in _metrics.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(merged.get(name, {}).items()):
+            if metric.kind == "counter":
+                lines.append(f"{name}{_format_labels(metric.label_names, labels)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets, value):
+                cumulative += count
+                le = _format_labels(metric.label_names, labels, ("le", _format_value(float(bound))))
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            inf = _format_labels(metric.label_names, labels, ("le", "+Inf"))
+            lines.append(f"{name}_bucket{inf} {value[-2]}")
+            lines.append(f"{name}_count{_format_labels(metric.label_names, labels)} {value[-2]}")
+            lines.append(f"{name}_sum{_format_labels(metric.label_names, labels)} {_format_value(float(value[-1]))}")
+
+    samples: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+    for collector in _collectors:
+        try:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append((labels, value))
+        except Exception as e:
+            logger.warning(f"指标采集失败 {getattr(collector, '__name__', collector)}: {e}")
+    for name, metric in _gauges.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples.get(name, ()):
+            label_values = [labels.get(n, "") for n in metric.label_names]
+            lines.append(f"{name}{_format_labels(metric.label_names, label_values)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,205 @@
+"""
+游标分页（keyset）
+按 (created_at, id) 倒序分页：游标是上一页最后一行的 (created_at, id)，下一页只需
+WHERE (created_at, id) < 游标 ... LIMIT n，配合 (…, created_at) 索引时深分页与首页一样快；
+OFFSET 分页需要先扫描并丢弃前面所有行，页数越深越慢。
+
+- 游标对客户端不透明（URL安全的base64），由上一页响应的 next_cursor 给出，没有下一页时为空
+- 保留原有的 skip/limit：未传 cursor 时按 skip 偏移，同样返回 next_cursor，可从任意页切换为游标翻页
+- 总数（COUNT）可选，关闭后省去一次全量统计
+
+总数缓存：同一筛选条件（按编译后的SQL与参数归一化）的总数在Redis中缓存 count_cache_ttl 秒，
+翻页时不再每页重复 COUNT；每张表是一个缓存命名空间（count_<表名>），缓存键包含命名空间代数，
+会话提交了该表的新增/删除后代数加一（CacheManager.bump_namespace），旧缓存不再命中并随TTL过期。
+- 只跟踪分页过的表（paginate 统计总数时登记），调用计数、日志批次等其它表的写入不产生任何Redis操作
+- 提交时只在本进程记下变更的表，由后台任务每 count_bump_interval 秒合并递增一次代数，
+  提交（包括 AsyncSession 在事件循环中的提交）不再同步访问Redis
+- 本worker尚未分页过的表不会被跟踪，其它worker缓存的总数最多陈旧 count_cache_ttl 秒
+估算模式（estimate=True）：无筛选条件时直接读取 information_schema 中的表行数统计（仅MySQL，InnoDB为估算值）。
+"""
+import base64
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, List, Optional, Set, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import and_, event, or_, text
+from sqlalchemy.orm import Session
+from app.cache import cache_manager
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+COUNT_CACHE_TTL = config.get('app.pagination.count_cache_ttl', 30)
+COUNT_BUMP_INTERVAL = config.get('app.pagination.count_bump_interval', 1)
+COUNT_NAMESPACE_PREFIX = "count_"
+
+# 缓存了总数的表（由 count 登记），以及已提交新增/删除、等待递增代数的表
+_counted_tables: Set[str] = set()
+_changed_tables: Set[str] = set()
+_changed_lock = threading.Lock()
+
+
+class Page:
+    """一页查询结果"""
+
+    __slots__ = ("items", "total", "next_cursor", "estimated")
+
+    def __init__(self, items: List[Any], total: Optional[int], next_cursor: Optional[str], estimated: bool = False):
+        self.items = items
+        self.total = total
+        self.next_cursor = next_cursor
+        self.estimated = estimated
+
+
+def encode_cursor(created_at: Optional[datetime], row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    """解析游标，格式错误时返回400"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return (datetime.fromisoformat(created_at) if created_at else None), int(row_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+
+def _after(model, created_at: Optional[datetime], row_id: int):
+    """排在游标之后的行（created_at 倒序，为空的行排在最后）"""
+    if created_at is None:
+        return and_(model.created_at.is_(None), model.id < row_id)
+    return or_(
+        model.created_at < created_at,
+        and_(model.created_at == created_at, model.id < row_id),
+        model.created_at.is_(None),
+    )
+
+
+# ==================== 总数缓存 ====================
+
+def bump_generation(*table_names: str) -> None:
+    """使这些表的总数缓存失效"""
+    for table_name in table_names:
+        cache_manager.bump_namespace(COUNT_NAMESPACE_PREFIX + table_name)
+
+
+def flush_count_generations() -> None:
+    """递增已变更表的总数缓存代数（后台周期任务）"""
+    with _changed_lock:
+        tables = list(_changed_tables)
+        _changed_tables.clear()
+    if tables:
+        bump_generation(*tables)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_tables(session, flush_context):
+    if not _counted_tables:
+        return
+    tables = None
+    for instance in list(session.new) + list(session.deleted):
+        table_name = getattr(instance, "__tablename__", None)
+        if table_name in _counted_tables:
+            if tables is None:
+                tables = session.info.setdefault("count_changed_tables", set())
+            tables.add(table_name)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_counts(session):
+    tables = session.info.pop("count_changed_tables", None)
+    if tables:
+        with _changed_lock:
+            _changed_tables.update(tables)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_tables(session):
+    session.info.pop("count_changed_tables", None)
+
+
+def _count_key(query, table_name: str) -> str:
+    """按编译后的SQL与参数归一化筛选条件（与参数顺序、写法无关）"""
+    compiled = query.statement.compile()
+    params = sorted((k, repr(v)) for k, v in compiled.params.items())
+    digest = hashlib.blake2b(f"{compiled}|{params}".encode("utf-8"), digest_size=16).hexdigest()
+    return cache_manager.namespaced_key(COUNT_NAMESPACE_PREFIX + table_name, digest)
+
+
+def _estimated_count(query, table_name: str) -> Optional[int]:
+    """无筛选条件时读取表行数统计（仅MySQL），不可用时返回None"""
+    if query.whereclause is not None or query.session.get_bind().dialect.name != "mysql":
+        return None
+    value = query.session.execute(
+        text("SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name"),
+        {"name": table_name}
+    ).scalar()
+    return None if value is None else int(value)
+
+
+def count(query, model, estimate: bool = False) -> Tuple[int, bool]:
+    """满足条件的总数（优先读缓存），返回 (总数, 是否为估算值)"""
+    query = query.order_by(None)
+    table_name = model.__tablename__
+    _counted_tables.add(table_name)
+    if estimate:
+        total = _estimated_count(query, table_name)
+        if total is not None:
+            return total, True
+
+    try:
+        key = _count_key(query, table_name)
+        cached = cache_manager.get(key)
+        if cached is not None:
+            return int(cached), False
+    except Exception as e:
+        logger.warning(f"读取总数缓存失败: {e}")
+        return query.count(), False
+
+    total = query.count()
+    cache_manager.set(key, total, COUNT_CACHE_TTL)
+    return total, False
+
+
+def paginate(
+    query,
+    model,
+    limit: int,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+    estimate: bool = False
+) -> Page:
+    """
+    按 (created_at, id) 倒序分页
+
+    Args:
+        query: 已应用筛选条件的查询（不含排序与分页）
+        model: 查询的模型（需有 created_at 与 id 列）
+        limit: 每页条数
+        skip: 偏移量（未传 cursor 时使用）
+        cursor: 上一页返回的 next_cursor
+        with_total: 是否统计满足条件的总数（结果缓存 count_cache_ttl 秒）
+        estimate: 无筛选条件时使用表统计信息估算总数
+    """
+    total, estimated = count(query, model, estimate) if with_total else (None, False)
+    query = query.order_by(model.created_at.desc(), model.id.desc())
+    if cursor:
+        query = query.filter(_after(model, *decode_cursor(cursor)))
+    elif skip:
+        query = query.offset(skip)
+    # 多取一行判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return Page(rows, total, next_cursor, estimated)
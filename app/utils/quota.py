@@ -0,0 +1,247 @@
+"""
+订阅调用次数配额（remaining_calls）
+用一个Redis Lua脚本原子地完成“检查剩余次数 + 扣减”，并发调用不会超额；
+Redis中的剩余次数用于放行判断，数据库按扣减增量对账（不以Redis的绝对值覆盖数据库）。
+
+- 配额键按订阅ID存储（quota:{subscription_id}），更换API密钥不影响剩余次数
+- 配额键不存在时以 Subscription.remaining_calls 作为初始值
+- 每次扣减同时累加到增量哈希（quota:deltas），对账任务把增量转为待对账批次，
+  在一个事务中写入批次ID（唯一约束，与调用计数共用 usage_flush_batches）并执行
+  remaining_calls = remaining_calls - 增量（不小于0），批次重复处理时跳过
+- 绕过Redis直接修改数据库剩余次数的路径（Redis不可用时的回退扣减）调用 mark_changed，
+  由对账任务按数据库值（扣除尚未对账的增量）重置Redis配额（reset）
+"""
+import logging
+import threading
+from typing import Dict, Optional, Set, Tuple
+from sqlalchemy import case, select, update
+from sqlalchemy.exc import IntegrityError
+from app.cache import cache_manager
+from app.config import config
+from app.database import db_manager, redis_manager
+from app.admin import models as admin_models
+from app.utils.usage_counter import snapshot_to_pending
+
+logger = logging.getLogger(__name__)
+
+QUOTA_PREFIX = "quota:"
+DELTAS_KEY = "quota:deltas"
+PENDING_SET_KEY = "quota:deltas:pending"
+PENDING_PREFIX = "quota:deltas:pending:"
+# 写入 usage_flush_batches 时的批次ID前缀（与调用计数批次区分）
+BATCH_ID_PREFIX = "quota:"
+
+# 配额键闲置多久后过期（过期后从已对账的数据库值重新初始化）
+QUOTA_TTL = config.get('app.usage.quota_ttl', 7 * 24 * 3600)
+
+# KEYS[1]=配额键 KEYS[2]=增量哈希
+# ARGV[1]=初始值 ARGV[2]=订阅ID ARGV[3]=本次消耗 ARGV[4]=过期时间
+# 返回 {是否允许(1/0), 剩余次数}
+_CONSUME_SCRIPT = """
+local remaining = redis.call('GET', KEYS[1])
+if not remaining then
+    remaining = ARGV[1]
+    redis.call('SET', KEYS[1], remaining)
+end
+remaining = tonumber(remaining)
+local cost = tonumber(ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+if remaining < cost then
+    return {0, remaining}
+end
+remaining = redis.call('DECRBY', KEYS[1], cost)
+redis.call('HINCRBY', KEYS[2], ARGV[2], cost)
+return {1, remaining}
+"""
+
+# KEYS[1]=配额键 KEYS[2]=增量哈希 KEYS[3]=待对账批次集合
+# ARGV[1]=数据库中的剩余次数 ARGV[2]=订阅ID ARGV[3]=待对账批次键前缀 ARGV[4]=过期时间
+# 数据库值尚未扣除未对账的增量，重置时一并扣除，返回重置后的剩余次数
+_RESET_SCRIPT = """
+local unreconciled = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or 0)
+for _, batch_id in ipairs(redis.call('SMEMBERS', KEYS[3])) do
+    unreconciled = unreconciled + tonumber(redis.call('HGET', ARGV[3] .. batch_id, ARGV[2]) or 0)
+end
+local remaining = math.max(tonumber(ARGV[1]) - unreconciled, 0)
+redis.call('SET', KEYS[1], remaining, 'EX', ARGV[4])
+return remaining
+"""
+
+_consume_script = None
+_consume_script_async = None
+_reset_script = None
+
+# 数据库剩余次数被直接修改、等待重置Redis配额的订阅
+_changed: Set[int] = set()
+_changed_lock = threading.Lock()
+
+
+def _quota_key(subscription_id: int) -> str:
+    return f"{QUOTA_PREFIX}{subscription_id}"
+
+
+def consume(subscription_id: int, seed_remaining: int, cost: int = 1) -> Optional[Tuple[bool, int]]:
+    """
+    原子地检查并扣减剩余次数
+
+    Args:
+        subscription_id: 订阅ID
+        seed_remaining: Redis中尚无配额时使用的初始值（Subscription.remaining_calls）
+        cost: 本次消耗次数
+
+    Returns:
+        (是否允许, 剩余次数)；Redis不可用时返回None，由调用方回退到数据库判断
+    """
+    global _consume_script
+    try:
+        if _consume_script is None:
+            _consume_script = cache_manager.redis.register_script(_CONSUME_SCRIPT)
+        allowed, remaining = _consume_script(
+            keys=[_quota_key(subscription_id), DELTAS_KEY],
+            args=[max(int(seed_remaining or 0), 0), subscription_id, cost, QUOTA_TTL]
+        )
+        return bool(int(allowed)), int(remaining)
+    except Exception as e:
+        logger.error(f"配额扣减失败: {e}")
+        return None
+
+
+async def consume_async(subscription_id: int, seed_remaining: int, cost: int = 1) -> Optional[Tuple[bool, int]]:
+    """consume 的异步版本（使用异步Redis客户端）"""
+    global _consume_script_async
+    try:
+        if _consume_script_async is None:
+            _consume_script_async = redis_manager.get_async_client().register_script(_CONSUME_SCRIPT)
+        allowed, remaining = await _consume_script_async(
+            keys=[_quota_key(subscription_id), DELTAS_KEY],
+            args=[max(int(seed_remaining or 0), 0), subscription_id, cost, QUOTA_TTL]
+        )
+        return bool(int(allowed)), int(remaining)
+    except Exception as e:
+        logger.error(f"配额扣减失败: {e}")
+        return None
+
+
+def reset(subscription_id: int, remaining_calls: Optional[int]) -> bool:
+    """按数据库中的剩余次数重置Redis配额（扣除尚未对账的增量）；None 表示不限次数"""
+    global _reset_script
+    try:
+        if remaining_calls is None:
+            cache_manager.redis.delete(_quota_key(subscription_id))
+            return True
+        if _reset_script is None:
+            _reset_script = cache_manager.redis.register_script(_RESET_SCRIPT)
+        _reset_script(
+            keys=[_quota_key(subscription_id), DELTAS_KEY, PENDING_SET_KEY],
+            args=[int(remaining_calls), subscription_id, PENDING_PREFIX, QUOTA_TTL]
+        )
+        return True
+    except Exception as e:
+        logger.error(f"重置配额失败: {e}")
+        return False
+
+
+def mark_changed(subscription_id: int) -> None:
+    """数据库中的剩余次数被直接修改（未经 consume）后调用，由对账任务重置Redis配额"""
+    with _changed_lock:
+        _changed.add(subscription_id)
+
+
+def _resync_changed() -> int:
+    """按数据库值重置被直接修改过的订阅配额，失败的留待下次对账，返回重置的订阅数"""
+    with _changed_lock:
+        if not _changed:
+            return 0
+        subscription_ids = list(_changed)
+        _changed.clear()
+
+    Sub = admin_models.Subscription
+    db = db_manager.create_session()
+    try:
+        remaining_map = dict(db.execute(
+            select(Sub.id, Sub.remaining_calls).where(Sub.id.in_(subscription_ids))
+        ).all())
+    except Exception as e:
+        logger.error(f"读取订阅剩余次数失败: {e}")
+        remaining_map = None
+    finally:
+        db.close()
+
+    failed = subscription_ids if remaining_map is None else [
+        sid for sid in subscription_ids if not reset(sid, remaining_map.get(sid))
+    ]
+    if failed:
+        with _changed_lock:
+            _changed.update(failed)
+    return len(subscription_ids) - len(failed)
+
+
+def _parse_deltas(data: Dict[str, str]) -> Dict[int, int]:
+    deltas: Dict[int, int] = {}
+    for field, value in data.items():
+        try:
+            subscription_id, delta = int(field), int(value)
+        except (TypeError, ValueError):
+            continue
+        if delta > 0:
+            deltas[subscription_id] = delta
+    return deltas
+
+
+def _apply_deltas(batch_id: str, deltas: Dict[int, int]) -> bool:
+    """在一个事务中写入批次记录并扣减剩余次数；批次已提交过时返回False"""
+    Sub = admin_models.Subscription
+    db = db_manager.create_session()
+    try:
+        db.add(admin_models.UsageFlushBatch(batch_id=BATCH_ID_PREFIX + batch_id))
+        db.flush()
+        delta = case(deltas, value=Sub.id, else_=0)
+        db.execute(
+            update(Sub)
+            .where(Sub.id.in_(list(deltas)), Sub.remaining_calls.isnot(None))
+            .values(remaining_calls=case((Sub.remaining_calls > delta, Sub.remaining_calls - delta), else_=0))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        logger.info(f"配额对账批次已提交过，跳过: {batch_id}")
+        return False
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def reconcile_quotas() -> int:
+    """把Redis中累计的扣减增量写回MySQL，并重置被直接修改过的订阅配额，返回写回的订阅数"""
+    try:
+        redis = cache_manager.redis
+        snapshot_to_pending(DELTAS_KEY, PENDING_PREFIX, PENDING_SET_KEY)
+        batch_ids = redis.smembers(PENDING_SET_KEY)
+    except Exception as e:
+        logger.error(f"读取配额增量失败: {e}")
+        return 0
+
+    reconciled = 0
+    for batch_id in batch_ids:
+        pending_key = PENDING_PREFIX + batch_id
+        try:
+            deltas = _parse_deltas(redis.hgetall(pending_key))
+            if deltas:
+                _apply_deltas(batch_id, deltas)
+                reconciled += len(deltas)
+            pipe = redis.pipeline(transaction=True)
+            pipe.delete(pending_key)
+            pipe.srem(PENDING_SET_KEY, batch_id)
+            pipe.execute()
+        except Exception as e:
+            # 批次保留在Redis中，下次重试
+            logger.error(f"配额对账失败 batch={batch_id}: {e}")
+
+    _resync_changed()
+    if reconciled:
+        logger.debug(f"配额已对账: {reconciled} 个订阅")
+    return reconciled
@@ -0,0 +1,197 @@
+"""
+API调用频率限制（GCRA，通用信元速率算法）
+状态保存在Redis中，每个桶只存一个“理论到达时间”(TAT)，一次Lua调用同时检查多个桶：
+
+- 客户端IP桶：ratelimit:ip:{ip}，限制单个IP的总请求速率（在任何数据库操作之前拦截刷接口/撞库流量）
+- 调用方桶：ratelimit:api:{api_id}:{身份}，身份为API密钥（无密钥的免费API使用客户端IP），
+  上限取 API.rate_limit_per_minute，为空时使用全局配置
+
+任一桶超限即拒绝（429），且不消耗其它桶的额度。
+"""
+import logging
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request, status
+from app.cache import LocalLRUCache, cache_manager
+from app.config import config
+from app.database import redis_manager
+from app.utils import invalidation
+from app.utils.concurrency import run_sync
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PREFIX = "ratelimit:"
+PERIOD_MS = 60 * 1000
+
+DEFAULT_LIMIT_PER_MINUTE = config.get('app.security.rate_limit_per_minute', 60)
+IP_LIMIT_PER_MINUTE = config.get('app.security.rate_limit_per_ip_per_minute', 300)
+
+# KEYS[i]=桶；ARGV[2i-1]=发射间隔(ms) ARGV[2i]=容忍度(ms，即间隔*突发量)
+# 返回 {是否允许, 最紧张桶的序号(1起), 剩余次数, 需等待(ms), 恢复满额(ms)}
+_GCRA_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local new_tats = {}
+local tightest, tightest_remaining, tightest_reset = 1, nil, 0
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[i * 2 - 1])
+    local tolerance = tonumber(ARGV[i * 2])
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then
+        tat = now
+    end
+    local new_tat = tat + interval
+    local allow_at = new_tat - tolerance
+    if allow_at > now then
+        return {0, i, 0, allow_at - now, tat - now}
+    end
+    new_tats[i] = new_tat
+    local remaining = math.floor((now - allow_at) / interval)
+    if tightest_remaining == nil or remaining < tightest_remaining then
+        tightest, tightest_remaining, tightest_reset = i, remaining, new_tat - now
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, new_tats[i], 'PX', math.max(new_tats[i] - now, 1))
+end
+return {1, tightest, tightest_remaining, 0, tightest_reset}
+"""
+
+_gcra_script = None
+_gcra_script_async = None
+_limit_cache = LocalLRUCache(16)
+LIMIT_CACHE_NAMESPACE = "rate_limit"
+LIMIT_CACHE_TTL = 60
+invalidation.subscribe("webconfig", lambda key: _limit_cache.clear())
+
+
+def get_client_ip(request: Request) -> str:
+    """
+    获取用于限流的客户端IP（连接对端地址）
+    不读取 X-Forwarded-For / X-Real-IP：这些头由客户端控制，轮换取值即可绕过按IP的限流。
+    部署在反向代理之后时，由uvicorn按 app.security.forwarded_allow_ips 信任的代理改写对端地址。
+    """
+    return request.client.host if request.client else "unknown"
+
+
+def get_default_limit() -> int:
+    """全局每分钟上限：网站配置 security.rate_limit_per_minute 优先，其次配置文件（本地缓存60秒）"""
+    limit = _limit_cache.get("default", None)
+    if limit is None:
+        from app.utils.webconfig_manager import get_config, ConfigKeys
+        limit = get_config(ConfigKeys.SECURITY_RATE_LIMIT_PER_MINUTE, DEFAULT_LIMIT_PER_MINUTE, int)
+        _limit_cache.set("default", LIMIT_CACHE_NAMESPACE, limit, LIMIT_CACHE_TTL)
+    return limit
+
+
+def _script_args(buckets: List[Tuple[str, int]]) -> Tuple[List[str], List[int]]:
+    keys, args = [], []
+    for key, limit in buckets:
+        interval = max(PERIOD_MS // limit, 1)
+        keys.append(key)
+        args.extend([interval, interval * limit])
+    return keys, args
+
+
+def _check(buckets: List[Tuple[str, int]]) -> Optional[tuple]:
+    """检查一组 (桶键, 每分钟上限)，Redis不可用时返回None（放行）"""
+    global _gcra_script
+    keys, args = _script_args(buckets)
+    try:
+        if _gcra_script is None:
+            _gcra_script = cache_manager.redis.register_script(_GCRA_SCRIPT)
+        return tuple(_gcra_script(keys=keys, args=args))
+    except Exception as e:
+        logger.error(f"频率限制检查失败，放行请求: {e}")
+        return None
+
+
+async def _check_async(buckets: List[Tuple[str, int]]) -> Optional[tuple]:
+    """_check 的异步版本（使用异步Redis客户端）"""
+    global _gcra_script_async
+    keys, args = _script_args(buckets)
+    try:
+        if _gcra_script_async is None:
+            _gcra_script_async = redis_manager.get_async_client().register_script(_GCRA_SCRIPT)
+        return tuple(await _gcra_script_async(keys=keys, args=args))
+    except Exception as e:
+        logger.error(f"频率限制检查失败，放行请求: {e}")
+        return None
+
+
+def _build_buckets(
+    request: Request,
+    api_id: int,
+    api_key: Optional[str],
+    api_limit: Optional[int]
+) -> List[Tuple[str, int]]:
+    client_ip = get_client_ip(request)
+    buckets: List[Tuple[str, int]] = []
+    if IP_LIMIT_PER_MINUTE:
+        buckets.append((f"{RATE_LIMIT_PREFIX}ip:{client_ip}", IP_LIMIT_PER_MINUTE))
+    caller_limit = api_limit or get_default_limit()
+    if caller_limit:
+        identity = f"key:{api_key}" if api_key else f"ip:{client_ip}"
+        buckets.append((f"{RATE_LIMIT_PREFIX}api:{api_id}:{identity}", caller_limit))
+    return buckets
+
+
+def _apply_result(request: Request, buckets: List[Tuple[str, int]], result: Optional[tuple]) -> Dict[str, str]:
+    """根据脚本结果生成响应头，超限时抛出429"""
+    if result is None:
+        return {}
+
+    allowed, index, remaining, retry_after, reset = (int(v) for v in result)
+    headers = {
+        "X-RateLimit-Limit": str(buckets[index - 1][1]),
+        "X-RateLimit-Remaining": str(max(remaining, 0)),
+        "X-RateLimit-Reset": str((reset + 999) // 1000),
+    }
+    if not allowed:
+        headers["Retry-After"] = str((retry_after + 999) // 1000)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="请求过于频繁，请稍后再试",
+            headers=headers
+        )
+
+    request.state.rate_limit_headers = headers
+    return headers
+
+
+def enforce_rate_limit(
+    request: Request,
+    api_id: int,
+    api_key: Optional[str] = None,
+    api_limit: Optional[int] = None
+) -> Dict[str, str]:
+    """
+    检查频率限制，超限时抛出429；通过时返回 X-RateLimit-* 响应头，并保存在 request.state.rate_limit_headers
+
+    Args:
+        request: 请求对象
+        api_id: API ID
+        api_key: API密钥（免费API为空，按客户端IP限流）
+        api_limit: 该API的每分钟上限（为空使用全局配置）
+    """
+    buckets = _build_buckets(request, api_id, api_key, api_limit)
+    if not buckets:
+        return {}
+    return _apply_result(request, buckets, _check(buckets))
+
+
+async def enforce_rate_limit_async(
+    request: Request,
+    api_id: int,
+    api_key: Optional[str] = None,
+    api_limit: Optional[int] = None
+) -> Dict[str, str]:
+    """enforce_rate_limit 的异步版本（不阻塞事件循环）"""
+    if not api_limit:
+        # 全局上限可能需要查询网站配置，本地缓存未命中时放到线程池
+        api_limit = _limit_cache.get("default", None)
+        if api_limit is None:
+            api_limit = await run_sync(get_default_limit)
+    buckets = _build_buckets(request, api_id, api_key, api_limit)
+    if not buckets:
+        return {}
+    return _apply_result(request, buckets, await _check_async(buckets))
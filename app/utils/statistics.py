@@ -5,9 +5,11 @@
 import logging
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import case, func, select
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.admin import models as admin_models
+from app.utils import call_counter, quota
 
 logger = logging.getLogger(__name__)
 
@@ -64,15 +66,20 @@ class APIStatistics:
                 logger.warning(f"未找到API别名对应的接口: {api_alias}")
                 return False
             
-            # 不再写入APILog，仅更新API累计调用次数
-            api.call_count += 1
+            # 调用明细由网关的使用事件写入 api_call_logs（app.utils.call_log），这里仅更新累计次数
+            call_counter.increment(self.db, api.id)
             
-            # 更新订阅使用统计
+            # 更新订阅使用统计（剩余次数由Redis原子扣减，Redis不可用时才直接扣减数据库）
             subscription.used_calls += 1
+            remaining_changed = False
             if subscription.remaining_calls is not None and subscription.remaining_calls > 0:
-                subscription.remaining_calls -= 1
+                if quota.consume(subscription.id, subscription.remaining_calls) is None:
+                    subscription.remaining_calls -= 1
+                    remaining_changed = True
             
             self.db.commit()
+            if remaining_changed:
+                quota.mark_changed(subscription.id)
             
             logger.info(f"API调用已记录: user_id={subscription.user_id}, api_id={api.id}, endpoint={endpoint}")
             return True
@@ -82,6 +89,24 @@ class APIStatistics:
             self.db.rollback()
             return False
     
+    def _aggregate_calls(self, *conditions) -> dict:
+        """按调用明细聚合总次数、成功/失败次数与平均耗时（状态码 < 400 视为成功）"""
+        Log = admin_models.APICallLog
+        total, success, avg_latency = self.db.query(
+            func.count(Log.id),
+            func.coalesce(func.sum(case((Log.status_code < 400, 1), else_=0)), 0),
+            func.avg(Log.latency_ms)
+        ).filter(*conditions).one()
+        total = int(total or 0)
+        success = int(success or 0)
+        return {
+            "total_calls": total,
+            "success_calls": success,
+            "error_calls": total - success,
+            "success_rate": round(success / total * 100, 2) if total else 0,
+            "avg_latency_ms": round(float(avg_latency), 2) if avg_latency is not None else 0,
+        }
+    
     def get_api_statistics(self, api_alias: str, days: int = 30) -> dict:
         """
         获取API统计信息
@@ -108,18 +133,16 @@ class APIStatistics:
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days)
             
-            # 无明细日志时，直接返回API累计次数
-            total_calls = api.call_count or 0
-            success_calls = 0
-            error_calls = 0
+            Log = admin_models.APICallLog
+            calls = self._aggregate_calls(Log.api_id == api.id, Log.created_at >= start_date)
             
             return {
                 "api_alias": api_alias,
                 "api_title": api.title,
-                "total_calls": total_calls,
-                "success_calls": success_calls,
-                "error_calls": error_calls,
-                "success_rate": 0,
+                **calls,
+                "cumulative_calls": self.db.scalar(
+                    select(call_counter.total_calls_expr()).where(admin_models.API.id == api.id)
+                ) or 0,
                 "period_days": days,
                 "start_date": start_date.isoformat(),
                 "end_date": end_date.isoformat()
@@ -150,13 +173,8 @@ class APIStatistics:
             end_date = datetime.utcnow()
             start_date = end_date - timedelta(days=days)
             
-            # 用户维度统计改为聚合订阅使用计数
-            subs = self.db.query(admin_models.Subscription).filter(
-                admin_models.Subscription.user_id == user_id
-            ).all()
-            total_calls = sum((s.used_calls or 0) for s in subs)
-            success_calls = 0
-            error_calls = 0
+            Log = admin_models.APICallLog
+            calls = self._aggregate_calls(Log.user_id == user_id, Log.created_at >= start_date)
             
             # 获取用户订阅的API列表
             subscriptions = self.db.query(admin_models.Subscription).filter(
@@ -178,10 +196,7 @@ class APIStatistics:
             
             return {
                 "user_id": user_id,
-                "total_calls": total_calls,
-                "success_calls": success_calls,
-                "error_calls": error_calls,
-                "success_rate": 0,
+                **calls,
                 "subscribed_apis": subscribed_apis,
                 "period_days": days,
                 "start_date": start_date.isoformat(),
@@ -0,0 +1,183 @@
+"""
+API调用计数缓冲
+调用时在Redis中原子累加（HINCRBY），由后台任务每隔N秒批量刷写到MySQL，
+避免每次调用都对 apis 热点行加锁提交（API调用次数写入 api_call_counters 分片，见 call_counter）。
+
+刷写流程（可跨重启、不重复计数）：
+1. 用Lua脚本把当前计数哈希原子地 RENAME 为待刷写批次，并登记到待刷写集合
+2. 在同一个数据库事务中写入批次ID（唯一约束）并执行批量UPDATE
+   - 批次ID已存在说明该批次此前已提交（例如提交后进程崩溃、未来得及清理），直接跳过
+3. 提交后删除Redis中的批次
+进程崩溃时未清理的批次会在下一次刷写（任意worker）时被重新处理。
+"""
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import case, func, update
+from sqlalchemy.exc import IntegrityError
+from app.cache import cache_manager
+from app.config import config
+from app.database import db_manager, redis_manager
+from app.admin import models as admin_models
+from app.utils import call_counter
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_KEY = "usage:counters"
+PENDING_SET_KEY = "usage:pending"
+PENDING_PREFIX = "usage:pending:"
+
+FLUSH_INTERVAL = config.get('app.usage.flush_interval', 5)
+# 批次记录保留天数（远大于任何批次的滞留时间即可）
+BATCH_RETENTION_DAYS = config.get('app.usage.batch_retention_days', 7)
+
+_SNAPSHOT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    redis.call('SADD', KEYS[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_snapshot_script = None
+
+
+def incr_call(api_id: int, subscription_id: Optional[int] = None, amount: int = 1) -> bool:
+    """累加一次API调用（及订阅使用次数），Redis不可用时返回False由调用方回退"""
+    try:
+        pipe = cache_manager.redis.pipeline(transaction=True)
+        pipe.hincrby(COUNTERS_KEY, f"a:{api_id}", amount)
+        if subscription_id is not None:
+            pipe.hincrby(COUNTERS_KEY, f"s:{subscription_id}", amount)
+        pipe.execute()
+        return True
+    except Exception as e:
+        logger.error(f"累加调用计数失败: {e}")
+        return False
+
+
+async def incr_call_async(api_id: int, subscription_id: Optional[int] = None, amount: int = 1) -> bool:
+    """incr_call 的异步版本（使用异步Redis客户端）"""
+    try:
+        pipe = redis_manager.get_async_client().pipeline(transaction=True)
+        pipe.hincrby(COUNTERS_KEY, f"a:{api_id}", amount)
+        if subscription_id is not None:
+            pipe.hincrby(COUNTERS_KEY, f"s:{subscription_id}", amount)
+        await pipe.execute()
+        return True
+    except Exception as e:
+        logger.error(f"累加调用计数失败: {e}")
+        return False
+
+
+def snapshot_to_pending(source_key: str, pending_prefix: str, pending_set_key: str) -> Optional[str]:
+    """把 source_key 原子地转为待处理批次并登记，返回批次ID（source_key 不存在时返回None）"""
+    global _snapshot_script
+    if _snapshot_script is None:
+        _snapshot_script = cache_manager.redis.register_script(_SNAPSHOT_SCRIPT)
+    batch_id = uuid.uuid4().hex
+    moved = _snapshot_script(
+        keys=[source_key, pending_prefix + batch_id, pending_set_key],
+        args=[batch_id]
+    )
+    return batch_id if moved else None
+
+
+def _parse_counters(data: Dict[str, str]):
+    api_deltas: Dict[int, int] = {}
+    sub_deltas: Dict[int, int] = {}
+    for field, value in data.items():
+        kind, _, raw_id = field.partition(":")
+        try:
+            target_id, delta = int(raw_id), int(value)
+        except (TypeError, ValueError):
+            continue
+        if delta <= 0:
+            continue
+        if kind == "a":
+            api_deltas[target_id] = delta
+        elif kind == "s":
+            sub_deltas[target_id] = delta
+    return api_deltas, sub_deltas
+
+
+def _apply_batch(batch_id: str, api_deltas: Dict[int, int], sub_deltas: Dict[int, int]) -> bool:
+    """在一个事务中写入批次记录并批量更新计数；批次已提交过时返回False"""
+    db = db_manager.create_session()
+    try:
+        db.add(admin_models.UsageFlushBatch(batch_id=batch_id))
+        db.flush()
+
+        call_counter.add(db, api_deltas)
+
+        if sub_deltas:
+            # remaining_calls 由 quota 模块的对账任务维护，这里只累加已用次数
+            Sub = admin_models.Subscription
+            db.execute(
+                update(Sub)
+                .where(Sub.id.in_(list(sub_deltas)))
+                .values(used_calls=func.coalesce(Sub.used_calls, 0) + case(sub_deltas, value=Sub.id, else_=0))
+                .execution_options(synchronize_session=False)
+            )
+
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        logger.info(f"调用计数批次已提交过，跳过: {batch_id}")
+        return False
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def flush_usage_counters() -> int:
+    """把Redis中缓冲的计数刷写到MySQL，返回处理的批次数"""
+    try:
+        redis = cache_manager.redis
+        snapshot_to_pending(COUNTERS_KEY, PENDING_PREFIX, PENDING_SET_KEY)
+        batch_ids = redis.smembers(PENDING_SET_KEY)
+    except Exception as e:
+        logger.error(f"读取调用计数缓冲失败: {e}")
+        return 0
+
+    processed = 0
+    for batch_id in batch_ids:
+        pending_key = PENDING_PREFIX + batch_id
+        try:
+            api_deltas, sub_deltas = _parse_counters(redis.hgetall(pending_key))
+            if api_deltas or sub_deltas:
+                _apply_batch(batch_id, api_deltas, sub_deltas)
+            pipe = redis.pipeline(transaction=True)
+            pipe.delete(pending_key)
+            pipe.srem(PENDING_SET_KEY, batch_id)
+            pipe.execute()
+            processed += 1
+            logger.debug(f"调用计数已刷写: batch={batch_id}, apis={len(api_deltas)}, subscriptions={len(sub_deltas)}")
+        except Exception as e:
+            # 批次保留在Redis中，下次重试
+            logger.error(f"刷写调用计数失败 batch={batch_id}: {e}")
+
+    if processed:
+        _prune_batches()
+    return processed
+
+
+def _prune_batches():
+    """清理过期的批次记录"""
+    db = db_manager.create_session()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=BATCH_RETENTION_DAYS)
+        db.query(admin_models.UsageFlushBatch).filter(
+            admin_models.UsageFlushBatch.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"清理调用计数批次记录失败: {e}")
+    finally:
+        db.close()
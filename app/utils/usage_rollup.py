@@ -0,0 +1,229 @@
+"""
+API调用量时间分桶汇总
+使用事件在进程内按（分钟桶, API, 订阅）累加，由后台任务定期以多行 INSERT（键冲突时累加，
+MySQL 为 ON DUPLICATE KEY UPDATE，SQLite 为 ON CONFLICT DO UPDATE）同时累加到分钟、小时、天三种粒度的汇总行（api_usage_rollups）。
+
+- 每个API另有 subscription_id=0 的整体汇总行，仪表盘“最近24小时各API调用量”只需一次按索引的范围扫描
+- 降采样压缩：分钟粒度只保留最近 minute_retention_hours 小时，小时粒度保留 hour_retention_days 天，
+  更早的数据只保留在更粗的粒度中（天粒度长期保留）
+- 进程内缓冲在应用关闭时再刷写一次；进程崩溃最多丢失一个刷写间隔的汇总数据（调用计数与计费不受影响）
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, func
+from app.config import config
+from app.database import db_manager, insert_or_increment
+from app.admin import models as admin_models
+from app.utils import gateway, metrics
+
+logger = logging.getLogger(__name__)
+
+MINUTE = "minute"
+HOUR = "hour"
+DAY = "day"
+GRANULARITIES = (MINUTE, HOUR, DAY)
+
+FLUSH_INTERVAL = config.get('app.rollup.flush_interval', 10)
+MINUTE_RETENTION_HOURS = config.get('app.rollup.minute_retention_hours', 48)
+HOUR_RETENTION_DAYS = config.get('app.rollup.hour_retention_days', 90)
+COMPACT_INTERVAL = config.get('app.rollup.compact_interval', 600)
+
+# (分钟桶起始, API ID, 订阅ID) -> [调用次数, 成功次数, 失败次数, 耗时合计, 字节数合计]
+_pending: Dict[Tuple[datetime, int, int], List[float]] = {}
+_pending_lock = threading.Lock()
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    """时间所在分桶的起始时间"""
+    moment = moment.replace(second=0, microsecond=0)
+    if granularity in (HOUR, DAY):
+        moment = moment.replace(minute=0)
+    if granularity == DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _add(key: Tuple[datetime, int, int], success: bool, latency_ms: float, response_bytes: int) -> None:
+    entry = _pending.get(key)
+    if entry is None:
+        entry = _pending[key] = [0, 0, 0, 0.0, 0]
+    entry[0] += 1
+    entry[1 if success else 2] += 1
+    entry[3] += latency_ms
+    entry[4] += response_bytes
+
+
+def record(event: gateway.UsageEvent) -> None:
+    """把一次调用累加到进程内缓冲（API整体汇总 + 订阅汇总）"""
+    minute = bucket_start(event.created_at, MINUTE)
+    success = (event.status_code or 500) < 400
+    latency_ms = event.latency_ms or 0.0
+    response_bytes = event.response_bytes or 0
+    with _pending_lock:
+        _add((minute, event.api_id, 0), success, latency_ms, response_bytes)
+        if event.subscription_id:
+            _add((minute, event.api_id, event.subscription_id), success, latency_ms, response_bytes)
+
+
+@gateway.subscribe_usage_events
+async def rollup_api_call(event: gateway.UsageEvent) -> None:
+    """使用事件处理：累加到时间分桶汇总"""
+    record(event)
+
+
+@metrics.register_collector
+def _collect_pending():
+    return [metrics.queue_depth("usage_rollup", len(_pending))]
+
+
+def _rows_for(pending: Dict[Tuple[datetime, int, int], List[float]]) -> List[dict]:
+    """把分钟缓冲展开为三种粒度的汇总行（同一小时/天的分钟桶先在内存中合并）"""
+    merged: Dict[Tuple[str, datetime, int, int], List[float]] = {}
+    for (minute, api_id, subscription_id), values in pending.items():
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(minute, granularity), api_id, subscription_id)
+            entry = merged.get(key)
+            if entry is None:
+                merged[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    entry[i] += value
+    return [
+        {
+            "granularity": granularity,
+            "bucket_start": start,
+            "api_id": api_id,
+            "subscription_id": subscription_id,
+            "calls": int(values[0]),
+            "success_calls": int(values[1]),
+            "error_calls": int(values[2]),
+            "latency_ms_sum": float(values[3]),
+            "response_bytes_sum": int(values[4]),
+        }
+        for (granularity, start, api_id, subscription_id), values in merged.items()
+    ]
+
+
+def _restore(pending: Dict[Tuple[datetime, int, int], List[float]]) -> None:
+    """刷写失败时把数据放回缓冲，下次重试"""
+    with _pending_lock:
+        for key, values in pending.items():
+            entry = _pending.get(key)
+            if entry is None:
+                _pending[key] = values
+            else:
+                for i, value in enumerate(values):
+                    entry[i] += value
+
+
+def flush_rollups() -> int:
+    """把进程内缓冲刷写到汇总表，返回写入的汇总行数"""
+    global _pending
+    with _pending_lock:
+        if not _pending:
+            return 0
+        pending, _pending = _pending, {}
+
+    rows = _rows_for(pending)
+    db = db_manager.create_session()
+    try:
+        stmt = insert_or_increment(
+            db.get_bind().dialect.name,
+            admin_models.APIUsageRollup,
+            ("granularity", "subscription_id", "bucket_start", "api_id"),
+            ("calls", "success_calls", "error_calls", "latency_ms_sum", "response_bytes_sum"),
+        )
+        db.execute(stmt, rows)
+        db.commit()
+        return len(rows)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"刷写调用汇总失败: {e}")
+        _restore(pending)
+        return 0
+    finally:
+        db.close()
+
+
+def compact_rollups() -> int:
+    """降采样压缩：删除超过保留期的分钟、小时粒度汇总，返回删除的行数"""
+    now = datetime.now(timezone.utc)
+    Rollup = admin_models.APIUsageRollup
+    cutoffs = {
+        MINUTE: now - timedelta(hours=MINUTE_RETENTION_HOURS),
+        HOUR: now - timedelta(days=HOUR_RETENTION_DAYS),
+    }
+    total = 0
+    db = db_manager.create_session()
+    try:
+        for granularity, cutoff in cutoffs.items():
+            result = db.execute(
+                delete(Rollup).where(
+                    Rollup.granularity == granularity,
+                    Rollup.bucket_start < cutoff
+                )
+            )
+            total += result.rowcount or 0
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"压缩调用汇总失败: {e}")
+    finally:
+        db.close()
+    return total
+
+
+def _summary(calls, success, errors, latency_sum, bytes_sum) -> dict:
+    calls = int(calls or 0)
+    success = int(success or 0)
+    return {
+        "total_calls": calls,
+        "success_calls": success,
+        "error_calls": int(errors or 0),
+        "success_rate": round(success / calls * 100, 2) if calls else 0,
+        "avg_response_time": round(float(latency_sum or 0) / calls, 2) if calls else 0,
+        "response_bytes": int(bytes_sum or 0),
+    }
+
+
+def _aggregates():
+    Rollup = admin_models.APIUsageRollup
+    return (
+        func.sum(Rollup.calls),
+        func.sum(Rollup.success_calls),
+        func.sum(Rollup.error_calls),
+        func.sum(Rollup.latency_ms_sum),
+        func.sum(Rollup.response_bytes_sum),
+    )
+
+
+def get_totals(db, since: datetime, granularity: str = HOUR, subscription_id: int = 0) -> dict:
+    """统计 since 之后（按分桶起始时间）所有API的调用汇总"""
+    Rollup = admin_models.APIUsageRollup
+    row = db.query(*_aggregates()).filter(
+        Rollup.granularity == granularity,
+        Rollup.subscription_id == subscription_id,
+        Rollup.bucket_start >= since
+    ).one()
+    return _summary(*row)
+
+
+def get_by_api(
+    db,
+    since: datetime,
+    granularity: str = HOUR,
+    subscription_id: int = 0,
+    api_id: Optional[int] = None
+) -> Dict[int, dict]:
+    """按API分组统计 since 之后的调用汇总（一次按唯一索引的范围扫描）"""
+    Rollup = admin_models.APIUsageRollup
+    query = db.query(Rollup.api_id, *_aggregates()).filter(
+        Rollup.granularity == granularity,
+        Rollup.subscription_id == subscription_id,
+        Rollup.bucket_start >= since
+    )
+    if api_id is not None:
+        query = query.filter(Rollup.api_id == api_id)
+    return {row[0]: _summary(*row[1:]) for row in query.group_by(Rollup.api_id).all()}
@@ -8,6 +8,7 @@
 from typing import Any, Optional, Dict
 from app.database import get_db
 from app.admin.crud import WebConfigCRUD
+from app.utils import invalidation
 import logging
 import json
 
@@ -85,6 +86,7 @@ class WebConfigManager:
             db = next(get_db())
             WebConfigCRUD.set_config(db, key, str_value)
             db.close()
+            invalidation.publish("webconfig", key)
             return True
         except Exception as e:
             logger.error(f"设置配置失败 {key}: {e}")
@@ -109,6 +111,8 @@ class WebConfigManager:
             db = next(get_db())
             success = WebConfigCRUD.delete_by_key(db, key)
             db.close()
+            if success:
+                invalidation.publish("webconfig", key)
             return success
         except Exception as e:
             logger.error(f"删除配置失败 {key}: {e}")
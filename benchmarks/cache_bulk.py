@@ -0,0 +1,158 @@
+"""
+缓存批量读取基准：对比 N 次 GET、一次 MGET 与管道 GET 的耗时
+
+- N×GET：逐个读取，N 次网络往返（批量接口出现之前的写法）
+- MGET：CacheManager.get_many 使用的方式，一次往返
+- 管道：CacheManager.pipeline() / set_many 使用的方式，一次往返、N 条命令
+
+默认在本进程内启动一个只支持少量命令的 RESP 服务（监听回环地址）作为本地Redis替身，
+客户端仍是 redis-py，走真实的TCP往返，可以看出往返次数的差异；--url 指定真实Redis时结果更接近生产，
+注意会在该库中写入 bench: 前缀的测试键（结束后删除），请使用测试库。
+
+用法（在项目根目录）：
+    python benchmarks/cache_bulk.py --keys 10,50,200 --rounds 500
+    python benchmarks/cache_bulk.py --url "redis://127.0.0.1:6379/15"
+"""
+import argparse
+import os
+import socketserver
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis  # noqa: E402
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """最小的 RESP2 实现：GET / MGET / SET / SETEX / DEL / PING，其余命令（握手用的 CLIENT、SELECT 等）返回 OK"""
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        data = self.server.data
+        while True:
+            args = self._read_command()
+            if not args:
+                return
+            name = args[0].upper()
+            if name == b"GET":
+                reply = self._bulk(data.get(args[1]))
+            elif name == b"MGET":
+                reply = b"*%d\r\n" % (len(args) - 1) + b"".join(self._bulk(data.get(k)) for k in args[1:])
+            elif name == b"SET":
+                data[args[1]] = args[2]
+                reply = b"+OK\r\n"
+            elif name == b"SETEX":
+                data[args[1]] = args[3]
+                reply = b"+OK\r\n"
+            elif name == b"DEL":
+                reply = b":%d\r\n" % sum(data.pop(k, None) is not None for k in args[1:])
+            elif name == b"PING":
+                reply = b"+PONG\r\n"
+            else:
+                reply = b"+OK\r\n"
+            self.wfile.write(reply)
+
+
+class _RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _RespHandler)
+        self.data = {}
+
+
+def start_stand_in() -> _RespServer:
+    server = _RespServer()
+    threading.Thread(target=server.serve_forever, name="resp-stand-in", daemon=True).start()
+    return server
+
+
+def read_each(client, keys):
+    return [client.get(key) for key in keys]
+
+
+def read_mget(client, keys):
+    return client.mget(keys)
+
+
+def read_pipeline(client, keys):
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.get(key)
+    return pipe.execute()
+
+
+def run_case(client, read, keys, rounds: int):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        read(client, keys)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "avg": statistics.fmean(timings),
+        "p50": timings[len(timings) // 2],
+        "p99": timings[min(int(len(timings) * 0.99), len(timings) - 1)],
+    }
+
+
+def main(url: str, sizes, rounds: int):
+    server = None
+    if not url:
+        server = start_stand_in()
+        url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    client = redis.Redis.from_url(url, decode_responses=True)
+    client.ping()
+
+    keys = [f"bench:cache_bulk:{i}" for i in range(max(sizes))]
+    value = '{"id": 1, "status": "active", "remaining_calls": 100}'
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.setex(key, 600, value)
+    pipe.execute()
+
+    print(f"Redis: {'本地替身' if server else url}，每组轮数: {rounds}")
+    print(f"{'键数':>6}  {'方式':<10}{'平均(ms)':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+    try:
+        for size in sizes:
+            subset = keys[:size]
+            for name, read in (("N×GET", read_each), ("MGET", read_mget), ("管道GET", read_pipeline)):
+                run_case(client, read, subset, min(rounds, 50))  # 预热
+                result = run_case(client, read, subset, rounds)
+                print(f"{size:>6}  {name:<10}{result['avg']:>10.3f}{result['p50']:>10.3f}{result['p99']:>10.3f}")
+    finally:
+        client.delete(*keys)
+        client.close()
+        if server:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="缓存批量读取基准")
+    parser.add_argument("--url", default="", help="Redis URL（默认使用进程内的本地替身）")
+    parser.add_argument("--keys", default="10,50,200", help="每次读取的键数，逗号分隔")
+    parser.add_argument("--rounds", type=int, default=500, help="每种方式的读取轮数")
+    args = parser.parse_args()
+    main(args.url, [int(n) for n in args.keys.split(",") if n], args.rounds)
@@ -0,0 +1,65 @@
+"""
+网关并发基准：对比 async 路由中直接调用阻塞代码 与 通过 run_sync 卸载到线程池
+
+模拟 N 个并发请求，每个请求包含一次阻塞的“验证 + 上游请求”（time.sleep 代替同步SQLAlchemy/requests），
+同时测量一个不做阻塞I/O的“快请求”的延迟，观察事件循环是否被冻结。
+
+用法（在项目根目录）：
+    python benchmarks/gateway_concurrency.py --requests 50 --blocking-ms 100
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.concurrency import run_sync, shutdown  # noqa: E402
+
+
+def blocking_call(seconds: float) -> float:
+    """阻塞调用的替身（同步数据库查询 / 上游HTTP请求）"""
+    time.sleep(seconds)
+    return seconds
+
+
+async def handler_inline(seconds: float):
+    return blocking_call(seconds)
+
+
+async def handler_offloaded(seconds: float):
+    return await run_sync(blocking_call, seconds)
+
+
+async def fast_handler() -> float:
+    """纯内存请求，返回完成时刻"""
+    return time.perf_counter()
+
+
+async def run_case(handler, requests: int, seconds: float):
+    start = time.perf_counter()
+    slow = [asyncio.create_task(handler(seconds)) for _ in range(requests)]
+    # 快请求排在所有慢请求之后进入事件循环
+    fast = asyncio.create_task(fast_handler())
+    fast_done = await fast
+    await asyncio.gather(*slow)
+    return time.perf_counter() - start, fast_done - start
+
+
+async def main(requests: int, blocking_ms: int):
+    seconds = blocking_ms / 1000
+    print(f"并发请求数: {requests}，单次阻塞: {blocking_ms}ms")
+    print(f"{'模式':<12}{'总耗时(s)':>12}{'快请求延迟(ms)':>18}")
+    for name, handler in (("直接调用", handler_inline), ("run_sync", handler_offloaded)):
+        total, fast = await run_case(handler, requests, seconds)
+        print(f"{name:<12}{total:>12.3f}{fast * 1000:>18.2f}")
+    shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="网关并发基准")
+    parser.add_argument("--requests", type=int, default=50, help="并发请求数")
+    parser.add_argument("--blocking-ms", type=int, default=100, help="每个请求的阻塞时间（毫秒）")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.blocking_ms))
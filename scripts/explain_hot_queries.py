@@ -0,0 +1,105 @@
+"""
+热点查询执行计划检查：对每个热点查询执行 EXPLAIN，确认用上了迁移 0003 建立的组合索引
+
+查询与代码中的写法一致（用户订阅查找、密钥验证、订单列表、最后登录时间、前台热门列表），
+参数取表中已有的一行数据；表为空或数据很少时优化器可能选择全表扫描，请在有代表性数据的库上运行。
+
+用法（在项目根目录，使用 config 中的数据库配置）：
+    python scripts/explain_hot_queries.py
+    python scripts/explain_hot_queries.py --verbose   # 同时打印完整执行计划
+全部查询用上预期索引时退出码为0，否则为1。
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select, text  # noqa: E402
+from app.database import db_manager  # noqa: E402
+from app.admin import models  # noqa: E402
+
+
+def _sample(conn, column, default):
+    value = conn.execute(select(column).where(column.is_not(None)).limit(1)).scalar()
+    return default if value is None else value
+
+
+def hot_queries(conn):
+    """(名称, 语句, 可接受的索引名)"""
+    Sub, Order, Log, API = models.Subscription, models.Order, models.SystemLog, models.API
+    user_id = _sample(conn, Sub.user_id, 1)
+    api_id = _sample(conn, Sub.api_id, 1)
+    api_key = _sample(conn, Sub.api_key, "0" * 64)
+    order_user_id = _sample(conn, Order.user_id, 1)
+    actor_id = _sample(conn, Log.actor_id, 1)
+    return [
+        (
+            "购买/更新密钥：按用户+API+状态查找订阅",
+            select(Sub.id).where(Sub.user_id == user_id, Sub.api_id == api_id, Sub.status == "active"),
+            ("ix_subscriptions_user_api_status",),
+        ),
+        (
+            # api_key 本身唯一，优化器可能直接用唯一索引（常量查找），同样可接受
+            "密钥验证：按 api_key 读取鉴权列",
+            select(Sub.status, Sub.end_date, Sub.remaining_calls, Sub.user_id, Sub.api_id).where(Sub.api_key == api_key),
+            ("ix_subscriptions_key_cover", "api_key"),
+        ),
+        (
+            "用户订单列表：按用户过滤、按时间倒序",
+            select(Order.id).where(Order.user_id == order_user_id).order_by(Order.created_at.desc()).limit(20),
+            ("ix_orders_user_created",),
+        ),
+        (
+            "最后登录时间：按操作者+动作取最大时间",
+            select(Log.actor_id, func.max(Log.created_at))
+            .where(Log.actor_id.in_([actor_id]), Log.action == "login")
+            .group_by(Log.actor_id),
+            ("ix_system_logs_actor_action_created",),
+        ),
+        (
+            "前台热门API：启用且公开、按调用次数倒序",
+            select(API.id).where(API.is_active == True, API.is_public == True)  # noqa: E712
+            .order_by(API.call_count.desc()).limit(10),
+            ("ix_apis_active_public_calls",),
+        ),
+    ]
+
+
+def explain(conn, statement):
+    """返回 (使用的索引名列表, 执行计划行)"""
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).mappings().all()
+        used = []
+        for row in rows:
+            detail = row["detail"]
+            if " INDEX " in detail:
+                used.append(detail.split(" INDEX ", 1)[1].split(" ", 1)[0])
+        return used, rows
+    rows = conn.execute(text(f"EXPLAIN {sql}")).mappings().all()
+    return [row["key"] for row in rows if row["key"]], rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查热点查询是否使用了预期的索引")
+    parser.add_argument("--verbose", action="store_true", help="打印完整执行计划")
+    args = parser.parse_args()
+
+    failures = 0
+    with db_manager.get_engine().connect() as conn:
+        for name, statement, expected in hot_queries(conn):
+            used, rows = explain(conn, statement)
+            ok = any(index in expected for index in used)
+            failures += not ok
+            print(f"[{'OK' if ok else 'FAIL'}] {name}")
+            print(f"       预期索引: {' / '.join(expected)}    实际使用: {', '.join(used) or '无（全表扫描）'}")
+            if args.verbose or not ok:
+                for row in rows:
+                    print(f"       {dict(row)}")
+    print(f"\n共 {failures} 个查询未使用预期索引" if failures else "\n所有热点查询均使用了预期索引")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
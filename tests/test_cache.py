@@ -0,0 +1,186 @@
+"""
+缓存管理器（app.cache）：进程内LRU、命名空间代数、标签失效，以及 cache_result 的单飞与过期后台刷新
+Redis 使用 fakeredis。
+"""
+import asyncio
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app import cache  # noqa: E402
+from app.cache import CacheManager, LocalLRUCache, cache_manager, cache_result, make_cache_key  # noqa: E402
+from app.database import redis_manager  # noqa: E402
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(redis_manager, "_binary_client", fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(cache_manager, "local", LocalLRUCache(100))
+    monkeypatch.setattr(cache_manager, "local_ttls", {"hot": 60})
+    monkeypatch.setattr(cache_manager, "_ns_generations", {})
+    return redis
+
+
+# ==================== 进程内LRU ====================
+
+def test_lru_evicts_least_recently_used():
+    lru = LocalLRUCache(2)
+    lru.set("a", "ns", 1, 60)
+    lru.set("b", "ns", 2, 60)
+    assert lru.get("a") == 1
+    lru.set("c", "ns", 3, 60)
+    assert lru.get("b", None) is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert len(lru) == 2
+
+
+def test_lru_expired_entry_is_a_miss():
+    lru = LocalLRUCache(2)
+    lru.set("a", "ns", 1, -1)
+    assert lru.get("a", None) is None
+    assert len(lru) == 0
+
+
+def test_lru_generation_bump_invalidates_namespace():
+    lru = LocalLRUCache(10)
+    lru.set("a", "ns", 1, 60)
+    lru.set("b", "other", 2, 60)
+    lru.bump("ns")
+    assert lru.get("a", None) is None
+    assert lru.get("b") == 2
+
+
+def test_lru_entry_loaded_before_bump_is_discarded():
+    lru = LocalLRUCache(10)
+    generation = lru.generation("ns")
+    # 读取数据源期间命名空间被清除
+    lru.bump("ns")
+    lru.set("a", "ns", "stale", 60, generation)
+    assert lru.get("a", None) is None
+
+
+# ==================== 两级缓存 ====================
+
+def test_local_tier_serves_hits_until_delete(redis):
+    cache_manager.set("hot:k", {"v": 1})
+    assert cache_manager.get("hot:k") == {"v": 1}
+    # 一级缓存命中时不访问Redis
+    redis.delete("hot:k")
+    assert cache_manager.get("hot:k") == {"v": 1}
+
+    cache_manager.delete("hot:k")
+    assert cache_manager.get("hot:k") is None
+
+
+# ==================== 批量失效 ====================
+
+def test_namespace_generation_bump(redis):
+    assert cache_manager.namespaced_key("list", "p1") == "list:g0:p1"
+    other_worker = CacheManager()
+    assert other_worker.namespaced_key("list", "p1") == "list:g0:p1"
+
+    assert cache_manager.bump_namespace("list") == 1
+    assert cache_manager.namespaced_key("list", "p1") == "list:g1:p1"
+    # 其它worker收到失效消息后丢弃进程内的代数副本
+    other_worker.invalidate_local("gen:list")
+    assert other_worker.namespaced_key("list", "p1") == "list:g1:p1"
+
+
+def test_invalidate_tag_deletes_only_tagged_keys(redis):
+    cache_manager.set("item:1", 1, tags=["user:1"])
+    cache_manager.set("item:2", 2, tags=["user:1", "user:2"])
+    cache_manager.set("item:3", 3, tags=["user:2"])
+    assert cache_manager.invalidate_tag("user:1") == 2
+    assert cache_manager.get_many(["item:1", "item:2", "item:3"]) == {"item:1": None, "item:2": None, "item:3": 3}
+    assert not redis.exists(cache.TAG_PREFIX + "user:1")
+
+
+def test_clear_pattern_scans_matching_keys(redis):
+    cache_manager.set_many({f"page:{i}": i for i in range(5)})
+    cache_manager.set("keep:1", 1)
+    assert cache_manager.clear_pattern("page:*") == 5
+    assert cache_manager.get("keep:1") == 1
+
+
+def test_clear_all_keeps_state_keys(redis):
+    cache_manager.set("api_state:1", {"is_active": True}, tags=["api:1"])
+    cache_manager.set("webconfig:site", "name")
+    redis.set("token:admin", "jwt")
+    redis.hset("usage:counters", "a:1", 3)
+    redis.set("quota:1", 10)
+    assert cache_manager.clear_all() == 3
+    assert sorted(redis.keys()) == ["cache:invalidate:version", "quota:1", "token:admin", "usage:counters"]
+
+
+# ==================== cache_result ====================
+
+def test_cache_result_single_flight(redis):
+    calls = []
+
+    @cache_result(ttl=60, key_prefix="test")
+    async def load(item_id):
+        calls.append(item_id)
+        await asyncio.sleep(0.05)
+        return {"id": item_id}
+
+    async def main():
+        return await asyncio.gather(*(load(1) for _ in range(5)))
+
+    assert asyncio.run(main()) == [{"id": 1}] * 5
+    assert calls == [1]
+    assert asyncio.run(load(1)) == {"id": 1}
+    assert calls == [1]
+
+
+def test_cache_result_serves_stale_and_refreshes(redis):
+    calls = []
+
+    @cache_result(ttl=60, key_prefix="test", stale_ttl=60)
+    async def load(item_id):
+        calls.append(item_id)
+        return "new"
+
+    key = make_cache_key("test", load, (1,), {})
+    cache_manager.set(key, {"value": "old", "fresh_until": time.time() - 1}, 60)
+
+    async def main():
+        result = await load(1)
+        await asyncio.gather(*cache._inflight.values())
+        return result
+
+    assert asyncio.run(main()) == "old"
+    assert calls == [1]
+    assert cache_manager.get(key)["value"] == "new"
+
+
+def test_cache_key_is_stable_and_order_independent():
+    async def func(a, b=None):
+        return None
+
+    assert make_cache_key("p", func, (1,), {"b": {"x": 1, "y": 2}}) == \
+        make_cache_key("p", func, (1,), {"b": {"y": 2, "x": 1}})
+    assert make_cache_key("p", func, ({3, 1, 2},), {}) == make_cache_key("p", func, ({2, 1, 3},), {})
+
+
+def test_cache_result_rejects_unstable_arguments(redis):
+    class Session:
+        pass
+
+    @cache_result(ttl=60, key_prefix="test")
+    async def load(db, item_id):
+        return item_id
+
+    with pytest.raises(TypeError):
+        asyncio.run(load(Session(), 1))
+
+    @cache_result(ttl=60, key_prefix="test", key_func=lambda db, item_id: item_id)
+    async def load_by_id(db, item_id):
+        return item_id
+
+    assert asyncio.run(load_by_id(Session(), 1)) == 1
@@ -0,0 +1,59 @@
+"""
+API调用次数分片计数（app.utils.call_counter）：分片冲突时累加，合并回 apis.call_count 后删除分片
+数据库使用内存SQLite（INSERT ... ON CONFLICT DO UPDATE；MySQL 为 ON DUPLICATE KEY UPDATE）。
+"""
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base, db_manager
+from app.admin import models
+from app.utils import call_counter
+
+
+@pytest.fixture
+def Session(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(db_manager, "get_engine", lambda: engine)
+    Session = sessionmaker(bind=engine)
+    db = Session()
+    db.add(models.API(id=1, title="IP", alias="ip", endpoint="/api/ip", method="GET", call_count=5))
+    db.commit()
+    db.close()
+    yield Session
+    engine.dispose()
+
+
+def _shards(Session):
+    db = Session()
+    try:
+        Counter = models.APICallCounter
+        return dict(db.execute(select(Counter.shard, Counter.count).where(Counter.api_id == 1)).all())
+    finally:
+        db.close()
+
+
+def test_add_accumulates_on_shard_conflict(Session, monkeypatch):
+    monkeypatch.setattr(call_counter, "SHARDS", 1)
+    db = Session()
+    call_counter.add(db, {1: 2})
+    call_counter.increment(db, 1)
+    db.commit()
+    assert _shards(Session) == {0: 3}
+    assert db.scalar(call_counter.total_calls_sum()) == 8
+    db.close()
+
+
+def test_compact_merges_shards_into_apis(Session):
+    db = Session()
+    for _ in range(10):
+        call_counter.increment(db, 1)
+    db.commit()
+    db.close()
+
+    assert call_counter.compact_call_counters() == 1
+    assert _shards(Session) == {}
+    db = Session()
+    assert db.get(models.API, 1).call_count == 15
+    db.close()
@@ -0,0 +1,62 @@
+"""
+缓存值编解码（app.utils.codec）：带类型字节的往返、压缩，以及升级前写入的旧格式值
+"""
+import json
+import zlib
+
+import pytest
+from app.utils import codec
+
+
+@pytest.mark.parametrize("value", [
+    "文本", "", 0, -12345678901234567890, 3.5, True, False,
+    {"a": 1, "b": [1, 2, None], "c": {"d": "中文"}}, [1, "2", 3.0],
+])
+def test_round_trip(value):
+    raw = codec.encode(value)
+    assert raw[0] < 0x20
+    decoded = codec.decode(raw)
+    assert decoded == value
+    assert type(decoded) is type(value)
+
+
+def test_tuple_and_int_keys_decode_as_json():
+    assert codec.decode(codec.encode((1, 2))) == [1, 2]
+    assert codec.decode(codec.encode({1: "a"})) == {"1": "a"}
+
+
+def test_large_values_are_compressed(monkeypatch):
+    monkeypatch.setattr(codec, "COMPRESS_THRESHOLD", 64)
+    value = {"items": ["重复的内容"] * 100}
+    raw = codec.encode(value)
+    assert raw[0] >> 3 != codec.NONE
+    assert len(raw) < len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    assert codec.decode(raw) == value
+
+    # 未达到阈值时不压缩
+    assert codec.encode("short")[0] >> 3 == codec.NONE
+
+
+def test_reads_zlib_written_by_other_workers():
+    payload = zlib.compress(b'{"a":1}')
+    assert codec.decode(bytes((codec.ZLIB << 3 | codec.JSON,)) + payload) == {"a": 1}
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (b'{"a": 1}', {"a": 1}),
+    (b"[1, 2]", [1, 2]),
+    (b"42", 42),
+    (b"plain text", "plain text"),
+    ('{"a": 1}', {"a": 1}),
+    (b"", ""),
+    (None, None),
+])
+def test_legacy_values_without_header(raw, expected):
+    assert codec.decode(raw) == expected
+
+
+def test_unsupported_compression_raises(monkeypatch):
+    # 其它worker用本进程未安装的库压缩
+    monkeypatch.setattr(codec, "_DECOMPRESS", {codec.ZLIB: zlib.decompress})
+    with pytest.raises(ValueError):
+        codec.decode(bytes((codec.ZSTD << 3 | codec.STR,)) + b"data")
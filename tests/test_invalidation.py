@@ -0,0 +1,104 @@
+"""
+缓存失效总线（app.utils.invalidation）：乱序或仍在路上的消息不触发全量清除，确实丢失时才清除
+"""
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.database import redis_manager  # noqa: E402
+from app.utils import invalidation  # noqa: E402
+
+
+@pytest.fixture
+def flushes(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(invalidation, "_last_version", None)
+    monkeypatch.setattr(invalidation, "_received_ahead", set())
+    monkeypatch.setattr(invalidation, "_check_target", 0)
+    calls = []
+    monkeypatch.setattr(invalidation, "_apply_all", lambda: calls.append(invalidation._last_version))
+
+    redis.set(invalidation.VERSION_KEY, 10)
+    # 订阅之前的周期检查不建立基准
+    invalidation.check_version()
+    assert invalidation._last_version is None
+    # listen() 订阅频道后以当前版本为基准
+    invalidation._reset_version(10)
+    return redis, calls
+
+
+def test_out_of_order_messages_advance_watermark(flushes):
+    redis, calls = flushes
+    invalidation._on_version(12)
+    assert invalidation._last_version == 10
+    invalidation._on_version(11)
+    assert invalidation._last_version == 12
+    assert not invalidation._received_ahead
+    assert not calls
+
+
+def test_in_flight_messages_do_not_flush(flushes):
+    redis, calls = flushes
+    redis.set(invalidation.VERSION_KEY, 13)
+    invalidation.check_version()
+    # 检查之后消息才到达
+    for version in (11, 13, 12):
+        invalidation._on_version(version)
+    invalidation.check_version()
+    assert not calls
+    assert invalidation._last_version == 13
+
+
+def test_lost_message_flushes_after_one_interval(flushes):
+    redis, calls = flushes
+    redis.set(invalidation.VERSION_KEY, 13)
+    invalidation.check_version()
+    invalidation._on_version(11)
+    invalidation._on_version(13)
+    assert not calls
+
+    # 版本12到下一次检查仍未收到
+    redis.set(invalidation.VERSION_KEY, 15)
+    invalidation.check_version()
+    assert len(calls) == 1
+    assert invalidation._last_version == 13
+
+    # 14、15 在本次检查后到达，不再触发清除
+    invalidation._on_version(14)
+    invalidation._on_version(15)
+    invalidation.check_version()
+    assert len(calls) == 1
+
+
+def test_listen_sets_baseline_before_first_message(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_manager, "_redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(redis_manager, "_async_client", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(invalidation, "_last_version", None)
+    monkeypatch.setattr(invalidation, "_received_ahead", set())
+    monkeypatch.setattr(invalidation, "_check_target", 0)
+    calls = []
+    monkeypatch.setattr(invalidation, "_apply_all", lambda: calls.append(invalidation._last_version))
+
+    async def main():
+        task = asyncio.ensure_future(invalidation.listen())
+        while invalidation._last_version is None:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    # 尚未发布过任何事件（版本号键不存在）时基准为0
+    asyncio.run(main())
+    assert invalidation._last_version == 0
+
+    # 订阅后第一条消息（版本1）丢失，收到版本2：下一次检查记下目标，再下一次仍未收到时清除
+    invalidation._on_version(2)
+    redis = redis_manager.get_client()
+    redis.set(invalidation.VERSION_KEY, 2)
+    invalidation.check_version()
+    invalidation.check_version()
+    assert calls == [0]
+    assert invalidation._last_version == 2
@@ -0,0 +1,79 @@
+"""
+API密钥过滤（app.utils.key_filter）：布隆过滤器、其它worker新签发密钥的“最近签发”集合回查与负缓存
+Redis 使用 fakeredis，数据库使用内存SQLite。
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from app.cache import LocalLRUCache  # noqa: E402
+from app.database import Base, db_manager, redis_manager  # noqa: E402
+from app.admin import models  # noqa: E402
+from app.utils import key_filter  # noqa: E402
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(db_manager, "create_session", Session)
+    monkeypatch.setattr(key_filter, "_filter", None)
+    monkeypatch.setattr(key_filter, "_negative", LocalLRUCache(100))
+
+    db = Session()
+    db.add(models.Subscription(
+        user_id=1, api_id=1, api_key="issued-key",
+        start_date=datetime.utcnow(), end_date=datetime.utcnow() + timedelta(days=30)
+    ))
+    db.commit()
+    db.close()
+    yield redis
+    engine.dispose()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = key_filter.BloomFilter(1000, 0.01)
+    keys = [f"key-{i}" for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_unbuilt_filter_does_not_reject(redis):
+    assert key_filter.might_exist("anything")
+
+
+def test_rebuild_loads_issued_keys(redis):
+    assert key_filter.rebuild() == 1
+    assert key_filter.might_exist("issued-key")
+    assert not key_filter.might_exist("forged-key")
+    # 判定为未知后进入负缓存，不再查询Redis
+    redis.zadd(key_filter.RECENT_KEY, {"forged-key": 0})
+    assert not key_filter.might_exist("forged-key")
+
+
+def test_key_issued_by_other_worker_found_in_recent_set(redis):
+    key_filter.rebuild()
+    # 其它worker签发：只登记到Redis的最近签发集合，本进程过滤器中没有
+    redis.zadd(key_filter.RECENT_KEY, {"new-key": 1})
+    assert key_filter.might_exist("new-key")
+    assert "new-key" in key_filter._filter
+
+
+def test_add_clears_negative_cache(redis):
+    key_filter.rebuild()
+    key_filter.mark_unknown("rotated-key")
+    assert not key_filter.might_exist("rotated-key")
+    key_filter.add("rotated-key")
+    assert key_filter.might_exist("rotated-key")
+    assert redis.zscore(key_filter.RECENT_KEY, "rotated-key") is not None
@@ -0,0 +1,58 @@
+"""
+密钥主体缓存（app.utils.key_principal）：回源期间发生失效时不把旧数据写回缓存
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from app.database import Base, redis_manager  # noqa: E402
+from app.admin import models  # noqa: E402
+from app.utils import key_principal  # noqa: E402
+
+
+@pytest.fixture
+def env(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis_manager, "_redis_client", fakeredis.FakeRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(redis_manager, "_binary_client", fakeredis.FakeRedis(server=server))
+    key_principal._local_principals.clear()
+
+    db = Session()
+    db.add(models.Subscription(
+        user_id=1, api_id=1, api_key="test-key", remaining_calls=10,
+        start_date=datetime.utcnow(), end_date=datetime.utcnow() + timedelta(days=30)
+    ))
+    db.commit()
+    yield db
+    db.close()
+    key_principal._local_principals.clear()
+    engine.dispose()
+
+
+def test_principal_is_cached(env):
+    principal = key_principal.get_principal(env, "test-key")
+    assert principal.remaining_calls == 10
+    assert redis_manager.get_binary_client().exists(key_principal._principal_key("test-key"))
+
+
+def test_invalidation_during_load_skips_store(env, monkeypatch):
+    load = key_principal.load_principal
+
+    def load_then_invalidate(db, api_key):
+        principal = load(db, api_key)
+        # 查询数据库之后、写入缓存之前，其它请求修改了订阅并使缓存失效
+        key_principal.invalidate_subscription(principal.subscription_id)
+        return principal
+
+    monkeypatch.setattr(key_principal, "load_principal", load_then_invalidate)
+    assert key_principal.get_principal(env, "test-key") is not None
+    assert not redis_manager.get_binary_client().exists(key_principal._principal_key("test-key"))
+    assert key_principal._local_principals.get("test-key", None) is None
@@ -0,0 +1,50 @@
+"""
+延迟直方图（app.utils.latency）：增量刷写到Redis后合并查询，刷写失败时增量放回缓冲
+Redis 使用 fakeredis。
+"""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.database import redis_manager  # noqa: E402
+from app.utils import latency  # noqa: E402
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(latency, "_pending", {})
+    return redis
+
+
+class _UnavailableRedis:
+    def pipeline(self, **kwargs):
+        raise ConnectionError("Redis不可用")
+
+
+def test_flush_merges_into_redis(redis):
+    for value in (1.0, 2.0, 3.0):
+        latency.record("ip", "total", value)
+    assert latency.flush_histograms() == 1
+    assert not latency._pending
+
+    latency.record("ip", "total", 10.0)
+    latency.flush_histograms()
+    stats = latency.get_histograms(1)["ip"]["total"]
+    assert stats["count"] == 4
+    assert stats["max_ms"] == 10.0
+
+
+def test_failed_flush_keeps_samples(redis, monkeypatch):
+    latency.record("ip", "total", 5.0)
+    monkeypatch.setattr(redis_manager, "_redis_client", _UnavailableRedis())
+    assert latency.flush_histograms() == 0
+    # 刷写失败期间新记录的样本与放回的增量合并
+    latency.record("ip", "total", 7.0)
+
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    assert latency.flush_histograms() == 1
+    stats = latency.get_histograms(1)["ip"]["total"]
+    assert stats["count"] == 2
+    assert stats["max_ms"] == 7.0
@@ -0,0 +1,116 @@
+"""
+订阅配额（app.utils.quota）：Redis Lua扣减 + 按增量对账
+Redis 使用 fakeredis（需要 lupa 执行Lua脚本），数据库使用内存SQLite。
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from sqlalchemy import create_engine, update  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from app.database import Base, db_manager, redis_manager  # noqa: E402
+from app.admin import models  # noqa: E402
+from app.utils import quota, usage_counter  # noqa: E402
+
+
+@pytest.fixture
+def env(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(db_manager, "create_session", Session)
+    monkeypatch.setattr(quota, "_consume_script", None)
+    monkeypatch.setattr(quota, "_reset_script", None)
+    monkeypatch.setattr(usage_counter, "_snapshot_script", None)
+    monkeypatch.setattr(quota, "_changed", set())
+
+    db = Session()
+    subscription = models.Subscription(
+        user_id=1, api_id=1, api_key="test-key", remaining_calls=10,
+        start_date=datetime.utcnow(), end_date=datetime.utcnow() + timedelta(days=30)
+    )
+    db.add(subscription)
+    db.commit()
+    subscription_id = subscription.id
+    db.close()
+    yield Session, redis, subscription_id
+    engine.dispose()
+
+
+def _db_remaining(Session, subscription_id):
+    db = Session()
+    try:
+        return db.get(models.Subscription, subscription_id).remaining_calls
+    finally:
+        db.close()
+
+
+def test_consume_is_reconciled_as_delta(env):
+    Session, redis, sid = env
+    assert quota.consume(sid, 10) == (True, 9)
+    assert quota.consume(sid, 10, cost=2) == (True, 7)
+    assert _db_remaining(Session, sid) == 10
+
+    assert quota.reconcile_quotas() == 1
+    assert _db_remaining(Session, sid) == 7
+    assert not redis.exists(quota.DELTAS_KEY)
+    assert not redis.smembers(quota.PENDING_SET_KEY)
+
+    # 没有新的扣减时重复对账不改变数据库
+    quota.reconcile_quotas()
+    assert _db_remaining(Session, sid) == 7
+
+
+def test_consume_rejects_when_exhausted(env):
+    Session, redis, sid = env
+    assert quota.consume(sid, 10, cost=10) == (True, 0)
+    assert quota.consume(sid, 10) == (False, 0)
+    quota.reconcile_quotas()
+    assert _db_remaining(Session, sid) == 0
+
+
+def test_mysql_side_change_survives_reconcile(env):
+    Session, redis, sid = env
+    quota.consume(sid, 10)
+    quota.consume(sid, 10)
+
+    # Redis不可用时的回退路径：直接扣减数据库并登记
+    db = Session()
+    db.execute(update(models.Subscription).where(models.Subscription.id == sid).values(remaining_calls=9))
+    db.commit()
+    db.close()
+    quota.mark_changed(sid)
+
+    quota.reconcile_quotas()
+    # 数据库：10 - 1（直接扣减）- 2（Redis增量），Redis配额按数据库值重置
+    assert _db_remaining(Session, sid) == 7
+    assert int(redis.get(quota._quota_key(sid))) == 7
+    assert quota.consume(sid, 7) == (True, 6)
+
+
+def test_reset_subtracts_unreconciled_deltas(env):
+    Session, redis, sid = env
+    quota.consume(sid, 10)
+    quota.consume(sid, 10)
+    # 一部分增量已转为待对账批次，一部分仍在增量哈希中
+    usage_counter.snapshot_to_pending(quota.DELTAS_KEY, quota.PENDING_PREFIX, quota.PENDING_SET_KEY)
+    quota.consume(sid, 10)
+
+    assert quota.reset(sid, 10)
+    assert int(redis.get(quota._quota_key(sid))) == 7
+
+    assert quota.reset(sid, None)
+    assert not redis.exists(quota._quota_key(sid))
+
+
+def test_replayed_batch_is_skipped(env):
+    Session, redis, sid = env
+    assert quota._apply_deltas("batch-1", {sid: 3})
+    assert not quota._apply_deltas("batch-1", {sid: 3})
+    assert _db_remaining(Session, sid) == 7
@@ -0,0 +1,83 @@
+"""
+频率限制（app.utils.rate_limiter）：GCRA Lua脚本一次检查多个桶，任一桶超限时不消耗其它桶
+Redis 使用 fakeredis（需要 lupa 执行Lua脚本）。
+"""
+from types import SimpleNamespace
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from fastapi import HTTPException  # noqa: E402
+from app.database import redis_manager  # noqa: E402
+from app.utils import rate_limiter  # noqa: E402
+
+IP_BUCKET = "ratelimit:ip:10.0.0.1"
+KEY_BUCKET = "ratelimit:api:1:key:test-key"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(rate_limiter, "_gcra_script", None)
+    monkeypatch.setattr(rate_limiter, "IP_LIMIT_PER_MINUTE", 100)
+    return redis
+
+
+def _request(ip="10.0.0.1"):
+    return SimpleNamespace(client=SimpleNamespace(host=ip), headers={}, state=SimpleNamespace())
+
+
+def test_burst_up_to_limit_then_deny(redis):
+    buckets = [(KEY_BUCKET, 2)]
+    assert rate_limiter._check(buckets)[0] == 1
+    assert rate_limiter._check(buckets)[0] == 1
+    allowed, index, remaining, retry_after, _ = rate_limiter._check(buckets)
+    assert (allowed, index, remaining) == (0, 1, 0)
+    assert 0 < retry_after <= 30000
+
+
+def test_denial_does_not_consume_other_buckets(redis):
+    buckets = [(IP_BUCKET, 100), (KEY_BUCKET, 2)]
+    rate_limiter._check(buckets)
+    rate_limiter._check(buckets)
+    ip_tat = redis.get(IP_BUCKET)
+    key_tat = redis.get(KEY_BUCKET)
+
+    allowed, index, *_ = rate_limiter._check(buckets)
+    assert (allowed, index) == (0, 2)
+    assert redis.get(IP_BUCKET) == ip_tat
+    assert redis.get(KEY_BUCKET) == key_tat
+
+
+def test_remaining_reports_tightest_bucket(redis):
+    allowed, index, remaining, _, reset = rate_limiter._check([(IP_BUCKET, 100), (KEY_BUCKET, 5)])
+    assert (allowed, index, remaining) == (1, 2, 4)
+    assert reset > 0
+
+
+def test_enforce_raises_429_with_retry_after(redis):
+    request = _request()
+    headers = rate_limiter.enforce_rate_limit(request, 1, "test-key", 1)
+    assert headers["X-RateLimit-Limit"] == "1"
+    assert request.state.rate_limit_headers == headers
+
+    with pytest.raises(HTTPException) as exc:
+        rate_limiter.enforce_rate_limit(request, 1, "test-key", 1)
+    assert exc.value.status_code == 429
+    assert int(exc.value.headers["Retry-After"]) > 0
+
+    # 同一IP的其它密钥不受影响
+    assert rate_limiter.enforce_rate_limit(_request(), 1, "other-key", 1)
+
+
+class _UnavailableRedis:
+    def register_script(self, script):
+        raise ConnectionError("Redis不可用")
+
+
+def test_redis_unavailable_allows_request(redis, monkeypatch):
+    monkeypatch.setattr(redis_manager, "_redis_client", _UnavailableRedis())
+    assert rate_limiter.enforce_rate_limit(_request(), 1, "test-key", 1) == {}
@@ -0,0 +1,117 @@
+"""
+调用计数缓冲（app.utils.usage_counter）：Redis快照转批次 + 按批次ID幂等刷写
+Redis 使用 fakeredis（需要 lupa 执行Lua脚本），数据库使用内存SQLite。
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from app.database import Base, db_manager, redis_manager  # noqa: E402
+from app.admin import models  # noqa: E402
+from app.utils import call_counter, usage_counter  # noqa: E402
+
+
+@pytest.fixture
+def env(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(redis_manager, "_redis_client", redis)
+    monkeypatch.setattr(db_manager, "create_session", Session)
+    monkeypatch.setattr(usage_counter, "_snapshot_script", None)
+
+    db = Session()
+    db.add(models.API(id=1, title="IP", alias="ip", endpoint="/api/ip", method="GET"))
+    subscription = models.Subscription(
+        user_id=1, api_id=1, api_key="test-key", used_calls=0,
+        start_date=datetime.utcnow(), end_date=datetime.utcnow() + timedelta(days=30)
+    )
+    db.add(subscription)
+    db.commit()
+    subscription_id = subscription.id
+    db.close()
+    yield Session, redis, subscription_id
+    engine.dispose()
+
+
+def _db_api_calls(Session, api_id):
+    db = Session()
+    try:
+        return db.scalar(select(call_counter.total_calls_expr()).where(models.API.id == api_id))
+    finally:
+        db.close()
+
+
+def _db_used(Session, subscription_id):
+    db = Session()
+    try:
+        return db.get(models.Subscription, subscription_id).used_calls
+    finally:
+        db.close()
+
+
+def test_incr_call_accumulates_in_redis(env):
+    Session, redis, sid = env
+    assert usage_counter.incr_call(1, sid)
+    assert usage_counter.incr_call(1, sid)
+    assert usage_counter.incr_call(2)
+    assert redis.hgetall(usage_counter.COUNTERS_KEY) == {"a:1": "2", f"s:{sid}": "2", "a:2": "1"}
+    assert _db_used(Session, sid) == 0
+
+
+def test_snapshot_moves_counters_to_pending_batch(env):
+    Session, redis, sid = env
+    assert usage_counter.snapshot_to_pending(
+        usage_counter.COUNTERS_KEY, usage_counter.PENDING_PREFIX, usage_counter.PENDING_SET_KEY
+    ) is None
+
+    usage_counter.incr_call(1, sid)
+    batch_id = usage_counter.snapshot_to_pending(
+        usage_counter.COUNTERS_KEY, usage_counter.PENDING_PREFIX, usage_counter.PENDING_SET_KEY
+    )
+    assert batch_id
+    assert not redis.exists(usage_counter.COUNTERS_KEY)
+    assert redis.smembers(usage_counter.PENDING_SET_KEY) == {batch_id}
+    assert redis.hgetall(usage_counter.PENDING_PREFIX + batch_id) == {"a:1": "1", f"s:{sid}": "1"}
+
+    # 快照之后的调用累加到新的计数哈希，不会并入已转出的批次
+    usage_counter.incr_call(1, sid)
+    assert redis.hgetall(usage_counter.COUNTERS_KEY) == {"a:1": "1", f"s:{sid}": "1"}
+
+
+def test_flush_writes_counts_and_clears_batches(env):
+    Session, redis, sid = env
+    for _ in range(3):
+        usage_counter.incr_call(1, sid)
+
+    assert usage_counter.flush_usage_counters() == 1
+    assert _db_used(Session, sid) == 3
+    assert _db_api_calls(Session, 1) == 3
+    assert not redis.exists(usage_counter.COUNTERS_KEY)
+    assert not redis.smembers(usage_counter.PENDING_SET_KEY)
+
+    assert usage_counter.flush_usage_counters() == 0
+    assert _db_used(Session, sid) == 3
+
+
+def test_committed_batch_is_not_applied_twice(env):
+    Session, redis, sid = env
+    usage_counter.incr_call(1, sid, amount=2)
+    batch_id = usage_counter.snapshot_to_pending(
+        usage_counter.COUNTERS_KEY, usage_counter.PENDING_PREFIX, usage_counter.PENDING_SET_KEY
+    )
+    # 上一次刷写已提交，但在清理Redis之前进程崩溃
+    assert usage_counter._apply_batch(batch_id, {1: 2}, {sid: 2})
+    assert _db_used(Session, sid) == 2
+
+    assert usage_counter.flush_usage_counters() == 1
+    assert _db_used(Session, sid) == 2
+    assert _db_api_calls(Session, 1) == 2
+    assert not redis.smembers(usage_counter.PENDING_SET_KEY)
@@ -0,0 +1,69 @@
+"""
+调用量时间分桶汇总（app.utils.usage_rollup）：多次刷写累加到同一分桶行，刷写失败时放回缓冲
+数据库使用内存SQLite（INSERT ... ON CONFLICT DO UPDATE；MySQL 为 ON DUPLICATE KEY UPDATE）。
+"""
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base, db_manager
+from app.admin import models
+from app.utils import usage_rollup
+
+MOMENT = datetime(2026, 1, 1, 12, 30, 15, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def Session(monkeypatch):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(db_manager, "create_session", Session)
+    monkeypatch.setattr(usage_rollup, "_pending", {})
+    yield Session
+    engine.dispose()
+
+
+def _event(status_code=200, subscription_id=7):
+    return SimpleNamespace(
+        api_id=1, subscription_id=subscription_id, status_code=status_code,
+        latency_ms=10.0, response_bytes=100, created_at=MOMENT
+    )
+
+
+def test_flushes_accumulate_into_bucket_rows(Session):
+    usage_rollup.record(_event())
+    usage_rollup.record(_event(status_code=500))
+    # 3 种粒度 × (整体汇总 + 订阅汇总)
+    assert usage_rollup.flush_rollups() == 6
+    usage_rollup.record(_event(subscription_id=None))
+    assert usage_rollup.flush_rollups() == 3
+
+    db = Session()
+    since = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for granularity in usage_rollup.GRANULARITIES:
+        totals = usage_rollup.get_totals(db, since, granularity)
+        assert (totals["total_calls"], totals["success_calls"], totals["error_calls"]) == (3, 2, 1)
+        assert totals["response_bytes"] == 300
+    assert usage_rollup.get_by_api(db, since, subscription_id=7)[1]["total_calls"] == 2
+    assert db.query(models.APIUsageRollup).count() == 6
+    db.close()
+
+
+def test_failed_flush_restores_pending(Session):
+    table = models.APIUsageRollup.__table__
+    bind = Session().get_bind()
+    usage_rollup.record(_event())
+    table.drop(bind)
+    assert usage_rollup.flush_rollups() == 0
+
+    table.create(bind)
+    usage_rollup.record(_event())
+    assert usage_rollup.flush_rollups() == 6
+    db = Session()
+    since = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert usage_rollup.get_totals(db, since)["total_calls"] == 2
+    db.close()
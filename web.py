@@ -1,20 +1,15 @@
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
-from app.database import init_db, health_check as db_health_check
+from app.database import ReadYourWritesMiddleware, init_db, db_manager, redis_manager, health_check as db_health_check
 from app.admin.api import router as admin_router
 from app.user.api import router as user_router
 from app.index.api import router as index_router
-from apis.bing.api import router as bing_router
-from apis.ip.api import router as ip_router
-from apis.yiyan.api import router as yiyan_router
-from apis.siteinfo.api import router as siteinfo_router
-from apis.tcaptcha.api import router as tcaptcha_router
-from apis.wyy_music.api import router as wyy_music_router
-from apis.word.api import router as word_router
 from app.config import config
+from app.auth import get_metrics_access
+from app.utils import api_registry, background, call_counter, call_log, concurrency, gateway, invalidation, key_filter, latency, metrics, pagination, quota, usage_counter, usage_rollup
 import logging
 import os
 from datetime import datetime
@@ -46,6 +41,64 @@ async def lifespan(app: FastAPI):
     try:
         # 初始化数据库
         init_db()
+        
+        # 跨worker缓存失效总线（订阅 + 版本号兜底检查）
+        background.start_task("invalidation_listener", invalidation.listen())
+        background.start_periodic(
+            "invalidation_version_check", invalidation.VERSION_CHECK_INTERVAL, invalidation.check_version
+        )
+        
+        # 按别名绑定API包与数据库记录（API变更由失效总线通知刷新，周期任务兜底）
+        api_registry.refresh()
+        background.start_periodic(
+            "api_registry_refresh", api_registry.REFRESH_INTERVAL, api_registry.refresh
+        )
+        
+        # API密钥过滤器（拦截未签发的密钥），定期重建
+        key_filter.rebuild()
+        background.start_periodic(
+            "key_filter_rebuild", key_filter.REBUILD_INTERVAL, key_filter.rebuild
+        )
+        
+        # 分页总数缓存：合并已提交的新增/删除后使其失效
+        background.start_periodic(
+            "count_generation_flush", pagination.COUNT_BUMP_INTERVAL, pagination.flush_count_generations
+        )
+        
+        # 调用计数批量刷写（关闭时再刷写一次）
+        background.start_periodic(
+            "usage_flush", usage_counter.FLUSH_INTERVAL,
+            usage_counter.flush_usage_counters, run_on_stop=True
+        )
+        # API调用次数分片合并回 apis.call_count
+        background.start_periodic(
+            "call_counter_compact", call_counter.COMPACT_INTERVAL, call_counter.compact_call_counters
+        )
+        # 剩余调用次数对账
+        background.start_periodic(
+            "quota_reconcile", usage_counter.FLUSH_INTERVAL,
+            quota.reconcile_quotas, run_on_stop=True
+        )
+        
+        # 调用明细日志：后台线程批量写入，定期清理过期记录
+        call_log.start()
+        background.start_periodic(
+            "call_log_prune", call_log.PRUNE_INTERVAL, call_log.prune_call_logs
+        )
+        
+        # 调用量时间分桶汇总（关闭时再刷写一次），定期降采样压缩
+        background.start_periodic(
+            "usage_rollup_flush", usage_rollup.FLUSH_INTERVAL,
+            usage_rollup.flush_rollups, run_on_stop=True
+        )
+        background.start_periodic(
+            "usage_rollup_compact", usage_rollup.COMPACT_INTERVAL, usage_rollup.compact_rollups
+        )
+        
+        # 分阶段延迟直方图合并到Redis（关闭时再刷写一次）
+        background.start_periodic(
+            "latency_flush", latency.FLUSH_INTERVAL, latency.flush_histograms, run_on_stop=True
+        )
         logger.info("应用启动成功")
     except Exception as e:
         logger.error(f"应用启动失败: {e}")
@@ -55,6 +108,12 @@ async def lifespan(app: FastAPI):
     
     # 关闭事件
     logger.info("应用正在关闭...")
+    await gateway.drain_usage_events()
+    await background.stop_all()
+    call_log.stop()
+    await db_manager.dispose_async()
+    await redis_manager.close_async()
+    concurrency.shutdown()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -74,8 +133,24 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Retry-After"],
 )
 
+# 频率限制响应头（由 rate_limiter 写入 request.state，附加到开放API的响应上）
+@app.middleware("http")
+async def rate_limit_headers_middleware(request: Request, call_next):
+    response = await call_next(request)
+    headers = getattr(request.state, "rate_limit_headers", None)
+    if headers:
+        response.headers.update(headers)
+    return response
+
+# 写请求后短时间内固定读主库（配置了只读从库时生效）
+app.add_middleware(ReadYourWritesMiddleware)
+
+# 开放API计时与计量（响应发送后异步分发使用事件）
+app.add_middleware(gateway.GatewayMiddleware, prefix=gateway.API_PREFIX)
+
 # 挂载静态文件
 upload_dir = config.get('app.upload.upload_dir', 'uploads')
 if os.path.exists(upload_dir):
@@ -87,14 +162,8 @@ app.include_router(admin_router, prefix="/v/admin", tags=["后台管理"])
 app.include_router(user_router, prefix="/v/user", tags=["前台用户"])
 app.include_router(index_router, prefix="/v/index", tags=["首页"])
 
-# 第三方/对外开放 API 使用 /api/xxx
-app.include_router(bing_router, prefix="/api", tags=["API"])
-app.include_router(ip_router, prefix="/api", tags=["API"])
-app.include_router(yiyan_router, prefix="/api", tags=["API"])
-app.include_router(siteinfo_router, prefix="/api", tags=["API"])
-app.include_router(tcaptcha_router, prefix="/api", tags=["API"])
-app.include_router(wyy_music_router, prefix="/api", tags=["API"])
-app.include_router(word_router, prefix="/api", tags=["API"])
+# 第三方/对外开放 API 使用 /api/xxx（自动发现 apis/* 下的包，统一经过网关鉴权）
+api_registry.include_routers(app, prefix=gateway.API_PREFIX, dependencies=[Depends(gateway.api_gateway)])
 
 # 全局异常处理器
 @app.exception_handler(HTTPException)
@@ -109,6 +178,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         error_code = "NOT_FOUND"
     elif exc.status_code == 422:
         error_code = "VALIDATION_ERROR"
+    elif exc.status_code == 429:
+        error_code = "TOO_MANY_REQUESTS"
     
     return JSONResponse(
         status_code=exc.status_code,
@@ -117,7 +188,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "error_code": error_code,
             "message": exc.detail,
             "status_code": exc.status_code
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
@@ -134,6 +206,11 @@ async def general_exception_handler(request: Request, exc: Exception):
         }
     )
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(get_metrics_access)])
+async def metrics_endpoint():
+    """Prometheus 指标（本worker进程）"""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     """根路径"""
@@ -166,5 +243,8 @@ if __name__ == "__main__":
         host=host,
         port=port,
         reload=debug,
-        log_level=log_level.lower()
+        log_level=log_level.lower(),
+        # 只信任这些代理发来的 X-Forwarded-For（改写 request.client，限流按真实客户端IP计算）
+        proxy_headers=True,
+        forwarded_allow_ips=",".join(config.get('app.security.forwarded_allow_ips', ["127.0.0.1"]))
     )